@@ -0,0 +1,60 @@
+"""
+Microbenchmark of `CorrectionMap.apply` with a large set of corrections.
+
+Measures the per-item cost of an exact hit, a case-insensitive hit and a miss (the
+common case), plus compiling the map. Doesn't need a database.
+Usage: python -m benchmarks.corrections [-c CORRECTIONS] [-n NUMBER]
+"""
+
+import argparse
+import random
+import string
+import timeit
+
+from scrobbler.api.corrections import CorrectionMap
+
+
+def random_name(length=12):
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_corrections(count):
+    artists = [(random_name(), random_name()) for _ in range(count)]
+    tracks = [(new, random_name(), random_name()) for _, new in artists]
+    tags = [(random_name(6), random_name(6)) for _ in range(count // 10)]
+    return artists, tracks, tags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--corrections', type=int, default=10000,
+                        help='artist and track corrections each')
+    parser.add_argument('-n', '--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    artists, tracks, tags = make_corrections(args.corrections)
+
+    started_at = timeit.default_timer()
+    correction_map = CorrectionMap(artists, tracks, tags)
+    print('compile: {:.1f} ms for {} corrections'.format(
+        (timeit.default_timer() - started_at) * 1000, len(correction_map)))
+
+    artist, new_artist = random.choice(artists)
+    track = next(old for name, old, _ in tracks if name == new_artist)
+
+    cases = (
+        ('exact hit', {'artist': artist, 'track': track}),
+        ('casefolded hit', {'artist': artist.upper(), 'track': track.upper()}),
+        ('miss', {'artist': random_name(), 'track': random_name()}),
+    )
+
+    # `apply()` works in place, so every run gets a fresh copy of the item
+    baseline = min(timeit.repeat(lambda: dict(cases[0][1]), number=args.number, repeat=5))
+
+    for name, item in cases:
+        best = min(timeit.repeat(lambda: correction_map.apply(dict(item)), number=args.number, repeat=5))
+        print('{:15s} {:6.2f} us/item'.format(name, (best - baseline) / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
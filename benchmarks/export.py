@@ -0,0 +1,101 @@
+"""
+Streams a large history through the export and reports the throughput and the
+peak memory of the process, which should stay flat whatever the number of rows.
+
+The scrobbles are generated in the database with generate_series() for a dedicated
+user (the rollups aren't maintained for them) and kept for the next run unless --clean.
+
+Usage: python -m benchmarks.export [-n ROWS] [--naive] [--clean]
+"""
+
+import argparse
+import resource
+import time
+
+from sqlalchemy import text
+
+from benchmarks.helpers import delete_scrobbles, get_or_create_user
+from scrobbler.export import export
+from scrobbler.models import Scrobble
+from scrobbler.wsgi import app, db
+
+
+GENERATE_QUERY = '''
+    INSERT INTO scrobbles (user_id, created_at, played_at, artist, track, album, length)
+    SELECT
+        :user_id, now(), timestamp '2000-01-01' + g * interval '3 minutes',
+        'artist ' || g % 5000, 'track ' || g % 100000, 'album ' || g % 20000, interval '3 minutes'
+    FROM generate_series(:start, :stop - 1) AS g
+'''
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def generate(user, rows, chunk=500000):
+    existing = db.session.query(Scrobble).filter(Scrobble.user_id == user.id).count()
+
+    for start in range(existing, rows, chunk):
+        stop = min(start + chunk, rows)
+        db.session.execute(text(GENERATE_QUERY), {'user_id': user.id, 'start': start, 'stop': stop})
+        db.session.commit()
+        print('Generated {} / {} scrobbles'.format(stop, rows))
+
+    return max(existing, rows)
+
+
+def run(fmt, user):
+    rss_before = peak_rss_mb()
+    started_at = time.perf_counter()
+    size = 0
+
+    for chunk in export(fmt, user.id):
+        size += len(chunk)
+
+    elapsed = time.perf_counter() - started_at
+    return elapsed, size, peak_rss_mb() - rss_before
+
+
+def run_naive(user):
+    """ For comparison: the same rows loaded at once with .all(). """
+    rss_before = peak_rss_mb()
+    started_at = time.perf_counter()
+    rows = db.session.query(Scrobble).filter(Scrobble.user_id == user.id).all()
+    elapsed = time.perf_counter() - started_at
+    count = len(rows)
+    del rows
+    return elapsed, count, peak_rss_mb() - rss_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--rows', type=int, default=5000000)
+    parser.add_argument('--naive', action='store_true', help='also load all the rows with .all()')
+    parser.add_argument('--clean', action='store_true', help='delete the generated scrobbles')
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = get_or_create_user('export-benchmark')
+        rows = generate(user, args.rows)
+
+        print('{:8s} {:>10s} {:>10s} {:>10s} {:>14s}'.format(
+            'format', 'seconds', 'rows/s', 'MB', 'peak RSS +MB'))
+
+        for fmt in ('csv', 'ndjson'):
+            elapsed, size, rss = run(fmt, user)
+            print('{:8s} {:10.1f} {:10.0f} {:10.1f} {:14.1f}'.format(
+                fmt, elapsed, rows / elapsed, size / 1024.0 / 1024.0, rss))
+
+        if args.naive:
+            elapsed, count, rss = run_naive(user)
+            print('{:8s} {:10.1f} {:10.0f} {:>10s} {:14.1f}'.format(
+                '.all()', elapsed, count / elapsed, '', rss))
+
+        if args.clean:
+            delete_scrobbles(user)
+
+
+if __name__ == '__main__':
+    main()
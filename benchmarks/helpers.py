@@ -0,0 +1,85 @@
+"""
+Shared bits of the benchmark scripts.
+
+The benchmarks talk to the database configured in `scrobbler/config.py`,
+so point it to a scratch database before running them.
+"""
+
+import contextlib
+import random
+import string
+import time
+
+from sqlalchemy import event
+
+from scrobbler.api.helpers import md5
+from scrobbler.wsgi import app, db
+from scrobbler.models import Artist, Scrobble, Session, User
+
+
+class QueryCounter(object):
+    """ Counts the SQL statements sent by the app's engine. """
+
+    def __init__(self):
+        self.count = 0
+
+    def _callback(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    @contextlib.contextmanager
+    def __call__(self):
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', self._callback)
+        try:
+            yield self
+        finally:
+            event.remove(engine, 'before_cursor_execute', self._callback)
+
+
+def random_name(length=12):
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def get_or_create_user(username, password='benchmark'):
+    user = db.session.query(User).filter_by(username=username).first()
+    if user is None:
+        user = User(username=username, api_password=password, webui_password=password)
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+
+def create_session(user, token_id=None):
+    session_id = md5('{}-{}-{}'.format(user.username, token_id, time.time()))
+    db.session.add(Session(user_id=user.id, token_id=token_id, session_id=session_id))
+    db.session.commit()
+    return session_id
+
+
+def create_artists(names):
+    existing = {name for (name,) in db.session.query(Artist.name).filter(Artist.name.in_(names))}
+    for name in names:
+        if name not in existing:
+            db.session.add(Artist(name=name, local_playcount=0))
+    db.session.commit()
+
+
+def delete_scrobbles(user):
+    db.session.query(Scrobble).filter(Scrobble.user_id == user.id).delete()
+    db.session.commit()
+
+
+def submission(session_id, tracks, started_at):
+    """ Builds an Audioscrobbler 1.2 submission form out of (artist, track, album) tuples. """
+    form = {'s': session_id}
+    for i, (artist, track, album) in enumerate(tracks):
+        form['a[{}]'.format(i)] = artist
+        form['t[{}]'.format(i)] = track
+        form['b[{}]'.format(i)] = album
+        form['i[{}]'.format(i)] = str(started_at + i * 240)
+        form['l[{}]'.format(i)] = '240'
+        form['o[{}]'.format(i)] = 'P'
+        form['r[{}]'.format(i)] = ''
+        form['n[{}]'.format(i)] = ''
+        form['m[{}]'.format(i)] = ''
+    return form
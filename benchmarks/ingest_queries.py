@@ -0,0 +1,72 @@
+"""
+Counts SQL statements per `/protocol_1.2` submission with a cold and a warm
+artist/album id cache.
+
+Usage: python -m benchmarks.ingest_queries [-n SUBMISSIONS] [-s ITEMS]
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.helpers import (QueryCounter, create_artists, create_session, delete_scrobbles,
+                                get_or_create_user, random_name, submission)
+from scrobbler.api import ingest
+from scrobbler.wsgi import app
+
+
+def run(client, session_id, artists, submissions, items, cold):
+    counter = QueryCounter()
+    started_at = int(time.time()) - submissions * items * 240
+    elapsed = 0.0
+
+    with counter():
+        for n in range(submissions):
+            if cold:
+                ingest.artist_ids.clear()
+                ingest.album_ids.clear()
+
+            tracks = [
+                (random.choice(artists), random_name(), random_name())
+                for _ in range(items)
+            ]
+            form = submission(session_id, tracks, started_at + n * items * 240)
+
+            t0 = time.perf_counter()
+            response = client.post('/protocol_1.2', data=form)
+            elapsed += time.perf_counter() - t0
+            assert response.data.startswith(b'OK'), response.data
+
+    return counter.count / float(submissions), elapsed / submissions * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--submissions', type=int, default=200)
+    parser.add_argument('-s', '--items', type=int, default=50)
+    parser.add_argument('-a', '--artists', type=int, default=300)
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = get_or_create_user('benchmark')
+        session_id = create_session(user)
+
+        # Half of the artists have a metadata row, the others are negative entries
+        artists = [random_name() for _ in range(args.artists)]
+        create_artists(artists[::2])
+
+        client = app.test_client()
+
+        for cold in (True, False):
+            ingest.artist_ids.hits = ingest.artist_ids.misses = 0
+            delete_scrobbles(user)
+            queries, latency = run(client, session_id, artists, args.submissions, args.items, cold)
+            print('{:5s} cache: {:6.2f} queries/submission, {:7.2f} ms/submission, '
+                  'artist cache hit ratio {:.1%}'.format(
+                      'cold' if cold else 'warm', queries, latency, ingest.artist_ids.hit_ratio))
+
+        delete_scrobbles(user)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Audioscrobbler protocol load test.
+
+Drives the app's `handshake`, `np_1.2` and `protocol_1.2` endpoints in-process with
+a mix of clients: many users with several tokens each, mostly single-track
+submissions with now-playing pings, bursty offline-cache flushes of up to 50 items
+and resubmissions of batches that were already accepted.
+
+Reports requests/s, p50/p95/p99 latency and SQL statements per request for every
+endpoint, and stores the results as JSON, so runs can be compared over time.
+
+Usage:
+    python -m benchmarks.loadtest [-u USERS] [-t TOKENS] [-d SECONDS] [-c THREADS]
+    python -m benchmarks.loadtest --compare benchmarks/results/loadtest-<previous>.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import threading
+import time
+
+from collections import defaultdict
+
+from sqlalchemy import event
+
+from benchmarks.helpers import delete_scrobbles, get_or_create_user, random_name, submission
+from scrobbler.api.helpers import md5
+from scrobbler.models import Token
+from scrobbler.wsgi import app, db
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Relative weights of the client actions
+ACTIONS = (
+    ('single', 70),
+    ('flush', 10),
+    ('duplicate', 10),
+    ('handshake', 10),
+)
+WEIGHTED_ACTIONS = [name for name, weight in ACTIONS for _ in range(weight)]
+
+
+class Statements(threading.local):
+    count = 0
+
+
+statements = Statements()
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.count += 1
+
+
+class Client(object):
+    """ A player on one device, i.e. a (user, token) pair. """
+
+    def __init__(self, http, username, key, artists):
+        self.http = http
+        self.username = username
+        self.key = key
+        self.artists = artists
+        self.session_id = None
+        self.clock = int(time.time()) - random.randint(0, 365 * 24 * 60 * 60)
+        self.last_batch = None
+
+    def tracks(self, count):
+        return [(random.choice(self.artists), random_name(), random_name()) for _ in range(count)]
+
+    def handshake(self):
+        timestamp = str(int(time.time()))
+        response = self.http.get('/', query_string={
+            'hs': 'true', 'p': '1.2', 'c': 'tst', 'v': '1.0',
+            'u': self.username, 't': timestamp, 'a': md5(md5(self.key) + timestamp),
+        })
+        lines = response.data.decode('utf-8').split('\n')
+        assert lines[0] == 'OK', lines
+        self.session_id = lines[1]
+
+    def now_playing(self, artist, track, album):
+        response = self.http.post('/np_1.2', data={
+            's': self.session_id, 'a': artist, 't': track, 'b': album, 'l': '240',
+        })
+        assert response.data.startswith(b'OK'), response.data
+
+    def submit(self, tracks):
+        form = submission(self.session_id, tracks, self.clock)
+        self.clock += len(tracks) * 240
+        response = self.http.post('/protocol_1.2', data=form)
+        assert response.data.startswith(b'OK'), response.data
+        return form
+
+    def resubmit(self):
+        response = self.http.post('/protocol_1.2', data=self.last_batch)
+        assert response.data.startswith(b'OK'), response.data
+
+
+class LoadTest(object):
+    def __init__(self, clients, duration):
+        self.clients = clients
+        self.duration = duration
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def measure(self, endpoint, func, *args):
+        statements.count = 0
+        started_at = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started_at
+
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            self.statements[endpoint] += statements.count
+
+        return result
+
+    def step(self, client):
+        action = random.choice(WEIGHTED_ACTIONS)
+
+        if client.session_id is None or action == 'handshake':
+            self.measure('handshake', client.handshake)
+        elif action == 'duplicate' and client.last_batch:
+            self.measure('protocol_1.2', client.resubmit)
+        elif action == 'flush':
+            tracks = client.tracks(random.randint(10, 50))
+            client.last_batch = self.measure('protocol_1.2', client.submit, tracks)
+        else:
+            tracks = client.tracks(1)
+            self.measure('np_1.2', client.now_playing, *tracks[0])
+            client.last_batch = self.measure('protocol_1.2', client.submit, tracks)
+
+    def worker(self, clients, deadline):
+        with app.app_context():
+            while time.time() < deadline:
+                self.step(random.choice(clients))
+
+    def run(self, threads):
+        deadline = time.time() + self.duration
+        workers = [
+            threading.Thread(target=self.worker, args=(self.clients[i::threads], deadline))
+            for i in range(threads)
+        ]
+        started_at = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.time() - started_at
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def summarize(test, elapsed):
+    endpoints = {}
+    for endpoint, latencies in sorted(test.latencies.items()):
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'statements_per_request': test.statements[endpoint] / float(len(latencies)),
+        }
+
+    total = sum(len(latencies) for latencies in test.latencies.values())
+    return {'elapsed': elapsed, 'rps': total / elapsed, 'endpoints': endpoints}
+
+
+def print_results(results, previous=None):
+    print('{:14s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>10s}'.format(
+        'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'SQL/req'))
+
+    for endpoint, stats in sorted(results['endpoints'].items()):
+        print('{:14s} {requests:9d} {rps:9.1f} {p50_ms:9.2f} {p95_ms:9.2f} {p99_ms:9.2f} '
+              '{statements_per_request:10.2f}'.format(endpoint, **stats))
+
+        if previous and endpoint in previous['endpoints']:
+            before = previous['endpoints'][endpoint]
+            print('{:14s} {:>9s} {:+8.1f}% {:+8.1f}% {:+8.1f}% {:+8.1f}% {:+9.1f}%'.format(
+                '  vs previous', '',
+                *(100.0 * (stats[key] - before[key]) / before[key] if before[key] else 0.0
+                  for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'statements_per_request'))))
+
+    print('total: {:.1f} req/s over {:.1f}s'.format(results['rps'], results['elapsed']))
+
+
+def setup_clients(users, tokens, artists):
+    clients = []
+    bench_users = []
+
+    for n in range(users):
+        user = get_or_create_user('loadtest{}'.format(n))
+        bench_users.append(user)
+
+        existing = db.session.query(Token).filter(Token.user_id == user.id).count()
+        for i in range(existing, tokens):
+            db.session.add(Token(user_id=user.id, name='device{}'.format(i), key='key{}'.format(i)))
+        db.session.commit()
+
+        for i in range(tokens):
+            clients.append(Client(app.test_client(), user.username, 'key{}'.format(i), artists))
+
+    return clients, bench_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-u', '--users', type=int, default=20)
+    parser.add_argument('-t', '--tokens', type=int, default=3, help='tokens (devices) per user')
+    parser.add_argument('-a', '--artists', type=int, default=500)
+    parser.add_argument('-d', '--duration', type=float, default=30, help='seconds')
+    parser.add_argument('-c', '--threads', type=int, default=4)
+    parser.add_argument('--compare', help='a previous results file to compare with')
+    parser.add_argument('--keep', action='store_true', help="don't delete the generated scrobbles")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp)['results']
+
+    with app.app_context():
+        artists = [random_name() for _ in range(args.artists)]
+        clients, users = setup_clients(args.users, args.tokens, artists)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count_statement)
+        try:
+            test = LoadTest(clients, args.duration)
+            results = summarize(test, test.run(args.threads))
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_statement)
+
+        if not args.keep:
+            for user in users:
+                delete_scrobbles(user)
+
+    print_results(results, previous)
+
+    if not os.path.isdir(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+
+    now = datetime.datetime.now()
+    path = os.path.join(RESULTS_DIR, 'loadtest-{:%Y%m%d-%H%M%S}.json'.format(now))
+    with open(path, 'w') as fp:
+        json.dump({'date': now.isoformat(), 'config': vars(args), 'results': results}, fp, indent=2)
+    print('Saved to {}'.format(path))
+
+
+if __name__ == '__main__':
+    main()
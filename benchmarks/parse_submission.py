@@ -0,0 +1,42 @@
+"""
+Microbenchmark of `parse_scrobble_request` over 1-, 10- and 50-item submissions.
+
+Doesn't need a database. Usage: python -m benchmarks.parse_submission [-n NUMBER]
+"""
+
+import argparse
+import timeit
+
+from scrobbler.api.helpers import parse_scrobble_request
+
+
+def make_form(items):
+    form = {'s': 'd41d8cd98f00b204e9800998ecf8427e'}
+    for i in range(items):
+        form['a[{}]'.format(i)] = 'Artist {}'.format(i)
+        form['t[{}]'.format(i)] = 'Track {}'.format(i)
+        form['b[{}]'.format(i)] = 'Album {}'.format(i)
+        form['i[{}]'.format(i)] = str(1500000000 + (items - i) * 240)  # reversed order
+        form['l[{}]'.format(i)] = '240'
+        form['o[{}]'.format(i)] = 'P'
+        form['r[{}]'.format(i)] = ''
+        form['n[{}]'.format(i)] = str(i + 1)
+        form['m[{}]'.format(i)] = ''
+    return form
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    for items in (1, 10, 50):
+        form = make_form(items)
+        best = min(timeit.repeat(lambda: parse_scrobble_request(form), number=args.number, repeat=5))
+        per_call = best / args.number * 1e6
+        print('{:3d} items: {:9.1f} us/submission, {:6.2f} us/item'.format(
+            items, per_call, per_call / items))
+
+
+if __name__ == '__main__':
+    main()
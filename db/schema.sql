@@ -14,7 +14,8 @@ CREATE TABLE scrobbles (
     length interval NOT NULL,
     musicbrainz character varying(255),
     source character varying(255),
-    rating character varying(255)
+    rating character varying(255),
+    seq integer
 );
 
 CREATE SEQUENCE scrobbles_id_seq
@@ -31,22 +32,28 @@ ALTER TABLE ONLY scrobbles ADD CONSTRAINT scrobbles_pkey PRIMARY KEY (id);
 ALTER TABLE ONLY scrobbles ADD CONSTRAINT scrobbles_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(id);
 ALTER TABLE ONLY scrobbles ADD CONSTRAINT scrobbles_token_id_fkey FOREIGN KEY (token_id) REFERENCES tokens(id) ON DELETE SET NULL;
 ALTER TABLE ONLY scrobbles ADD CONSTRAINT scrobbles_artist_id_fkey FOREIGN KEY (artist_id) REFERENCES artists(id) ON DELETE SET NULL;
+ALTER TABLE ONLY scrobbles ADD CONSTRAINT scrobbles_track_id_fkey FOREIGN KEY (track_id) REFERENCES tracks(id);
 
 CREATE INDEX scrobbles_user_id_idx ON scrobbles (user_id);
 CREATE INDEX scrobbles_artist_id_idx ON scrobbles (artist_id);
 CREATE INDEX scrobbles_artist_idx ON scrobbles (lower((artist)::text));
 CREATE INDEX scrobbles_played_at_idx ON scrobbles (played_at);
 CREATE INDEX scrobbles_track_idx ON scrobbles (lower((track)::text));
-CREATE INDEX scrobbles_user_id_and_played_at_idx ON scrobbles (user_id, played_at);
+CREATE INDEX scrobbles_user_id_played_at_id_idx ON scrobbles (user_id, played_at, id);
 CREATE UNIQUE INDEX scrobbles_unique_idx ON scrobbles (user_id, played_at, artist, track);
+CREATE INDEX scrobbles_user_id_seq_idx ON scrobbles (user_id, seq);
+
+CREATE INDEX sessions_session_id_idx ON sessions (session_id);
+CREATE INDEX sessions_user_id_token_id_idx ON sessions (user_id, token_id);
 
 CREATE INDEX np_played_at_idx ON np (user_id, played_at);
+CREATE UNIQUE INDEX np_user_id_token_id_idx ON np (user_id, coalesce(token_id, 0));
+CREATE INDEX np_user_id_ends_at_idx ON np (user_id, ends_at);
+
+-- Trigram indexes for the search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX library_artist_trgm_idx ON library USING gin (artist gin_trgm_ops);
+CREATE INDEX library_track_trgm_idx ON library USING gin (track gin_trgm_ops);
 
--- A view for the per-user's milestones
-CREATE VIEW scrobbles_seq AS (
-    SELECT
-        row_number() OVER (PARTITION BY user_id ORDER BY played_at) AS seq_id,
-        *
-    FROM scrobbles
-    ORDER BY played_at
-);
\ No newline at end of file
+-- Per-day HyperLogLog sketches for the unique stats (`daily_sketches`), only needed with
+-- STATS_USE_HLL: `manage.py initdb` creates the `hll` extension and the table if it's enabled.
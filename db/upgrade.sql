@@ -0,0 +1,64 @@
+-- Statements that bring an existing database up to date with the models.
+-- Fresh installations get all of this from `manage.py initdb` and `schema.sql`.
+
+-- API session lookups by session id and by (user, token)
+CREATE INDEX sessions_session_id_idx ON sessions (session_id);
+CREATE INDEX sessions_user_id_token_id_idx ON sessions (user_id, token_id);
+
+-- Now playing: one row per (user, token) with a stored end time
+ALTER TABLE np ADD COLUMN ends_at timestamp with time zone;
+UPDATE np SET ends_at = played_at + length;
+DELETE FROM np WHERE id NOT IN (
+    SELECT DISTINCT ON (user_id, coalesce(token_id, 0)) id
+    FROM np
+    ORDER BY user_id, coalesce(token_id, 0), played_at DESC, id DESC
+);
+ALTER TABLE np ALTER COLUMN ends_at SET NOT NULL;
+CREATE UNIQUE INDEX np_user_id_token_id_idx ON np (user_id, coalesce(token_id, 0));
+CREATE INDEX np_user_id_ends_at_idx ON np (user_id, ends_at);
+
+-- Handshake credentials cache, checked against the users' token versions
+ALTER TABLE users ADD COLUMN tokens_version integer NOT NULL DEFAULT 0;
+
+-- Daily chart rollups: create the tables with `manage.py initdb`, then fill them with
+-- `manage.py rebuild_rollups`
+
+-- Unique stats sketches (optional, STATS_USE_HLL): enable it, let `manage.py initdb` create
+-- the `hll` extension and the `daily_sketches` table, then fill it with `manage.py rebuild_rollups`
+
+-- Webui result cache generations
+ALTER TABLE users ADD COLUMN generation integer NOT NULL DEFAULT 0;
+
+-- Stored per-user sequence numbers instead of the `scrobbles_seq` view;
+-- fill them with `manage.py renumber_scrobbles`
+DROP VIEW IF EXISTS scrobbles_seq;
+ALTER TABLE scrobbles ADD COLUMN seq integer;
+CREATE INDEX scrobbles_user_id_seq_idx ON scrobbles (user_id, seq);
+
+-- Dashboard activity cube: create the `activity` table with `manage.py initdb`,
+-- then fill it with `manage.py rebuild_rollups`
+
+-- Keyset pagination of the latest scrobbles by (played_at, id)
+CREATE INDEX scrobbles_user_id_played_at_id_idx ON scrobbles (user_id, played_at, id);
+DROP INDEX IF EXISTS scrobbles_user_id_and_played_at_idx;
+
+-- Search library: `CREATE EXTENSION pg_trgm` (done by `manage.py initdb`, but only a
+-- superuser may create it before PostgreSQL 13), create the `library` table with
+-- `manage.py initdb`, then fill it with `manage.py rebuild_rollups`
+
+-- Artist page summaries: create the `artist_summaries` table with `manage.py initdb`,
+-- the summaries are built as the artist pages are visited. Their top tracks come from
+-- the library, so run `manage.py rebuild_rollups` first if it's not filled yet.
+
+-- Tag inverted index and monthly tag weights: create the `artist_tags` and `user_tag_stats`
+-- tables with `manage.py initdb`, then fill both with `manage.py rebuild_rollups`
+CREATE INDEX artists_name_idx ON artists (name);
+
+-- Track dictionary: drop `daily_tracks` (it's keyed by `track_id` now), let `manage.py initdb`
+-- create `tracks` and the new `daily_tracks`, add the foreign key and run
+-- `manage.py rebuild_rollups`, which links the existing scrobbles to their tracks and
+-- refills the rollups. The HLL track sketches are hashed by `track_id` now as well.
+-- The top tracks and the yearly track charts stay empty until `rebuild_rollups` is done,
+-- so run it right after the upgrade.
+DROP TABLE IF EXISTS daily_tracks;
+ALTER TABLE scrobbles ADD CONSTRAINT scrobbles_track_id_fkey FOREIGN KEY (track_id) REFERENCES tracks(id);
@@ -26,8 +26,22 @@ def make_shell_context():
 
 @manager.command
 def initdb():
+    from scrobbler.rollups.library import create_extension
+
+    # For the trigram indexes of the search
+    if not create_extension():
+        print('The `pg_trgm` extension is missing, run `CREATE EXTENSION pg_trgm` as a superuser.')
+        return
+
     db.create_all()
 
+    if app.config.get('STATS_USE_HLL'):
+        from scrobbler.rollups.unique import create_sketches
+        if create_sketches():
+            db.session.commit()
+        else:
+            print('STATS_USE_HLL is enabled, but the `hll` extension is not available.')
+
 
 @manager.command
 @manager.option('-c', '--chunks', dest='chunks', default=1, help='Split data to chunks of N')
@@ -81,6 +95,118 @@ def fix_length():
     fix_scrobble_length()
 
 
+@manager.command
+@manager.option('-l', '--loop', dest='loop', default=False, help='Keep draining every N seconds')
+def flush_journal(loop):
+    """
+        Drain the write-behind ingest journal (see INGEST_JOURNAL_PATH) into the database.
+    """
+    from scrobbler.commands.journal import flush_journal
+    flush_journal(float(loop or 0))
+
+
+@manager.command
+@manager.option('-f', '--format', dest='file_format', default=None,
+                help='lastfm-csv, lastfm-json or listenbrainz (guessed by the extension)')
+@manager.option('-b', '--batch-size', dest='batch_size', default=10000, help='Rows per COPY batch')
+@manager.option('-r', '--restart', dest='restart', default=False, help='Ignore the checkpoint')
+def import_scrobbles(username, path, file_format, batch_size, restart):
+    """
+        Import a Last.fm or ListenBrainz export for the given user.
+
+        Usage:
+        ./manage.py import_scrobbles alice scrobbles.csv
+        ./manage.py import_scrobbles alice listens.jsonl -f listenbrainz
+
+        A killed import resumes from `<path>.checkpoint`. Rows that are already there are skipped.
+    """
+    from scrobbler.commands.importer import import_scrobbles
+    import_scrobbles(username, path, file_format, int(batch_size), bool(restart))
+
+
+@manager.command
+@manager.option('-f', '--format', dest='fmt', default='csv', help='csv or ndjson')
+@manager.option('--from', dest='time_from', default=None, help='YYYY-MM-DD')
+@manager.option('--to', dest='time_to', default=None, help='YYYY-MM-DD, inclusive')
+@manager.option('-o', '--offset', dest='offset', default=0, help='Skip the first N rows')
+def export_scrobbles(username, path, fmt, time_from, time_to, offset):
+    """
+        Export the scrobbles of the given user to a file (or `-` for stdout).
+
+        Usage:
+        ./manage.py export_scrobbles alice scrobbles.csv
+        ./manage.py export_scrobbles alice scrobbles.ndjson -f ndjson --from 2016-01-01
+
+        An interrupted export continues with `-o <rows already written>`.
+    """
+    from scrobbler.commands.export import export_scrobbles
+    export_scrobbles(username, path, fmt, time_from, time_to, int(offset))
+
+
+@manager.command
+@manager.option('-r', '--rate', dest='rate', default=None,
+                help='Rows per second (BACKFILL_ROWS_PER_SECOND by default)')
+@manager.option('-c', '--chunk-size', dest='chunk_size', default=10000, help='Ids per chunk')
+@manager.option('--checkpoint', dest='checkpoint', default='backfill_ids.checkpoint')
+@manager.option('--restart', dest='restart', default=False, help='Ignore the checkpoint')
+def backfill_ids(rate, chunk_size, checkpoint, restart):
+    """
+        Link the scrobbles without `artist_id`, `album_id` or `track_id` to their metadata.
+
+        Usage:
+        ./manage.py backfill_ids
+        ./manage.py backfill_ids -r 1000
+
+        Throttled so it can run next to the live ingest; a killed backfill resumes from the checkpoint.
+    """
+    from scrobbler.commands.backfill import backfill_ids
+    backfill_ids(int(rate) if rate else None, int(chunk_size), checkpoint, bool(restart))
+
+
+@manager.command
+def recount_playcounts():
+    """
+        Recompute artists' and albums' `local_playcount` from the `scrobbles` table.
+    """
+    from scrobbler.commands.playcounts import recount_playcounts
+    recount_playcounts()
+
+
+@manager.command
+@manager.option('-u', '--user', dest='username', default=None, help='Only rebuild this user')
+def rebuild_rollups(username):
+    """
+        Recompute the daily chart rollups (`daily_artists`, `daily_tracks`), the activity cube
+        (`activity`), the search library (`library`), the tag weights (`user_tag_stats`) and,
+        with STATS_USE_HLL, the unique stats sketches (`daily_sketches`) from `scrobbles`.
+
+        Also links the scrobbles without a `track_id` to their tracks, drops the artist page
+        summaries (`artist_summaries`) and, for all users, reindexes `artist_tags`.
+    """
+    from scrobbler.commands.rollups import rebuild_rollups
+    rebuild_rollups(username)
+
+
+@manager.command
+@manager.option('-u', '--user', dest='username', default=None, help='Only renumber this user')
+def renumber_scrobbles(username):
+    """
+        Recompute the per-user sequence numbers (`scrobbles.seq`) used by the milestones.
+    """
+    from scrobbler.commands.rollups import renumber_scrobbles
+    renumber_scrobbles(username)
+
+
+@manager.command
+@manager.option('-k', '--keep-days', dest='keep_days', default=1, help='Keep rows that ended N days ago')
+def prune_now_playing(keep_days):
+    """
+        Delete the stale rows of the `np` table.
+    """
+    from scrobbler.commands.nowplaying import prune_now_playing
+    prune_now_playing(int(keep_days))
+
+
 @manager.command
 def find_sequences():
     from scrobbler.commands.metadata import find_sequences
@@ -0,0 +1,111 @@
+"""
+Credential and session resolution for the Audioscrobbler endpoints.
+
+`handshake()` and `pwcheck.php` check the auth token against the user's API password
+and active token keys. The password is read with the user's row on every handshake,
+the token keys are kept per username in an in-process cache, stamped with the user's
+`tokens_version`. Adding or deactivating a token bumps the version, so every worker
+reloads the keys on its next handshake of that user.
+
+`now_playing()` and `scrobble()` map a session id to its (user_id, token_id) on every
+request, so the mapping is kept in an in-process cache that `handshake()` fills in.
+Misses fall back to an indexed lookup in `sessions`. Deactivating a token clears its
+sessions in the current worker only: the other workers keep accepting them until their
+entries expire, so `CACHE_SESSIONS_TTL` (a minute by default) is the revocation delay.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import event, or_, text
+
+from scrobbler import db
+from scrobbler.cache import LRUCache
+from scrobbler.models import Session, Token, User
+
+
+Credentials = namedtuple('Credentials', ('user_id', 'username', 'api_password', 'tokens'))
+
+# User.username -> (User.tokens_version, tokens)
+credentials = LRUCache('credentials', maxsize=1000, ttl=15 * 60)
+# Session.session_id -> (Session.user_id, Session.token_id)
+sessions = LRUCache('sessions', maxsize=10000, ttl=60)
+
+
+def get_credentials(username):
+    """
+    Returns the Credentials of the given user, or None if there's no such user.
+    `tokens` is a tuple of (Token.id, Token.key) of the active tokens.
+    """
+    user = (
+        db.session.query(User.id, User.username, User.api_password, User.tokens_version)
+        .filter(User.username == username)
+        .first()
+    )
+
+    if user is None:
+        return None
+
+    cached = credentials.get(username)
+    if cached is not None and cached[0] == user.tokens_version:
+        tokens = cached[1]
+    else:
+        tokens = tuple(
+            tuple(token) for token in
+            db.session.query(Token.id, Token.key)
+            .filter(Token.user_id == user.id, Token.is_active)
+            .order_by(Token.id.desc())
+        )
+        credentials.set(username, (user.tokens_version, tokens))
+
+    return Credentials(user.id, user.username, user.api_password, tokens)
+
+
+def bump_tokens_version(user_id):
+    """
+    Makes every worker reload the user's token keys on the next handshake.
+    Must be called in the transaction that adds or deactivates the token.
+    """
+    db.session.execute(
+        text('UPDATE users SET tokens_version = tokens_version + 1 WHERE id = :id'),
+        {'id': user_id},
+    )
+
+
+def remember_session(session_id, user_id, token_id):
+    sessions.set(session_id, (user_id, token_id))
+
+
+def resolve_session(session_id):
+    """
+    Returns a tuple of (user_id, token_id) or None if the session doesn't exist
+    or belongs to a deactivated token.
+    """
+    value = sessions.get(session_id)
+    if value is not None:
+        return value
+
+    # Unknown ids aren't cached: the session may have just been created by another worker
+    row = (
+        db.session.query(Session.user_id, Session.token_id)
+        .outerjoin(Token, Session.token_id == Token.id)
+        .filter(Session.session_id == session_id, or_(Session.token_id.is_(None), Token.is_active))
+        .order_by(Session.id.desc())
+        .first()
+    )
+
+    if row is None:
+        return None
+
+    remember_session(session_id, row.user_id, row.token_id)
+    return (row.user_id, row.token_id)
+
+
+def forget_token_sessions(token_id):
+    sessions.invalidate_where(lambda session_id, value: value[1] == token_id)
+
+
+@event.listens_for(Token.is_active, 'set')
+def on_token_deactivated(token, value, oldvalue, initiator):
+    if not value and token.id is not None:
+        forget_token_sessions(token.id)
+        bump_tokens_version(token.user_id)
@@ -55,3 +55,6 @@ SCROBBLE_KEY_MAPPING = {
     'o': 'source',
     'r': 'rating',
 }
+
+# Seconds to keep a track in "now playing" if the client didn't send its length
+NOW_PLAYING_FALLBACK_LENGTH = 5 * 60
@@ -0,0 +1,162 @@
+"""
+Artist, track and tag corrections applied to the incoming data.
+
+The `correction_*` tables are compiled into a `CorrectionMap`: plain dicts keyed by the
+exact name and, as a fallback, by its casefolded form, so a submission costs a couple of
+dict lookups per item. Every process keeps its compiled map and compares a version stamp
+of the tables (their row count and max id) at most every `CORRECTIONS_CHECK_INTERVAL`
+seconds, recompiling it when an admin has added or deleted a correction.
+
+A track correction references its artist's row (`correction_tracks.artist_id`), so it can
+only be made once the artist's metadata has been downloaded. It matches the artist's name,
+after the artist corrections.
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from scrobbler import db
+from scrobbler.models import Artist, ArtistCorrection, TagCorrection, TrackCorrection
+
+logger = logging.getLogger(__name__)
+
+
+VERSION_QUERY = '''
+    SELECT
+        (SELECT count(*) FROM correction_artists), (SELECT max(id) FROM correction_artists),
+        (SELECT count(*) FROM correction_tracks), (SELECT max(id) FROM correction_tracks),
+        (SELECT count(*) FROM correction_tags), (SELECT max(id) FROM correction_tags)
+'''
+
+
+def _compile(pairs):
+    """ Returns (exact, casefolded) dicts for the (old, new) pairs. The oldest correction wins. """
+    exact = {}
+    folded = {}
+
+    for old, new in pairs:
+        exact.setdefault(old, new)
+        folded.setdefault(old.casefold(), new)
+
+    return (exact, folded)
+
+
+class CorrectionMap(object):
+    """ The compiled corrections at a given `version`. """
+
+    def __init__(self, artists=(), tracks=(), tags=(), version=None):
+        """ `artists` and `tags` are (old, new) pairs, `tracks` are (artist, old, new). """
+        self.version = version
+        self.artists, self.folded_artists = _compile(artists)
+        self.tracks = {}
+        self.folded_tracks = {}
+        for artist, old, new in tracks:
+            self.tracks.setdefault((artist, old), new)
+            self.folded_tracks.setdefault((artist.casefold(), old.casefold()), new)
+        self.tags, self.folded_tags = _compile(tags)
+
+    def __len__(self):
+        return len(self.artists) + len(self.tracks) + len(self.tags)
+
+    def artist(self, name):
+        new = self.artists.get(name)
+        if new is None:
+            new = self.folded_artists.get(name.casefold(), name)
+        return new
+
+    def track(self, artist, title):
+        new = self.tracks.get((artist, title))
+        if new is None:
+            new = self.folded_tracks.get((artist.casefold(), title.casefold()), title)
+        return new
+
+    def tag(self, name):
+        new = self.tags.get(name)
+        if new is None:
+            new = self.folded_tags.get(name.casefold(), name)
+        return new
+
+    def apply(self, data):
+        """ Corrects the `artist` and `track` of a scrobble or now-playing dict in place. """
+        if not self:
+            return data
+
+        artist = data.get('artist')
+        if artist:
+            artist = data['artist'] = self.artist(artist)
+            if data.get('track'):
+                data['track'] = self.track(artist, data['track'])
+
+        return data
+
+    def apply_tags(self, tags):
+        """ Returns a corrected copy of {tag: strength}, merged tags keep the highest strength. """
+        result = {}
+        for name, strength in tags.items():
+            name = self.tag(name)
+            result[name] = max(strength, result.get(name, strength))
+        return result
+
+
+class Corrections(object):
+    """ Keeps the current `CorrectionMap` of the process. """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.check_interval = 10
+        self._map = CorrectionMap()
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.check_interval = app.config.get('CORRECTIONS_CHECK_INTERVAL', self.check_interval)
+        self._checked_at = None
+
+    @staticmethod
+    def get_version():
+        return tuple(db.session.execute(text(VERSION_QUERY)).first())
+
+    @staticmethod
+    def load(version=None):
+        artists = db.session.query(ArtistCorrection.old, ArtistCorrection.new).order_by(ArtistCorrection.id)
+        tracks = (
+            db.session.query(Artist.name, TrackCorrection.old, TrackCorrection.new)
+            .join(Artist, Artist.id == TrackCorrection.artist_id)
+            .order_by(TrackCorrection.id)
+        )
+        tags = db.session.query(TagCorrection.old, TagCorrection.new).order_by(TagCorrection.id)
+
+        return CorrectionMap(artists.all(), tracks.all(), tags.all(), version)
+
+    def get(self):
+        """ Returns the current map, recompiling it if the corrections have changed. """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._map
+
+        with self._lock:
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                version = self.get_version()
+                if version != self._map.version:
+                    self._map = self.load(version)
+                    logger.info('Loaded %d corrections', len(self._map))
+                self._checked_at = now
+
+        return self._map
+
+    def reload(self):
+        """ Forces a check on the next `get()`, e.g. right after a correction was edited. """
+        self._checked_at = None
+
+    def apply(self, data):
+        return self.get().apply(data)
+
+
+corrections = Corrections()
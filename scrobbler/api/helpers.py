@@ -1,7 +1,7 @@
 import datetime
 import hashlib
 
-from collections import defaultdict
+from operator import itemgetter
 
 from scrobbler.api.consts import AUTH_KEY_MAPPING, SCROBBLE_KEY_MAPPING
 
@@ -14,19 +14,22 @@ def api_response(*lines):
     return '\n'.join(lines + ('',))
 
 
-def authenticate(user, timestamp, auth):
+def authenticate(credentials, timestamp, auth):
     """
-    Returns a tuple of (User, Token.id).
+    Checks the auth token against the API password and the active tokens' keys.
+    `credentials` is an object with `api_password` and a `tokens` sequence of (Token.id, key).
+
+    Returns a tuple of (credentials, Token.id).
     """
-    if user is None:
+    if credentials is None:
         return (None, None)
 
-    if auth == md5(user.api_password + timestamp):
-        return (user, None)
-    else:
-        for token in user.tokens:
-            if auth == md5(token.key + timestamp):
-                return (user, token.id)
+    if auth == md5(credentials.api_password + timestamp):
+        return (credentials, None)
+
+    for token_id, key in credentials.tokens:
+        if auth == md5(key + timestamp):
+            return (credentials, token_id)
 
     return (None, None)
 
@@ -46,35 +49,96 @@ def parse_np_request(args):
     if not {'session_id', 'artist', 'track'}.issubset(data):
         return False
 
+    try:
+        data['length'] = datetime.timedelta(seconds=int(data.get('length') or 0))
+    except ValueError:
+        return False
+
     return data
 
 
-def parse_scrobble_request(args):
-    args = args.copy()
-    if 's' not in args:
-        return (False, [])
+class SubmissionError(ValueError):
+    """ A submission that can't be accepted. The message is sent back as `FAILED <reason>`. """
 
-    session_id = args.pop('s')
 
-    scrobbles = defaultdict(lambda: defaultdict(str))
+MAX_SUBMISSION_ITEMS = 50
+REQUIRED_SUBMISSION_FIELDS = ('artist', 'track', 'timestamp')
+SUBMISSION_FIELDS = {key: name for key, name in SCROBBLE_KEY_MAPPING.items() if key != 's'}
+
+
+def _submission_keys(count):
+    """ Precomputes {'a[0]': ('artist', 0), ...} for the keys of a regular submission. """
+    keys = {}
+    for key, name in SUBMISSION_FIELDS.items():
+        keys[key] = (name, 0)
+        for index in range(count):
+            keys['{}[{}]'.format(key, index)] = (name, index)
+    return keys
 
-    for key, value in args.items():
-        k_name = key[:1]
-        k_index = int(key[1:].strip('[]') or 0)
 
-        k_readable_name = SCROBBLE_KEY_MAPPING[k_name]
+SUBMISSION_KEYS = _submission_keys(MAX_SUBMISSION_ITEMS)
 
-        if k_index not in scrobbles:
-            scrobbles[k_index] = {}
 
-        if k_readable_name == 'timestamp':
-            value = datetime.datetime.fromtimestamp(int(value))
-        elif k_readable_name == 'length':
-            value = datetime.timedelta(seconds=int(value))
+def _parse_submission_key(key):
+    """ Slow path for the keys that aren't precomputed. Returns None for the unknown ones. """
+    name = SUBMISSION_FIELDS.get(key[:1])
+    if name is None:
+        return None
 
-        scrobbles[k_index][k_readable_name] = value
+    try:
+        return (name, int(key[1:].strip('[]') or 0))
+    except ValueError:
+        return None
 
-    # Convert dict to list & sort by timestamps
-    scrobbles = sorted(scrobbles.values(), key=lambda d: d.get('i', 0))
+
+def parse_scrobble_request(args):
+    """
+    Returns a tuple of (session_id, scrobbles) where scrobbles are sorted by their timestamps,
+    or (False, []) if there's no session id. Raises SubmissionError for an invalid item.
+    """
+    session_id = args.get('s')
+    if not session_id:
+        return (False, [])
+
+    items = {}
+    keys = SUBMISSION_KEYS
+
+    for key, value in args.items():
+        parsed = keys.get(key) or _parse_submission_key(key)
+        if parsed is None:
+            continue  # 's' and whatever else the client decided to send
+
+        name, index = parsed
+        item = items.get(index)
+        if item is None:
+            item = items[index] = {}
+        item[name] = value
+
+    scrobbles = []
+
+    for index in sorted(items):
+        item = items[index]
+        for field in REQUIRED_SUBMISSION_FIELDS:
+            if not item.get(field):
+                raise SubmissionError('Item #{} has no {}'.format(index, field))
+        scrobbles.append(item)
+
+    try:
+        timestamps = [int(item['timestamp']) for item in scrobbles]
+        lengths = [int(item.get('length') or 0) for item in scrobbles]
+    except ValueError:
+        raise SubmissionError('Timestamps and lengths must be integers')
+
+    fromtimestamp = datetime.datetime.fromtimestamp
+    timedelta = datetime.timedelta
+
+    try:
+        for item, timestamp, length in zip(scrobbles, timestamps, lengths):
+            item['timestamp'] = fromtimestamp(timestamp)
+            item['length'] = timedelta(seconds=length)
+    except (OverflowError, OSError, ValueError):
+        raise SubmissionError('Timestamp is out of range')
+
+    scrobbles.sort(key=itemgetter('timestamp'))
 
     return (session_id, scrobbles)
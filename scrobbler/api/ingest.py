@@ -0,0 +1,335 @@
+"""
+Set-based ingest of the submitted scrobbles.
+
+A submission (up to 50 items per request) is resolved and written with a constant
+number of statements: one SELECT for artists, one for albums, one for tracks (plus an
+INSERT of the tracks never seen before) and one multi-row INSERT ... ON CONFLICT
+DO NOTHING for the scrobbles themselves. `after_insert()` then keeps the rollups, the
+users' generations and the sequence numbers current with about ten more set-based
+statements, however many items the submission has.
+
+Artist, album and track ids are looked up through LRU caches first, so in the steady
+state a submission doesn't touch the `artists`, `albums` and `tracks` tables at all.
+"""
+
+import datetime
+import logging
+
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from scrobbler import db
+from scrobbler.api.consts import NOW_PLAYING_FALLBACK_LENGTH
+from scrobbler.api.playcounts import playcounts
+from scrobbler.cache import LRUCache
+from scrobbler.models import Album, Artist, NowPlaying, Scrobble, Track
+from scrobbler.rollups import activity, daily, library, sequence, summaries, tags, unique
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# Artist.name -> Artist.id (or None if there's no metadata row yet)
+artist_ids = LRUCache('artist_ids', maxsize=10000, ttl=60 * 60)
+# (Artist.id, Album.name) -> Album.id (or None)
+album_ids = LRUCache('album_ids', maxsize=20000, ttl=60 * 60)
+# (artist name, track title) -> Track.id
+track_ids = LRUCache('track_ids', maxsize=50000, ttl=60 * 60)
+
+
+SCROBBLE_FIELDS = (
+    'user_id', 'token_id', 'played_at',
+    'artist', 'track', 'album', 'tracknumber', 'length', 'musicbrainz', 'source', 'rating',
+    'artist_id', 'album_id', 'track_id',
+)
+
+NOW_PLAYING_FIELDS = (
+    'user_id', 'token_id', 'played_at',
+    'artist', 'track', 'album', 'tracknumber', 'length', 'musicbrainz',
+)
+
+INSERT_TRACKS_QUERY = '''
+    INSERT INTO tracks (artist, title, artist_id)
+    SELECT DISTINCT ON (s.artist, s.track) s.artist, s.track, s.artist_id
+    FROM scrobbles s
+    WHERE {where}
+    ORDER BY s.artist, s.track, s.artist_id
+    ON CONFLICT (artist, title) DO NOTHING
+'''
+
+LINK_TRACKS_QUERY = '''
+    UPDATE scrobbles s SET track_id = t.id
+    FROM tracks t
+    WHERE {where} AND t.artist = s.artist AND t.title = s.track
+      AND s.track_id IS DISTINCT FROM t.id
+'''
+
+
+def resolve_artist_ids(names):
+    """
+    Returns a dict of {artist name: Artist.id} for the given names, querying the
+    cache misses with a single SELECT. Names without a metadata row map to None.
+    """
+    result = {}
+    misses = set()
+
+    for name in set(name for name in names if name):
+        artist_id = artist_ids.get(name, MISSING)
+        if artist_id is MISSING:
+            misses.add(name)
+        else:
+            result[name] = artist_id
+
+    if not misses:
+        return result
+
+    rows = (
+        db.session.query(Artist.name, Artist.id)
+        .filter(Artist.name.in_(misses))
+        .order_by(Artist.id)
+        .all()
+    )
+
+    found = {}
+    for name, artist_id in rows:
+        found.setdefault(name, artist_id)  # the oldest row wins, like `.first()` did
+
+    for name in misses:
+        result[name] = found.get(name)
+        artist_ids.set(name, result[name])
+
+    return result
+
+
+def resolve_album_ids(pairs):
+    """
+    Returns a dict of {(Artist.id, album name): Album.id} for the given pairs, querying the
+    cache misses with a single SELECT. Unknown albums map to None.
+    """
+    result = {}
+    misses = set()
+
+    for key in set((artist_id, name) for artist_id, name in pairs if artist_id and name):
+        album_id = album_ids.get(key, MISSING)
+        if album_id is MISSING:
+            misses.add(key)
+        else:
+            result[key] = album_id
+
+    if not misses:
+        return result
+
+    rows = (
+        db.session.query(Album.artist_id, Album.name, Album.id)
+        .filter(tuple_(Album.artist_id, Album.name).in_(misses))
+        .order_by(Album.id)
+        .all()
+    )
+
+    found = {}
+    for artist_id, name, album_id in rows:
+        found.setdefault((artist_id, name), album_id)
+
+    for key in misses:
+        result[key] = found.get(key)
+        album_ids.set(key, result[key])
+
+    return result
+
+
+def resolve_track_ids(rows):
+    """
+    Returns a dict of {(artist name, track title): Track.id} for the given
+    (artist name, track title, Artist.id) rows, creating the missing tracks.
+
+    Only the ids that were already committed are cached: a track created here would
+    be gone if the transaction was rolled back.
+    """
+    result = {}
+    misses = {}
+
+    for artist, title, artist_id in rows:
+        key = (artist, title)
+        if key in result or key in misses:
+            continue
+
+        track_id = track_ids.get(key, MISSING)
+        if track_id is MISSING:
+            misses[key] = artist_id
+        else:
+            result[key] = track_id
+
+    if not misses:
+        return result
+
+    for artist, title, track_id in (
+        db.session.query(Track.artist, Track.title, Track.id)
+        .filter(tuple_(Track.artist, Track.title).in_(list(misses)))
+    ):
+        result[(artist, title)] = track_id
+        track_ids.set((artist, title), track_id)
+        del misses[(artist, title)]
+
+    if not misses:
+        return result
+
+    query = (
+        insert(Track)
+        .values([
+            {'artist': artist, 'title': title, 'artist_id': artist_id}
+            for (artist, title), artist_id in misses.items()
+        ])
+        .on_conflict_do_nothing(index_elements=['artist', 'title'])
+        .returning(Track.artist, Track.title, Track.id)
+    )
+    for artist, title, track_id in db.session.execute(query):
+        result[(artist, title)] = track_id
+        del misses[(artist, title)]
+
+    if misses:
+        # Created by a concurrent transaction in the meantime
+        for artist, title, track_id in (
+            db.session.query(Track.artist, Track.title, Track.id)
+            .filter(tuple_(Track.artist, Track.title).in_(list(misses)))
+        ):
+            result[(artist, title)] = track_id
+
+    return result
+
+
+def link_tracks(where, params):
+    """
+    Sets `track_id` of the scrobbles matching the `where` clause (on `scrobbles s`) from
+    their artist and track, creating the missing tracks. Used after in-place renames
+    and for the scrobbles written before `tracks` existed.
+    """
+    db.session.execute(text(INSERT_TRACKS_QUERY.format(where=where)), params)
+    return db.session.execute(text(LINK_TRACKS_QUERY.format(where=where)), params).rowcount
+
+
+def invalidate_artist(*names):
+    """ Forgets the cached ids of the given artist names, e.g. after a metadata sync. """
+    artist_ids.invalidate(*names)
+
+
+def bump_generations(user_ids):
+    """ Marks the cached webui results of the given users as stale. """
+    if not user_ids:
+        return
+
+    db.session.execute(
+        text('UPDATE users SET generation = generation + 1 WHERE id = ANY(:ids)'),
+        {'ids': sorted(user_ids)},
+    )
+
+
+def after_insert(inserted, number=True):
+    """
+    Keeps the data derived from `scrobbles` up to date. Every way of writing scrobbles
+    (the API, the journal flusher, the bulk import) calls it with the inserted rows,
+    i.e. (id, user_id, artist_id, album_id) tuples, in the same transaction.
+
+    With `number=False` the sequence numbers are left for `sequence.renumber()`.
+    """
+    playcounts.add(Artist, (row.artist_id for row in inserted if row.artist_id))
+    playcounts.add(Album, (row.album_id for row in inserted if row.album_id))
+    ids = [row.id for row in inserted]
+    daily.update(ids)
+    unique.update(ids)
+    activity.update(ids)
+    library.update(ids)
+    tags.update(ids)
+    # Locks the users' rows, which serializes the numbering below
+    bump_generations({row.user_id for row in inserted})
+    summaries.update(ids)
+    if number:
+        sequence.assign(ids)
+
+
+def after_update(ids):
+    """
+    Like `after_insert()`, for the scrobbles whose artist or track was changed in place
+    (e.g. by the maintenance fixes). Must be called after the UPDATE, in the same transaction.
+    """
+    if ids:
+        link_tracks('s.id = ANY(:ids)', {'ids': list(ids)})
+
+    daily.refresh(ids)
+    unique.refresh(ids)
+    activity.refresh(ids)
+    library.refresh(ids)
+    tags.refresh(ids)
+    summaries.refresh(ids)
+
+    if ids:
+        user_ids = db.session.query(Scrobble.user_id).filter(Scrobble.id.in_(ids)).distinct()
+        bump_generations({user_id for user_id, in user_ids})
+
+
+def ingest_scrobbles(scrobbles):
+    """
+    Writes the given scrobbles (dicts with `user_id`, `token_id`, `played_at` and the track
+    metadata) with a single multi-row INSERT. Rows that hit `scrobbles_unique_idx` are skipped.
+
+    Returns a tuple of (new, duplicates). The caller is responsible for the commit,
+    followed by `playcounts.maybe_flush()`.
+    """
+    if not scrobbles:
+        return (0, 0)
+
+    artist_map = resolve_artist_ids(data.get('artist') for data in scrobbles)
+    album_map = resolve_album_ids(
+        (artist_map.get(data.get('artist')), data.get('album')) for data in scrobbles
+    )
+    track_map = resolve_track_ids(
+        (data.get('artist'), data.get('track'), artist_map.get(data.get('artist')))
+        for data in scrobbles
+    )
+
+    created_at = datetime.datetime.now()
+    rows = []
+
+    for data in scrobbles:
+        row = {field: data.get(field) for field in SCROBBLE_FIELDS}
+        row['artist_id'] = artist_map.get(row['artist'])
+        row['album_id'] = album_map.get((row['artist_id'], row['album']))
+        row['track_id'] = track_map.get((row['artist'], row['track']))
+        row['created_at'] = created_at
+        rows.append(row)
+
+    # PG 9.5+: DO NOTHING if duplicate
+    query = (
+        insert(Scrobble)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=['user_id', 'played_at', 'artist', 'track'])
+        .returning(Scrobble.id, Scrobble.user_id, Scrobble.artist_id, Scrobble.album_id)
+    )
+    inserted = db.session.execute(query).fetchall()
+
+    after_insert(inserted)
+
+    new = len(inserted)
+    duplicates = len(rows) - new
+
+    logger.info('Ingested %d scrobbles: %d new, %d duplicates', len(rows), new, duplicates)
+
+    return (new, duplicates)
+
+
+def update_now_playing(data):
+    """
+    Stores the now-playing track of a (user, token), replacing the previous one.
+    The caller is responsible for the commit.
+    """
+    row = {field: data.get(field) for field in NOW_PLAYING_FIELDS}
+    row['length'] = row['length'] or datetime.timedelta(0)
+    row['ends_at'] = row['played_at'] + (
+        row['length'] or datetime.timedelta(seconds=NOW_PLAYING_FALLBACK_LENGTH)
+    )
+
+    query = insert(NowPlaying).values(row)
+    query = query.on_conflict_do_update(
+        index_elements=[NowPlaying.user_id, func.coalesce(NowPlaying.token_id, 0)],
+        set_={field: query.excluded[field] for field in row if field not in ('user_id', 'token_id')},
+    )
+    db.session.execute(query)
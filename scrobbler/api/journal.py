@@ -0,0 +1,364 @@
+"""
+Write-behind journal for the Audioscrobbler submissions.
+
+When `INGEST_JOURNAL_PATH` is set, `scrobble()` and `now_playing()` don't wait for
+Postgres: the parsed submission is appended to a local journal, fsync'd and
+acknowledged right away. A flusher drains the journal into the database in large
+batches, either in a background thread of every worker (`INGEST_JOURNAL_FLUSH_INTERVAL`)
+or with `manage.py flush_journal`. The thread is started on the first request a worker
+process serves, so it's there under pre-forking servers (e.g. `gunicorn --preload`) too.
+
+Layout of the journal directory:
+
+    active.log                    -- the segment being appended to
+    segment-<microseconds>.log    -- sealed segments, waiting for the flusher
+    journal.lock                  -- serializes the writers and the rotation
+    flush.lock                    -- makes sure only one flusher runs at a time
+    quarantine.log                -- the records the database refused, never replayed
+
+Every record is a single line of `<crc32 as 8 hex digits> <json>`. A torn or corrupt
+line (e.g. the tail of a segment after a crash) fails the checksum and is skipped.
+
+A segment is deleted only after all of its records have been committed, so a crash
+in between replays it. Replaying is safe: the scrobbles are deduplicated by
+`scrobbles_unique_idx` and the now-playing records that have already ended are dropped.
+
+A batch the database refuses because of its data (e.g. an artist longer than its column)
+is retried item by item and the failing items are moved to `quarantine.log`, so one bad
+record can't hold back everything behind it. The quarantine has the segment format: once
+the records are fixed, it can be renamed to `segment-<microseconds>.log` to replay it.
+"""
+
+import datetime
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from contextlib import contextmanager
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from scrobbler import db
+from scrobbler.api.consts import NOW_PLAYING_FALLBACK_LENGTH
+from scrobbler.api.ingest import ingest_scrobbles, update_now_playing
+from scrobbler.api.playcounts import playcounts
+
+logger = logging.getLogger(__name__)
+
+
+ACTIVE_SEGMENT = 'active.log'
+SEGMENT_PATTERN = 'segment-*.log'
+QUARANTINE = 'quarantine.log'
+
+# Errors caused by the records themselves, as opposed to e.g. the database being down
+BAD_RECORD_ERRORS = (DataError, IntegrityError)
+
+
+def encode_record(kind, data):
+    payload = json.dumps({'kind': kind, 'data': data}, separators=(',', ':'), sort_keys=True)
+    checksum = zlib.crc32(payload.encode('utf-8')) & 0xffffffff
+    return '{:08x} {}\n'.format(checksum, payload).encode('utf-8')
+
+
+def decode_record(line):
+    """ Returns a tuple of (kind, data) or None if the line is torn or corrupt. """
+    try:
+        line = line.decode('utf-8').rstrip('\n')
+        checksum, payload = line.split(' ', 1)
+        if int(checksum, 16) != zlib.crc32(payload.encode('utf-8')) & 0xffffffff:
+            return None
+        record = json.loads(payload)
+    except ValueError:
+        return None
+
+    return (record['kind'], record['data'])
+
+
+def encode_item(data):
+    data = dict(data)
+    if data.get('played_at') is not None:
+        data['played_at'] = data['played_at'].timestamp()
+    if data.get('length') is not None:
+        data['length'] = data['length'].total_seconds()
+    return data
+
+
+def decode_item(data):
+    if data.get('played_at') is not None:
+        data['played_at'] = datetime.datetime.fromtimestamp(data['played_at'])
+    if data.get('length') is not None:
+        data['length'] = datetime.timedelta(seconds=data['length'])
+    return data
+
+
+def update_all_now_playing(records):
+    for data in records:
+        update_now_playing(data)
+
+
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal(object):
+    def __init__(self, app=None):
+        self.app = app
+        self.path = None
+        self.segment_size = 16 * 1024 * 1024
+        self.batch_size = 5000
+        self.flush_interval = None
+        self._flusher = None
+        self._flusher_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config.get('INGEST_JOURNAL_PATH')
+        self.segment_size = app.config.get('INGEST_JOURNAL_SEGMENT_SIZE', self.segment_size)
+        self.batch_size = app.config.get('INGEST_JOURNAL_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('INGEST_JOURNAL_FLUSH_INTERVAL')
+
+        if not self.path:
+            return
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        if self.flush_interval:
+            app.before_request(self._start_flusher)
+
+    def _start_flusher(self):
+        """
+        Starts the flusher thread of the current process. Threads don't survive a fork, so
+        it's done on the first request of every worker rather than in `init_app()`.
+        """
+        if self._flusher_pid == os.getpid():
+            return
+
+        self._flusher_pid = os.getpid()
+        self._flusher = JournalFlusher(self, self.flush_interval)
+        self._flusher.start()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @contextmanager
+    def _lock(self, name, blocking=True):
+        with open(os.path.join(self.path, name), 'a') as fp:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def append(self, kind, data):
+        """ Durably appends a record to the active segment. """
+        record = encode_record(kind, data)
+        active = os.path.join(self.path, ACTIVE_SEGMENT)
+
+        with self._lock('journal.lock'):
+            with open(active, 'ab') as fp:
+                fp.write(record)
+                fp.flush()
+                os.fsync(fp.fileno())
+                size = fp.tell()
+
+            if size >= self.segment_size:
+                self._seal()
+
+    def append_scrobbles(self, user_id, token_id, scrobbles):
+        self.append('scrobbles', {
+            'user_id': user_id,
+            'token_id': token_id,
+            'items': [encode_item(data) for data in scrobbles],
+        })
+
+    def append_now_playing(self, data):
+        self.append('np', encode_item(data))
+
+    def quarantine(self, kind, data):
+        """ Durably appends a decoded scrobble item or now-playing record to the quarantine. """
+        if kind == 'scrobbles':
+            record = encode_record(kind, {
+                'user_id': data['user_id'],
+                'token_id': data['token_id'],
+                'items': [encode_item(data)],
+            })
+        else:
+            record = encode_record(kind, encode_item(data))
+
+        with open(os.path.join(self.path, QUARANTINE), 'ab') as fp:
+            fp.write(record)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def _seal(self):
+        """ Renames the active segment to a sealed one. Must be called under `journal.lock`. """
+        active = os.path.join(self.path, ACTIVE_SEGMENT)
+
+        if not os.path.exists(active) or not os.path.getsize(active):
+            return
+
+        while True:
+            sealed = os.path.join(self.path, 'segment-{:020d}.log'.format(int(time.time() * 1e6)))
+            if not os.path.exists(sealed):
+                break
+
+        os.rename(active, sealed)
+        fsync_directory(self.path)
+
+    def rotate(self):
+        with self._lock('journal.lock'):
+            self._seal()
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.path, SEGMENT_PATTERN)))
+
+    def read_segment(self, path):
+        with open(path, 'rb') as fp:
+            for lineno, line in enumerate(fp, 1):
+                record = decode_record(line)
+                if record is None:
+                    logger.warning('Skipping a corrupt record at %s:%d', path, lineno)
+                    continue
+                yield record
+
+    def flush(self):
+        """
+        Drains the sealed segments (and the active one) into the database.
+        Returns the number of scrobble items processed, or None if another flusher is running.
+        """
+        with self._lock('flush.lock', blocking=False) as locked:
+            if not locked:
+                return None
+
+            self.rotate()
+
+            total = 0
+            for path in self.segments():
+                total += self._flush_segment(path)
+                os.remove(path)
+
+            return total
+
+    def _flush_segment(self, path):
+        batch = []
+        now_playing = {}
+        total = 0
+
+        for kind, data in self.read_segment(path):
+            if kind == 'scrobbles':
+                for item in data['items']:
+                    item = decode_item(item)
+                    item['user_id'] = data['user_id']
+                    item['token_id'] = data['token_id']
+                    batch.append(item)
+            elif kind == 'np':
+                # Only the latest now-playing record of a (user, token) matters
+                now_playing[(data['user_id'], data['token_id'])] = decode_item(data)
+
+            if len(batch) >= self.batch_size:
+                total += self._flush_batch(batch)
+                batch = []
+
+        total += self._flush_batch(batch)
+        self._flush_now_playing(now_playing.values())
+
+        return total
+
+    def _commit(self, write, items):
+        try:
+            result = write(items)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return result
+
+    def _commit_or_quarantine(self, kind, write, items):
+        """
+        Calls `write(items)` and commits. If the database refuses the data, retries the items
+        one by one and quarantines the failing ones. Returns the results of the committed calls.
+        """
+        try:
+            return [self._commit(write, items)]
+        except BAD_RECORD_ERRORS:
+            logger.warning('Failed to flush %d journaled %s records, retrying them one by one',
+                           len(items), kind, exc_info=True)
+
+        results = []
+        for item in items:
+            try:
+                results.append(self._commit(write, [item]))
+            except BAD_RECORD_ERRORS:
+                logger.error('Quarantined a journaled %s record: %r', kind, item, exc_info=True)
+                self.quarantine(kind, item)
+
+        return results
+
+    def _flush_batch(self, batch):
+        if not batch:
+            return 0
+
+        results = self._commit_or_quarantine('scrobbles', ingest_scrobbles, batch)
+        new = sum(result[0] for result in results)
+        duplicates = sum(result[1] for result in results)
+        playcounts.maybe_flush()
+
+        logger.info('Flushed %d journaled scrobbles: %d new, %d duplicates',
+                    len(batch), new, duplicates)
+        return len(batch)
+
+    def _flush_now_playing(self, records):
+        now = datetime.datetime.now()
+        playing = []
+
+        for data in records:
+            length = data.get('length') or datetime.timedelta(seconds=NOW_PLAYING_FALLBACK_LENGTH)
+            if data['played_at'] + length < now:
+                continue  # the track has already ended, e.g. when replaying after a crash
+            playing.append(data)
+
+        if playing:
+            self._commit_or_quarantine('np', update_all_now_playing, playing)
+
+
+class JournalFlusher(threading.Thread):
+    """ Periodically drains the journal from a worker process. """
+
+    def __init__(self, journal, interval):
+        super(JournalFlusher, self).__init__(name='journal-flusher')
+        self.daemon = True
+        self.journal = journal
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                with self.journal.app.app_context():
+                    self.journal.flush()
+            except Exception:
+                logger.error('Failed to flush the ingest journal', exc_info=True)
+
+
+journal = Journal()
@@ -0,0 +1,162 @@
+"""
+Buffered `local_playcount` updates for artists and albums.
+
+Bumping the counters row by row on every scrobble makes the concurrent submissions
+queue up on the row locks of popular artists. Instead, the ingest path accumulates
+per-id deltas in memory and they're applied in one `UPDATE ... FROM (VALUES ...)`
+per table once `PLAYCOUNTS_FLUSH_SIZE` ids are pending or `PLAYCOUNTS_FLUSH_INTERVAL`
+seconds have passed since the last flush.
+
+The deltas are kept with the session until its transaction commits: the scrobbles of a
+transaction that's rolled back were never written, and counting them would count them
+twice once the client retries the submission.
+
+The counters are a cache of `scrobbles`: the deltas of a worker that dies before
+flushing are lost, so `manage.py recount_playcounts` recomputes them from scratch.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from collections import Counter
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, text
+
+from scrobbler import db
+from scrobbler.models import Album, Artist
+
+logger = logging.getLogger(__name__)
+
+# The key of the uncommitted deltas in `Session.info`
+SESSION_KEY = 'playcounts'
+
+UPDATE_QUERY = '''
+    UPDATE {table} SET local_playcount = coalesce({table}.local_playcount, 0) + v.delta
+    FROM (VALUES {values}) AS v (id, delta)
+    WHERE {table}.id = v.id
+'''
+
+RECOUNT_QUERY = '''
+    UPDATE {table} SET local_playcount = c.count
+    FROM (
+        SELECT {table}.id, count(scrobbles.id) AS count
+        FROM {table} LEFT JOIN scrobbles ON scrobbles.{column} = {table}.id
+        GROUP BY {table}.id
+    ) AS c
+    WHERE {table}.id = c.id AND {table}.local_playcount IS DISTINCT FROM c.count
+'''
+
+
+def apply_deltas(model, counts):
+    """ Adds the {id: delta} counts to `local_playcount` of the given model with one statement. """
+    if not counts:
+        return
+
+    # A stable order of the row locks keeps two concurrent flushes from deadlocking
+    ids = sorted(counts)
+    values = ', '.join('(:id_{0}, :delta_{0})'.format(i) for i in range(len(ids)))
+    params = {}
+    for i, pk in enumerate(ids):
+        params['id_{}'.format(i)] = pk
+        params['delta_{}'.format(i)] = counts[pk]
+
+    query = text(UPDATE_QUERY.format(table=model.__tablename__, values=values))
+    db.session.execute(query, params)
+
+
+def recount(model, column):
+    query = text(RECOUNT_QUERY.format(table=model.__tablename__, column=column))
+    return db.session.execute(query).rowcount
+
+
+class PlaycountAggregator(object):
+    def __init__(self, app=None):
+        self.app = app
+        self.flush_size = 1000
+        self.flush_interval = 60
+        self._pending = {Artist: Counter(), Album: Counter()}
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_size = app.config.get('PLAYCOUNTS_FLUSH_SIZE', self.flush_size)
+        self.flush_interval = app.config.get('PLAYCOUNTS_FLUSH_INTERVAL', self.flush_interval)
+        atexit.register(self._flush_at_exit)
+
+        if not event.contains(SignallingSession, 'after_commit', self._after_commit):
+            event.listen(SignallingSession, 'after_commit', self._after_commit)
+            event.listen(SignallingSession, 'after_transaction_end', self._after_transaction_end)
+
+    def add(self, model, ids):
+        """
+        Counts one play for every id in `ids` (duplicates included) once the current
+        transaction commits.
+        """
+        session = db.session()
+        pending = session.info.get(SESSION_KEY)
+        if pending is None:
+            pending = session.info[SESSION_KEY] = {Artist: Counter(), Album: Counter()}
+        pending[model].update(ids)
+
+    def _after_commit(self, session):
+        if session.transaction is not None and session.transaction.nested:
+            return  # a SAVEPOINT, the outer transaction may still be rolled back
+
+        pending = session.info.pop(SESSION_KEY, None)
+        if not pending:
+            return
+
+        with self._lock:
+            for model, counts in pending.items():
+                self._pending[model].update(counts)
+
+    def _after_transaction_end(self, session, transaction):
+        # Drops the deltas of a transaction that was rolled back or closed without a commit
+        if transaction.parent is None:
+            session.info.pop(SESSION_KEY, None)
+
+    @property
+    def pending(self):
+        return sum(len(counts) for counts in self._pending.values())
+
+    def maybe_flush(self):
+        """ Flushes if any threshold is reached. Call it after the ingest has been committed. """
+        if (self.pending >= self.flush_size or
+                time.monotonic() - self._flushed_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {Artist: Counter(), Album: Counter()}
+            self._flushed_at = time.monotonic()
+
+        if not any(pending.values()):
+            return
+
+        try:
+            for model, counts in pending.items():
+                apply_deltas(model, counts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put the deltas back, they'll be retried by the next flush. Not raising: the
+            # caller's own transaction (e.g. a submission) has been committed already.
+            with self._lock:
+                for model, counts in pending.items():
+                    self._pending[model].update(counts)
+            logger.error('Failed to flush %d pending playcounts', self.pending, exc_info=True)
+
+    def _flush_at_exit(self):
+        with self.app.app_context():
+            self.flush()
+
+
+playcounts = PlaycountAggregator()
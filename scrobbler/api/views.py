@@ -1,13 +1,17 @@
 import datetime
 
 from flask import Blueprint, redirect, request, url_for
-from sqlalchemy.dialects.postgresql import insert
 
 from scrobbler import db
+from scrobbler.api.auth import get_credentials, remember_session, resolve_session
 from scrobbler.api.consts import PONG, RADIO_HANDSHAKE, UPDATE_CHECK
-from scrobbler.api.helpers import (api_response, authenticate, md5,
+from scrobbler.api.corrections import corrections
+from scrobbler.api.helpers import (SubmissionError, api_response, authenticate, md5,
                                    parse_auth_request, parse_np_request, parse_scrobble_request)
-from scrobbler.models import Album, Artist, NowPlaying, Scrobble, Session, User
+from scrobbler.api.ingest import ingest_scrobbles, update_now_playing
+from scrobbler.api.journal import journal
+from scrobbler.api.playcounts import playcounts
+from scrobbler.models import Session
 
 blueprint = Blueprint('api', __name__)
 
@@ -24,14 +28,14 @@ def handshake():
     if not data:
         return api_response('BADREQUEST'), 400
 
-    user = db.session.query(User).filter_by(username=data['username']).first()
+    user = get_credentials(data['username'])
     user, token_id = authenticate(user, data['timestamp'], data['auth'])
 
     if user is None:
         return api_response('BADAUTH')
 
     session = db.session.query(Session).filter(
-        Session.user_id == user.id,
+        Session.user_id == user.user_id,
         Session.token_id == token_id
     ).first()
 
@@ -42,7 +46,7 @@ def handshake():
     else:
         session_id = md5(user.username + user.api_password + current_time.strftime('%s'))
         session = Session(
-            user_id=user.id,
+            user_id=user.user_id,
             token_id=token_id,
             session_id=session_id,
             created_at=current_time,
@@ -52,6 +56,8 @@ def handshake():
 
     db.session.commit()
 
+    remember_session(session.session_id, user.user_id, token_id)
+
     return api_response(
         'OK',
         session.session_id,
@@ -66,7 +72,7 @@ def password_check():
     if not data:
         return api_response('BADREQUEST'), 400
 
-    user = db.session.query(User).filter_by(username=data['username']).first()
+    user = get_credentials(data['username'])
     user, token_id = authenticate(user, data['timestamp'], data['auth'])
 
     if user is None:
@@ -81,17 +87,20 @@ def now_playing():
     if not data:
         return api_response('BADREQUEST'), 400
 
-    session = db.session.query(Session).filter(Session.session_id == data['session_id']).first()
+    session = resolve_session(data.pop('session_id'))
 
     if session is None:
         return api_response('BADSESSION')
 
-    data.pop('session_id', None)
-    data['user_id'] = session.user_id
-    data['token_id'] = session.token_id
+    data['user_id'], data['token_id'] = session
     data['played_at'] = datetime.datetime.now()
-    np = NowPlaying(**data)
-    db.session.add(np)
+    corrections.apply(data)
+
+    if journal.enabled:
+        journal.append_now_playing(data)
+        return api_response('OK')
+
+    update_now_playing(data)
     db.session.commit()
 
     return api_response('OK')
@@ -99,52 +108,33 @@ def now_playing():
 
 @blueprint.route('/protocol_1.2', methods=['POST'])
 def scrobble():
-    session_id, scrobbles = parse_scrobble_request(request.form)
+    try:
+        session_id, scrobbles = parse_scrobble_request(request.form)
+    except SubmissionError as e:
+        return api_response('FAILED {}'.format(e))
+
     if not session_id:
         return api_response('BADREQUEST'), 400
 
-    session = db.session.query(Session).filter(Session.session_id == session_id).first()
+    session = resolve_session(session_id)
+
+    if session is None:
+        return api_response('BADSESSION')
+
+    correction_map = corrections.get()
 
     for data in scrobbles:
-        artist = db.session.query(Artist).filter(Artist.name == data['artist']).first()
-        artist_id = None
-        album_id = None
-
-        if artist:
-            artist_id = artist.id
-            artist.local_playcount += 1
-
-            album = db.session.query(Album).filter(
-                Album.artist_id == artist_id,
-                Album.name == data['album']
-            ).first()
-
-            if album:
-                album_id = album.id
-                album.local_playcount += 1
-
-        # PG 9.5+: DO NOTHING if duplicate
-        query = insert(Scrobble).values(
-            user_id=session.user_id,
-            token_id=session.token_id,
-            played_at=data.pop('timestamp'),
-            artist_id=artist_id,
-            album_id=album_id,
-            **data
-        ).on_conflict_do_nothing(
-            index_elements=['user_id', 'played_at', 'artist', 'track']
-        )
-        db.session.execute(query)
-        # PG <9.5
-        # scrobble = Scrobble(
-        #     user_id=session.user_id,
-        #     played_at=data.pop('timestamp'),
-        #     artist_id=artist_id,
-        #     **data
-        # )
-        # db.session.add(scrobble)
+        data['user_id'], data['token_id'] = session
+        data['played_at'] = data.pop('timestamp', None)
+        correction_map.apply(data)
+
+    if journal.enabled:
+        journal.append_scrobbles(session[0], session[1], scrobbles)
+        return api_response('OK')
 
+    ingest_scrobbles(scrobbles)
     db.session.commit()
+    playcounts.maybe_flush()
 
     return api_response('OK')
 
@@ -0,0 +1,223 @@
+"""
+Bounded caches with an optional TTL: in-process LRU ones and shared filesystem ones.
+
+Every cache registers itself by name, so it can be sized from the app config
+(`CACHE_<NAME>_SIZE` and `CACHE_<NAME>_TTL`) and its counters can be inspected.
+`LRUCache` is per-process: anything that has to be seen by the other workers must
+either be invalidated explicitly or expire through the TTL. `FilesystemCache` is shared
+by all the workers of a host, at the cost of a file read per lookup.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from collections import OrderedDict
+
+
+caches = OrderedDict()
+
+
+class LRUCache(object):
+    """
+    A thread-safe LRU cache where every entry expires after `ttl` seconds (never if None).
+
+    `None` is a perfectly valid value to store, so negative lookups ("there is no such row")
+    can be cached as well; `get()` tells a miss apart by returning `default`.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        caches[name] = self
+
+    def init_app(self, app):
+        prefix = 'CACHE_{}_'.format(self.name.upper())
+        self.maxsize = app.config.get(prefix + 'SIZE', self.maxsize)
+        self.ttl = app.config.get(prefix + 'TTL', self.ttl)
+        self.clear()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """ Drops every entry whose (key, value) matches the predicate. """
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+        }
+
+
+class FilesystemCache(object):
+    """
+    A cache of pickled values in a directory (`CACHE_<NAME>_PATH`), one file per key.
+
+    When there are more than `maxsize` files, the least recently written ones are removed.
+    The counters are per-process.
+    """
+
+    # How often (in writes) the directory is checked for the size limit
+    prune_every = 100
+
+    def __init__(self, name, path=None, maxsize=1024, ttl=None):
+        self.name = name
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        caches[name] = self
+
+    def init_app(self, app):
+        prefix = 'CACHE_{}_'.format(self.name.upper())
+        self.path = app.config.get(prefix + 'PATH', self.path)
+        self.maxsize = app.config.get(prefix + 'SIZE', self.maxsize)
+        self.ttl = app.config.get(prefix + 'TTL', self.ttl)
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.pickle')
+
+    def get(self, key, default=None):
+        try:
+            with open(self._filename(key), 'rb') as fp:
+                stored_key, value, expires_at = pickle.load(fp)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+
+        if stored_key != key or (expires_at is not None and expires_at < time.time()):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires_at = None if self.ttl is None else time.time() + self.ttl
+        filename = self._filename(key)
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+
+        with open(tmp, 'wb') as fp:
+            pickle.dump((key, value, expires_at), fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, filename)
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def invalidate(self, *keys):
+        for key in keys:
+            try:
+                os.remove(self._filename(key))
+            except OSError:
+                pass
+
+    def prune(self, keep=None):
+        """ Removes the oldest files above `keep` (`maxsize` by default). """
+        keep = self.maxsize if keep is None else keep
+        files = []
+        for entry in os.listdir(self.path):
+            filename = os.path.join(self.path, entry)
+            try:
+                files.append((os.path.getmtime(filename), filename))
+            except OSError:
+                continue
+
+        files.sort()
+        for _, filename in files[:max(0, len(files) - keep)]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def clear(self):
+        self.prune(keep=0)
+
+    def __len__(self):
+        return len(os.listdir(self.path))
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+        }
+
+
+def init_app(app):
+    for cache in caches.values():
+        cache.init_app(app)
@@ -0,0 +1,187 @@
+"""
+Backfill of `artist_id`, `album_id` and `track_id` on the scrobbles written before
+their metadata was downloaded.
+
+`scrobbles` is walked in primary key ranges of `chunk_size` ids. The rows of a range that
+miss an id are resolved in bulk by the same cached resolvers as the ingest, written with
+one `UPDATE ... FROM (VALUES ...)` and committed, so the live ingest never waits for more
+than one short transaction. Between the ranges the job sleeps to stay under `rate` rows/s.
+The last finished id is kept in a checkpoint file, so a killed backfill resumes from there.
+"""
+
+import json
+import os
+import time
+
+from sqlalchemy import func, text
+
+from scrobbler import app, db
+from scrobbler.api.ingest import (
+    bump_generations,
+    resolve_album_ids,
+    resolve_artist_ids,
+    resolve_track_ids,
+)
+from scrobbler.api.playcounts import playcounts
+from scrobbler.models import Album, Artist, Scrobble
+from scrobbler.rollups import daily, unique
+
+
+SELECT_QUERY = '''
+    SELECT id, user_id, artist, album, track, artist_id, album_id, track_id
+    FROM scrobbles
+    WHERE id > :start AND id <= :stop
+      AND (artist_id IS NULL OR track_id IS NULL OR (album_id IS NULL AND album IS NOT NULL))
+'''
+
+UPDATE_QUERY = '''
+    UPDATE scrobbles SET artist_id = v.artist_id, album_id = v.album_id, track_id = v.track_id
+    FROM (VALUES {values}) AS v (id, artist_id, album_id, track_id)
+    WHERE scrobbles.id = v.id
+'''
+
+TRACK_ARTISTS_QUERY = '''
+    UPDATE tracks SET artist_id = a.id
+    FROM (SELECT name, min(id) AS id FROM artists GROUP BY name) AS a
+    WHERE tracks.artist_id IS NULL AND tracks.artist = a.name
+'''
+
+# How often (in seconds) the progress is printed
+PROGRESS_INTERVAL = 5
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)['id']
+    except (IOError, OSError, ValueError, KeyError):
+        return 0
+
+
+def write_checkpoint(path, last_id):
+    with open(path + '.tmp', 'w') as fp:
+        json.dump({'id': last_id}, fp)
+    os.rename(path + '.tmp', path)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+def backfill_chunk(start, stop):
+    """
+    Links the scrobbles with `start < id <= stop` to their artists, albums and tracks.
+    Returns a tuple of (rows examined, rows updated). The caller commits.
+    """
+    rows = db.session.execute(text(SELECT_QUERY), {'start': start, 'stop': stop}).fetchall()
+    if not rows:
+        return (0, 0)
+
+    artist_ids = resolve_artist_ids(row.artist for row in rows if row.artist_id is None)
+    linked_artist_ids = {row.id: row.artist_id or artist_ids.get(row.artist) for row in rows}
+
+    album_ids = resolve_album_ids(
+        (linked_artist_ids[row.id], row.album) for row in rows if row.album_id is None
+    )
+    track_ids = resolve_track_ids(
+        (row.artist, row.track, linked_artist_ids[row.id]) for row in rows if row.track_id is None
+    )
+
+    updates = []
+    for row in rows:
+        artist_id = linked_artist_ids[row.id]
+        album_id = row.album_id or album_ids.get((artist_id, row.album))
+        track_id = row.track_id or track_ids.get((row.artist, row.track))
+
+        if (artist_id, album_id, track_id) != (row.artist_id, row.album_id, row.track_id):
+            updates.append((row, artist_id, album_id, track_id))
+
+    if not updates:
+        return (len(rows), 0)
+
+    values = ', '.join(
+        '(:id_{0}, CAST(:artist_id_{0} AS integer), CAST(:album_id_{0} AS integer), '
+        'CAST(:track_id_{0} AS integer))'.format(i)
+        for i in range(len(updates))
+    )
+    params = {}
+    for i, (row, artist_id, album_id, track_id) in enumerate(updates):
+        params['id_{}'.format(i)] = row.id
+        params['artist_id_{}'.format(i)] = artist_id
+        params['album_id_{}'.format(i)] = album_id
+        params['track_id_{}'.format(i)] = track_id
+
+    db.session.execute(text(UPDATE_QUERY.format(values=values)), params)
+
+    # Keep the data derived from the ids in step. The playcount deltas are only counted
+    # once the chunk commits. The library and the summaries are keyed by the names, and
+    # the exact unique stats count `scrobbles.track_id` directly, so they're left as is.
+    playcounts.add(
+        Artist, (artist_id for row, artist_id, _, _ in updates if artist_id and not row.artist_id)
+    )
+    playcounts.add(
+        Album, (album_id for row, _, album_id, _ in updates if album_id and not row.album_id)
+    )
+
+    new_tracks = [row for row, _, _, track_id in updates if track_id and not row.track_id]
+    if new_tracks:
+        ids = [row.id for row in new_tracks]
+        daily.update_tracks(ids)
+        # The HLL sketches skipped these scrobbles' tracks while `track_id` was NULL
+        unique.refresh(ids)
+        bump_generations({row.user_id for row in new_tracks})
+
+    return (len(rows), len(updates))
+
+
+def backfill_ids(rate=None, chunk_size=10000, checkpoint='backfill_ids.checkpoint', restart=False):
+    rate = rate or app.config.get('BACKFILL_ROWS_PER_SECOND', 5000)
+
+    last_id = 0 if restart else read_checkpoint(checkpoint)
+    max_id = db.session.query(func.max(Scrobble.id)).scalar() or 0
+    db.session.commit()
+
+    if last_id:
+        print('Resuming after id {}.'.format(last_id))
+
+    first_id = last_id
+    started_at = time.time()
+    printed_at = 0
+    examined = updated = 0
+
+    while last_id < max_id:
+        stop = min(last_id + chunk_size, max_id)
+        chunk_examined, chunk_updated = backfill_chunk(last_id, stop)
+        db.session.commit()
+        playcounts.maybe_flush()
+
+        last_id = stop
+        write_checkpoint(checkpoint, last_id)
+        examined += chunk_examined
+        updated += chunk_updated
+
+        # The throttle: never get ahead of `rate` examined rows per second
+        elapsed = time.time() - started_at
+        if examined / float(rate) > elapsed:
+            time.sleep(examined / float(rate) - elapsed)
+
+        now = time.time()
+        if now - printed_at >= PROGRESS_INTERVAL or last_id >= max_id:
+            printed_at = now
+            done = float(last_id - first_id) / (max_id - first_id)
+            eta = (now - started_at) * (1 - done) / done
+            print('id {}/{} ({:.1%}): {} rows examined, {} updated ({:.0f} rows/s), ETA {}'.format(
+                last_id, max_id, done, examined, updated, examined / (now - started_at),
+                format_duration(eta)))
+
+    # The tracks created before their artist's metadata
+    linked = db.session.execute(text(TRACK_ARTISTS_QUERY)).rowcount
+    db.session.commit()
+    playcounts.flush()
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print('Done in {}: {} scrobbles and {} tracks updated.'.format(
+        format_duration(time.time() - started_at), updated, linked))
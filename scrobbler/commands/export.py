@@ -0,0 +1,46 @@
+import datetime
+import io
+import sys
+import time
+
+from scrobbler import db
+from scrobbler.export import CONTENT_TYPES, export
+from scrobbler.models import User
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+def export_scrobbles(username, path, fmt='csv', time_from=None, time_to=None, offset=0):
+    if fmt not in CONTENT_TYPES:
+        print('Unknown format, use one of: {}'.format(', '.join(sorted(CONTENT_TYPES))))
+        return
+
+    user = db.session.query(User).filter(User.username == username).first()
+    if user is None:
+        print('There is no user {!r}.'.format(username))
+        return
+
+    time_from = parse_date(time_from)
+    time_to = parse_date(time_to)
+    if time_to is not None:
+        time_to += datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
+
+    started_at = time.time()
+    chunks = export(fmt, user.id, time_from, time_to, offset)
+
+    if path == '-':
+        fp = sys.stdout
+    else:
+        # Appending makes resuming with --offset continue the same file
+        fp = io.open(path, 'a' if offset else 'w', encoding='utf-8', newline='')
+
+    try:
+        for chunk in chunks:
+            fp.write(chunk)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+
+    print('Done in {:.1f}s.'.format(time.time() - started_at), file=sys.stderr)
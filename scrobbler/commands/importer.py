@@ -0,0 +1,324 @@
+"""
+Bulk import of listening history exports.
+
+Supported formats:
+
+- `lastfm-csv`: Last.fm CSV exports, either headerless `artist,album,track,date`
+  rows (date like `31 Jan 2020 12:34`, UTC) or with a header containing `uts`/`utc_time`;
+- `lastfm-json`: Last.fm JSON exports, i.e. an array of `user.getRecentTracks` pages
+  (or of their tracks);
+- `listenbrainz`: ListenBrainz JSONL dumps, one listen per line.
+
+The file is streamed in batches. Every batch is `COPY`-ed into a temporary staging
+table and merged into `scrobbles` with INSERT ... ON CONFLICT DO NOTHING, so rows
+that already exist (per `scrobbles_unique_idx`) are skipped. After each committed
+batch the number of consumed rows is written to `<path>.checkpoint`, and a killed
+import resumes from there. The user's sequence numbers are assigned once at the end.
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import time
+
+from sqlalchemy import text
+
+from scrobbler import db
+from scrobbler.api.ingest import after_insert
+from scrobbler.api.playcounts import playcounts
+from scrobbler.models import User
+from scrobbler.rollups import sequence
+
+
+STAGING_TABLE = '''
+    CREATE TEMP TABLE IF NOT EXISTS scrobbles_import (
+        played_at timestamp with time zone NOT NULL,
+        artist character varying(255) NOT NULL,
+        track character varying(255) NOT NULL,
+        album character varying(255),
+        length interval NOT NULL,
+        musicbrainz character varying(255)
+    ) ON COMMIT DELETE ROWS
+'''
+
+COPY_QUERY = '''
+    COPY scrobbles_import (played_at, artist, track, album, length, musicbrainz)
+    FROM STDIN WITH (FORMAT csv)
+'''
+
+TRACKS_QUERY = '''
+    INSERT INTO tracks (artist, title, artist_id)
+    SELECT DISTINCT s.artist, s.track, (
+        SELECT id FROM artists WHERE artists.name = s.artist ORDER BY id LIMIT 1
+    )
+    FROM scrobbles_import AS s
+    ON CONFLICT (artist, title) DO NOTHING
+'''
+
+MERGE_QUERY = '''
+    INSERT INTO scrobbles (
+        user_id, created_at, played_at, artist, track, album, length, musicbrainz,
+        artist_id, album_id, track_id
+    )
+    SELECT
+        :user_id, now(), s.played_at, s.artist, s.track, s.album, s.length, s.musicbrainz,
+        artist.id, album.id, track.id
+    FROM scrobbles_import AS s
+    JOIN tracks AS track ON track.artist = s.artist AND track.title = s.track
+    LEFT JOIN LATERAL (
+        SELECT id FROM artists WHERE artists.name = s.artist ORDER BY id LIMIT 1
+    ) AS artist ON true
+    LEFT JOIN LATERAL (
+        SELECT id FROM albums WHERE albums.artist_id = artist.id AND albums.name = s.album
+        ORDER BY id LIMIT 1
+    ) AS album ON true
+    ON CONFLICT (user_id, played_at, artist, track) DO NOTHING
+    RETURNING id, user_id, artist_id, album_id
+'''
+
+
+def _scrobble(uts, artist, track, album=None, length=0, musicbrainz=None):
+    if not uts or not artist or not track:
+        return None
+
+    try:
+        played_at = datetime.datetime.fromtimestamp(int(uts), datetime.timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+    try:
+        length = int(length or 0)
+    except (ValueError, OverflowError):
+        length = 0
+
+    return {
+        'played_at': played_at,
+        'artist': artist[:255],
+        'track': track[:255],
+        'album': (album or None) and album[:255],
+        'length': length,
+        'musicbrainz': musicbrainz or None,
+    }
+
+
+def _lastfm_date(value):
+    try:
+        dt = datetime.datetime.strptime(value.strip(), '%d %b %Y %H:%M')
+    except ValueError:
+        return None
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def read_lastfm_csv(fp):
+    rows = csv.reader(fp)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    columns = [column.strip().lower() for column in header]
+
+    if 'artist' in columns and 'track' in columns:
+        for row in rows:
+            row = dict(zip(columns, row))
+            uts = row.get('uts') or (row.get('utc_time') and _lastfm_date(row['utc_time']))
+            yield _scrobble(uts, row.get('artist'), row.get('track'), row.get('album'),
+                            musicbrainz=row.get('track_mbid'))
+    else:
+        for row in itertools.chain([header], rows):
+            if len(row) < 4:
+                yield None
+                continue
+            artist, album, track, date = row[:4]
+            yield _scrobble(_lastfm_date(date), artist, track, album)
+
+
+def iter_json_array(fp, chunk_size=1024 * 1024):
+    """ Yields the elements of a top-level JSON array without loading the whole document. """
+    decoder = json.JSONDecoder()
+    buf, pos, eof, opened = '', 0, False, False
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buf):
+            if not opened:
+                if buf[pos] != '[':
+                    raise ValueError('Expected a JSON array')
+                opened = True
+                pos += 1
+                continue
+
+            if buf[pos] == ']':
+                return
+
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                yield obj
+                continue
+        elif eof:
+            return
+
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+
+def _text(value):
+    if isinstance(value, dict):
+        return value.get('#text') or value.get('name')
+    return value
+
+
+def read_lastfm_json(fp):
+    for element in iter_json_array(fp):
+        if 'recenttracks' in element:
+            tracks = element['recenttracks'].get('track', [])
+        elif 'track' in element and isinstance(element['track'], list):
+            tracks = element['track']
+        else:
+            tracks = [element]
+
+        for track in tracks:
+            if track.get('@attr', {}).get('nowplaying'):
+                continue
+
+            yield _scrobble(
+                (track.get('date') or {}).get('uts'),
+                _text(track.get('artist')),
+                track.get('name'),
+                _text(track.get('album')),
+                musicbrainz=track.get('mbid'),
+            )
+
+
+def read_listenbrainz(fp):
+    for line in fp:
+        if not line.strip():
+            continue
+
+        listen = json.loads(line)
+        metadata = listen.get('track_metadata', {})
+        info = metadata.get('additional_info') or {}
+
+        length = info.get('duration') or (info.get('duration_ms') or 0) // 1000
+
+        yield _scrobble(
+            listen.get('listened_at'),
+            metadata.get('artist_name'),
+            metadata.get('track_name'),
+            metadata.get('release_name'),
+            length=length,
+            musicbrainz=info.get('recording_mbid'),
+        )
+
+
+READERS = {
+    'lastfm-csv': read_lastfm_csv,
+    'lastfm-json': read_lastfm_json,
+    'listenbrainz': read_listenbrainz,
+}
+
+
+def guess_format(path):
+    if path.endswith('.csv'):
+        return 'lastfm-csv'
+    elif path.endswith('.jsonl') or path.endswith('.ndjson'):
+        return 'listenbrainz'
+    elif path.endswith('.json'):
+        return 'lastfm-json'
+    return None
+
+
+def load_batch(user_id, batch):
+    """ COPYs a batch into the staging table and merges it. Returns the number of new rows. """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in batch:
+        writer.writerow((
+            row['played_at'].isoformat(), row['artist'], row['track'], row['album'],
+            '{} seconds'.format(row['length']), row['musicbrainz'],
+        ))
+    buf.seek(0)
+
+    db.session.execute(text(STAGING_TABLE))
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(COPY_QUERY, buf)
+
+    db.session.execute(text(TRACKS_QUERY))
+    inserted = db.session.execute(text(MERGE_QUERY), {'user_id': user_id}).fetchall()
+    after_insert(inserted, number=False)
+    db.session.commit()
+    playcounts.maybe_flush()
+
+    return len(inserted)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)['rows']
+    except (IOError, OSError, ValueError, KeyError):
+        return 0
+
+
+def write_checkpoint(path, rows):
+    with open(path + '.tmp', 'w') as fp:
+        json.dump({'rows': rows}, fp)
+    os.rename(path + '.tmp', path)
+
+
+def import_scrobbles(username, path, file_format=None, batch_size=10000, restart=False):
+    user = db.session.query(User).filter(User.username == username).first()
+    if user is None:
+        print('There is no user {!r}.'.format(username))
+        return
+
+    file_format = file_format or guess_format(path)
+    if file_format not in READERS:
+        print('Unknown format, use one of: {}'.format(', '.join(sorted(READERS))))
+        return
+
+    checkpoint = path + '.checkpoint'
+    consumed = 0 if restart else read_checkpoint(checkpoint)
+    if consumed:
+        print('Resuming after {} rows.'.format(consumed))
+
+    started_at = time.time()
+    imported = skipped = invalid = 0
+
+    with open(path, encoding='utf-8', newline='' if file_format == 'lastfm-csv' else None) as fp:
+        rows = itertools.islice(READERS[file_format](fp), consumed, None)
+
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+
+            consumed += len(chunk)
+            batch = [row for row in chunk if row is not None]
+            invalid += len(chunk) - len(batch)
+
+            new = load_batch(user.id, batch) if batch else 0
+            imported += new
+            skipped += len(batch) - new
+            write_checkpoint(checkpoint, consumed)
+
+            elapsed = time.time() - started_at
+            print('{} rows read: {} imported, {} duplicates, {} invalid ({:.0f} rows/s)'.format(
+                consumed, imported, skipped, invalid, (imported + skipped) / elapsed))
+
+    playcounts.flush()
+    print('Renumbered {} scrobbles.'.format(sequence.renumber(user.id)))
+    db.session.commit()
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print('Done in {:.1f}s.'.format(time.time() - started_at))
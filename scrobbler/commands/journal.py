@@ -0,0 +1,23 @@
+import time
+
+from scrobbler.api.journal import journal
+
+
+def flush_journal(interval=0):
+    if not journal.enabled:
+        print('The ingest journal is disabled, set INGEST_JOURNAL_PATH first.')
+        return
+
+    while True:
+        started_at = time.time()
+        total = journal.flush()
+
+        if total is None:
+            print('Another flusher is already running.')
+        elif total:
+            print('Flushed {} scrobbles in {:.2f}s'.format(total, time.time() - started_at))
+
+        if not interval:
+            break
+
+        time.sleep(interval)
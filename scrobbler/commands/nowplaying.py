@@ -0,0 +1,17 @@
+import datetime
+
+from scrobbler import db
+from scrobbler.models import NowPlaying
+
+
+def prune_now_playing(keep_days):
+    threshold = datetime.datetime.now() - datetime.timedelta(days=keep_days)
+
+    count = (
+        db.session.query(NowPlaying)
+        .filter(NowPlaying.ends_at < threshold)
+        .delete(synchronize_session=False)
+    )
+    db.session.commit()
+
+    print('Deleted {} now-playing rows.'.format(count))
@@ -0,0 +1,13 @@
+from scrobbler import db
+from scrobbler.api.playcounts import playcounts, recount
+from scrobbler.models import Album, Artist
+
+
+def recount_playcounts():
+    playcounts.flush()
+
+    artists = recount(Artist, 'artist_id')
+    albums = recount(Album, 'album_id')
+    db.session.commit()
+
+    print('Fixed playcounts of {} artists and {} albums.'.format(artists, albums))
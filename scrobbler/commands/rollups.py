@@ -0,0 +1,53 @@
+from scrobbler import db
+from scrobbler.api.ingest import link_tracks
+from scrobbler.models import User
+from scrobbler.rollups import activity, daily, library, sequence, summaries, tags, unique
+
+
+def get_user_id(username):
+    """ Returns the id of the user, None for everyone or False if there's no such user. """
+    if not username:
+        return None
+
+    user = db.session.query(User).filter(User.username == username).first()
+    if user is None:
+        print('There is no user {!r}.'.format(username))
+        return False
+
+    return user.id
+
+
+def rebuild_rollups(username=None):
+    user_id = get_user_id(username)
+    if user_id is False:
+        return
+
+    # The scrobbles written before the `tracks` dictionary have no `track_id` yet
+    where = 's.track_id IS NULL' if user_id is None else 's.track_id IS NULL AND s.user_id = :user_id'
+    linked = link_tracks(where, {'user_id': user_id})
+    if linked:
+        print('Linked {} scrobbles to their tracks.'.format(linked))
+
+    daily.rebuild(user_id)
+    unique.rebuild(user_id)
+    activity.rebuild(user_id)
+    library.rebuild(user_id)
+    summaries.rebuild(user_id)
+    # The tag index is shared by everyone
+    if user_id is None:
+        tags.reindex()
+    tags.rebuild(user_id)
+    db.session.commit()
+
+    print('Rebuilt the rollups of {}.'.format(username or 'all users'))
+
+
+def renumber_scrobbles(username=None):
+    user_id = get_user_id(username)
+    if user_id is False:
+        return
+
+    count = sequence.renumber(user_id)
+    db.session.commit()
+
+    print('Renumbered {} scrobbles of {}.'.format(count, username or 'all users'))
@@ -0,0 +1,61 @@
+"""
+Compression of the larger text responses (HTML, JSON, CSS, JS).
+
+Brotli is used when the client accepts it and the `brotli` package is installed,
+gzip otherwise. Streamed responses (e.g. the exports) are passed through as they are.
+"""
+
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+}
+
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    elif 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+
+def init_app(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+    level = app.config.get('COMPRESS_LEVEL', 6)
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed or
+                response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers):
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = choose_encoding(request.accept_encodings)
+        data = response.get_data()
+        if encoding is None or len(data) < min_size:
+            return response
+
+        if encoding == 'br':
+            data = brotli.compress(data, quality=min(level, 11))
+        else:
+            data = gzip.compress(data, compresslevel=level)
+
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        return response
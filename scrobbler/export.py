@@ -0,0 +1,95 @@
+"""
+Streaming export of a user's scrobbles as CSV or NDJSON.
+
+The rows are read through a server-side cursor in chunks of `CHUNK_SIZE` and formatted
+one by one, so the memory use doesn't depend on the size of the history. The order is
+(played_at, id), so an interrupted export can be resumed with `offset`, the number of
+rows that were already received.
+"""
+
+import csv
+import io
+import json
+
+from scrobbler import db
+from scrobbler.models import Scrobble
+
+
+CHUNK_SIZE = 5000
+BUFFER_SIZE = 64 * 1024
+
+FIELDS = ('played_at', 'artist', 'track', 'album', 'tracknumber', 'length', 'musicbrainz')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_scrobbles(user_id, time_from=None, time_to=None, offset=0):
+    """ Yields tuples of `FIELDS` with the length in seconds and `played_at` as ISO 8601. """
+    query = (
+        db.session.query(*[getattr(Scrobble, field) for field in FIELDS])
+        .filter(Scrobble.user_id == user_id)
+        .order_by(Scrobble.played_at, Scrobble.id)
+    )
+
+    if time_from is not None:
+        query = query.filter(Scrobble.played_at >= time_from)
+    if time_to is not None:
+        query = query.filter(Scrobble.played_at <= time_to)
+    if offset:
+        query = query.offset(offset)
+
+    for played_at, artist, track, album, tracknumber, length, musicbrainz in query.yield_per(CHUNK_SIZE):
+        yield (
+            played_at.isoformat(), artist, track, album, tracknumber,
+            int(length.total_seconds()), musicbrainz,
+        )
+
+
+def to_csv(rows, header=True):
+    """ Yields CSV text in chunks of about `BUFFER_SIZE` characters. """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    if header:
+        writer.writerow(FIELDS)
+
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= BUFFER_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def to_ndjson(rows):
+    """ Yields JSON lines in chunks of about `BUFFER_SIZE` characters. """
+    lines, size = [], 0
+
+    for row in rows:
+        line = json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(lines)
+            lines, size = [], 0
+
+    if lines:
+        yield ''.join(lines)
+
+
+def export(fmt, user_id, time_from=None, time_to=None, offset=0):
+    """ Yields the export as chunks of text. The CSV header is only sent from the start. """
+    rows = iter_scrobbles(user_id, time_from, time_to, offset)
+
+    if fmt == 'csv':
+        return to_csv(rows, header=not offset)
+    elif fmt == 'ndjson':
+        return to_ndjson(rows)
+
+    raise ValueError('Unknown export format: {}'.format(fmt))
@@ -1,15 +1,25 @@
 from scrobbler import db, lastfm
+from scrobbler.api.corrections import corrections
+from scrobbler.api.ingest import bump_generations, invalidate_artist
 from scrobbler.meta.consts import SYNC_META
 from scrobbler.models import Artist
+from scrobbler.rollups import tags
 
 
 def sync(name, method=SYNC_META.INSERT_OR_UPDATE):
-    artist = db.session.query(Artist).filter(Artist.name == name).first()
+    # The oldest row of a name is the one the scrobbles and the tag weights use
+    artist = db.session.query(Artist).filter(Artist.name == name).order_by(Artist.id).first()
     data = lastfm.artist(name)
 
     if not data:
         return False
 
+    data['tags'] = corrections.get().apply_tags(data['tags'])
+
+    old_name = artist.name if artist is not None else None
+    old_tags = artist.tags if artist is not None else None
+    synced = True
+
     if artist is None and SYNC_META(method) in (SYNC_META.INSERT_ONLY, SYNC_META.INSERT_OR_UPDATE):
         artist = Artist(
             name=data['name'],
@@ -25,7 +35,18 @@ def sync(name, method=SYNC_META.INSERT_OR_UPDATE):
         artist.image_url = data['image']
         artist.playcount = data['playcount']
         artist.tags = data['tags']
+    else:
+        synced = False
+
+    if synced:
+        db.session.flush()
+        tags.index_artist(artist)
+        # The tag charts of the artist's listeners are cached by their generations
+        bump_generations(tags.retag(old_name, old_tags, artist.name, artist.tags))
 
     db.session.commit()
 
+    # The ingest path may have cached a negative or an outdated id for these names
+    invalidate_artist(name, data['name'])
+
     return data
@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from sqlalchemy import func
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -48,6 +49,10 @@ class User(db.Model):
     _webui_password = db.Column('webui_password', db.String(128))
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
+    # Bumped whenever the user's scrobbles change, see `scrobbler.webui.results`
+    generation = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # Bumped whenever a token is added or deactivated, see `scrobbler.api.auth`
+    tokens_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     sessions = db.relationship('Session', backref='user')
     tokens = db.relationship(
         'Token',
@@ -100,6 +105,10 @@ class User(db.Model):
 
 class Session(db.Model):
     __tablename__ = 'sessions'
+    __table_args__ = (
+        db.Index('sessions_session_id_idx', 'session_id'),
+        db.Index('sessions_user_id_token_id_idx', 'user_id', 'token_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(32))
@@ -135,14 +144,21 @@ class BaseScrobble(object):
 
 class Scrobble(db.Model, BaseScrobble):
     __tablename__ = 'scrobbles'
+    __table_args__ = (
+        db.Index('scrobbles_user_id_played_at_id_idx', 'user_id', 'played_at', 'id'),
+        db.Index('scrobbles_user_id_seq_idx', 'user_id', 'seq'),
+    )
 
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.now)
     source = db.Column(db.String(255))
     rating = db.Column(db.String(255))
     artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), nullable=True)
     album_id = db.Column(db.Integer, db.ForeignKey('albums.id'), nullable=True)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'), nullable=True)
     token_id = db.Column(db.Integer, db.ForeignKey('tokens.id'), nullable=True)
     token = relationship('Token')
+    # The user's n-th scrobble by `played_at`, see `scrobbler.rollups.sequence`
+    seq = db.Column(db.Integer)
 
     def __repr__(self):
         return "<Scrobble #{id}: {artist} - {track}>".format(
@@ -152,11 +168,120 @@ class Scrobble(db.Model, BaseScrobble):
         )
 
 
+class DailyArtistCount(db.Model):
+    """
+    Scrobbles per (user, day, artist), maintained by `scrobbler.rollups.daily`.
+    """
+    __tablename__ = 'daily_artists'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    artist = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailyTrackCount(db.Model):
+    """
+    Scrobbles per (user, day, track), maintained by `scrobbler.rollups.daily`.
+    """
+    __tablename__ = 'daily_tracks'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ActivityCount(db.Model):
+    """
+    Scrobbles per (user, year, month, weekday, hour, artist), maintained by
+    `scrobbler.rollups.activity`. `artist = ''` holds the totals of all artists.
+    """
+    __tablename__ = 'activity'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    year = db.Column(db.SmallInteger, primary_key=True)
+    month = db.Column(db.SmallInteger, primary_key=True)
+    weekday = db.Column(db.SmallInteger, primary_key=True)
+    hour = db.Column(db.SmallInteger, primary_key=True)
+    artist = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LibraryTrack(db.Model):
+    """
+    Every distinct (artist, track) a user has played, maintained by `scrobbler.rollups.library`.
+    """
+    __tablename__ = 'library'
+    __table_args__ = (
+        db.Index('library_artist_trgm_idx', 'artist',
+                 postgresql_using='gin', postgresql_ops={'artist': 'gin_trgm_ops'}),
+        db.Index('library_track_trgm_idx', 'track',
+                 postgresql_using='gin', postgresql_ops={'track': 'gin_trgm_ops'}),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    artist = db.Column(db.String(255), primary_key=True)
+    track = db.Column(db.String(255), primary_key=True)
+    playcount = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ArtistSummary(db.Model):
+    """
+    Everything the artist page shows about a user's artist, maintained by
+    `scrobbler.rollups.summaries`. `years` is {"2017": count}, `albums` and `tracks`
+    are lists of [name, count], the most played first.
+    """
+    __tablename__ = 'artist_summaries'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    artist = db.Column(db.String(255), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    first_heard = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_heard = db.Column(db.DateTime(timezone=True), nullable=False)
+    years = db.Column(JSONB, nullable=False)
+    albums = db.Column(JSONB, nullable=False)
+    albums_floor = db.Column(db.Integer, nullable=False, default=0)
+    tracks = db.Column(JSONB, nullable=False)
+    stale = db.Column(db.Boolean, nullable=False, default=False)
+
+
+class ArtistTag(db.Model):
+    """
+    An inverted index of `Artist.tags`, maintained by `scrobbler.meta.artist.sync`.
+    """
+    __tablename__ = 'artist_tags'
+    __table_args__ = (
+        db.Index('artist_tags_artist_id_idx', 'artist_id'),
+    )
+
+    tag = db.Column(db.String(255), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True)
+    strength = db.Column(db.Integer, nullable=False)
+
+
+class TagWeight(db.Model):
+    """
+    Scrobbles per (user, month, tag), weighted by the tag strengths of their artists,
+    maintained by `scrobbler.rollups.tags`.
+    """
+    __tablename__ = 'user_tag_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    tag = db.Column(db.String(255), primary_key=True)
+    weight = db.Column(db.Float, nullable=False, default=0)
+
+
 class NowPlaying(db.Model, BaseScrobble):
+    """
+    The track that is being played right now, one row per (user, token).
+    """
     __tablename__ = 'np'
 
     token_id = db.Column(db.Integer, db.ForeignKey('tokens.id'), nullable=True)
     token = relationship('Token')
+    ends_at = db.Column(db.DateTime(timezone=True), nullable=False)
 
     def __repr__(self):
         return "<NP #{id}: {artist} - {track}>".format(
@@ -166,8 +291,19 @@ class NowPlaying(db.Model, BaseScrobble):
         )
 
 
+db.Index(
+    'np_user_id_token_id_idx',
+    NowPlaying.user_id, func.coalesce(NowPlaying.token_id, 0),
+    unique=True,
+)
+db.Index('np_user_id_ends_at_idx', NowPlaying.user_id, NowPlaying.ends_at)
+
+
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('artists_name_idx', 'name'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
@@ -190,6 +326,29 @@ class Artist(db.Model):
         )
 
 
+class Track(db.Model):
+    """
+    A dictionary of every (artist, title) ever scrobbled, so that the scrobbles can be
+    grouped by `track_id` instead of two strings. Filled by the ingest.
+    """
+    __tablename__ = 'tracks'
+    __table_args__ = (
+        db.Index('tracks_artist_title_idx', 'artist', 'title', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    artist = db.Column(db.String(255), nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='SET NULL'), nullable=True)
+
+    def __repr__(self):
+        return "<Track #{id}: {artist} - {title}>".format(
+            id=self.id,
+            artist=self.artist,
+            title=self.title
+        )
+
+
 class Album(db.Model):
     __tablename__ = 'albums'
 
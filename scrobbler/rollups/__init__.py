@@ -0,0 +1,6 @@
+"""
+Aggregates derived from `scrobbles`.
+
+They're kept current by `scrobbler.api.ingest.after_insert()` and can be rebuilt
+from scratch with the `manage.py rebuild_*` commands.
+"""
@@ -0,0 +1,127 @@
+"""
+Weekday × hour activity cube behind the dashboard heat map.
+
+`activity` holds the scrobble counts per (user, year, month, weekday, hour, artist), plus
+the totals of all artists under `artist = ''`. The heat map of an artist (or of everything)
+is loaded as a NumPy array of shape (years, 12, 7, 24), and the year/month filters are
+slices of that array, so changing a filter doesn't have to query anything.
+"""
+
+import numpy
+
+from sqlalchemy import text
+
+from scrobbler import db
+from scrobbler.models import ActivityCount
+
+
+ALL_ARTISTS = ''
+
+UPDATE_QUERY = '''
+    INSERT INTO activity (user_id, year, month, weekday, hour, artist, count)
+    SELECT
+        user_id,
+        extract(year FROM played_at) AS year,
+        extract(month FROM played_at) AS month,
+        extract(isodow FROM played_at) AS weekday,
+        extract(hour FROM played_at) AS hour,
+        coalesce(artist, '') AS artist,
+        count(*)
+    FROM scrobbles
+    WHERE {where}
+    GROUP BY user_id, year, month, weekday, hour, GROUPING SETS ((artist), ())
+    ON CONFLICT (user_id, year, month, weekday, hour, artist)
+    DO UPDATE SET count = activity.count + excluded.count
+'''
+
+MONTHS = '''
+    SELECT DISTINCT user_id, extract(year FROM played_at), extract(month FROM played_at)
+    FROM scrobbles
+    WHERE id = ANY(:ids)
+'''
+
+
+def update(ids):
+    """ Adds the scrobbles with the given ids to the cube. """
+    if not ids:
+        return
+
+    db.session.execute(text(UPDATE_QUERY.format(where='id = ANY(:ids)')), {'ids': list(ids)})
+
+
+def refresh(ids):
+    """ Recomputes the months that contain the scrobbles with the given ids. """
+    if not ids:
+        return
+
+    db.session.execute(text(
+        'DELETE FROM activity WHERE (user_id, year, month) IN ({})'.format(MONTHS)
+    ), {'ids': list(ids)})
+
+    where = '(user_id, extract(year FROM played_at), extract(month FROM played_at)) IN ({})'
+    db.session.execute(text(UPDATE_QUERY.format(where=where.format(MONTHS))), {'ids': list(ids)})
+
+
+def rebuild(user_id=None):
+    query = db.session.query(ActivityCount)
+    if user_id is not None:
+        query = query.filter(ActivityCount.user_id == user_id)
+    query.delete(synchronize_session=False)
+
+    where = 'TRUE' if user_id is None else 'user_id = :user_id'
+    db.session.execute(text(UPDATE_QUERY.format(where=where)), {'user_id': user_id})
+
+
+def load_cube(user_id, artist=ALL_ARTISTS):
+    """
+    Returns a tuple of (first year, counts) where counts is an array of shape
+    (years, 12, 7, 24), or (None, None) if there's nothing.
+    """
+    rows = numpy.array(
+        db.session.query(
+            ActivityCount.year, ActivityCount.month, ActivityCount.weekday,
+            ActivityCount.hour, ActivityCount.count,
+        )
+        .filter(ActivityCount.user_id == user_id, ActivityCount.artist == artist)
+        .all(),
+        dtype=numpy.int64,
+    )
+
+    if not len(rows):
+        return (None, None)
+
+    year_from = int(rows[:, 0].min())
+    years = int(rows[:, 0].max()) - year_from + 1
+
+    counts = numpy.zeros((years, 12, 7, 24), dtype=numpy.int64)
+    counts[rows[:, 0] - year_from, rows[:, 1] - 1, rows[:, 2] - 1, rows[:, 3]] = rows[:, 4]
+
+    return (year_from, counts)
+
+
+def heat_map(cube, year=None, month=None):
+    """
+    Sums a cube from `load_cube()` into a list of (weekday, hour, count), weekday
+    being 1-7 (Monday-Sunday) and hour 1-24, for the non-empty cells only.
+    """
+    year_from, counts = cube
+    if counts is None:
+        return []
+
+    if year is not None:
+        index = year - year_from
+        if not 0 <= index < counts.shape[0]:
+            return []
+        counts = counts[index:index + 1]
+
+    if month is not None:
+        if not 1 <= month <= 12:
+            return []
+        counts = counts[:, month - 1:month]
+
+    per_hour = counts.sum(axis=(0, 1))
+
+    return [
+        (int(weekday) + 1, int(hour) + 1, int(per_hour[weekday, hour]))
+        for weekday, hour in zip(*per_hour.nonzero())
+    ]
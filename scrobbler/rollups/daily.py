@@ -0,0 +1,165 @@
+"""
+Daily per-user artist and track counts, used by the top artists/tracks charts.
+
+A chart covers whole days from the rollups and reads only the partial days at
+the edges of its range (e.g. "last week" starts at the current time) from `scrobbles`.
+Tracks are counted by `track_id`, and their names are only joined for the top rows.
+"""
+
+import datetime
+
+from sqlalchemy import func, select, text, union_all
+
+from scrobbler import db
+from scrobbler.models import DailyArtistCount, DailyTrackCount, Scrobble, Track
+
+
+UPDATE_ARTISTS_QUERY = '''
+    INSERT INTO daily_artists (user_id, day, artist, count)
+    SELECT user_id, played_at::date, artist, count(*)
+    FROM scrobbles
+    WHERE {where}
+    GROUP BY user_id, played_at::date, artist
+    ON CONFLICT (user_id, day, artist) DO UPDATE SET count = daily_artists.count + excluded.count
+'''
+
+UPDATE_TRACKS_QUERY = '''
+    INSERT INTO daily_tracks (user_id, day, track_id, count)
+    SELECT user_id, played_at::date, track_id, count(*)
+    FROM scrobbles
+    WHERE {where} AND track_id IS NOT NULL
+    GROUP BY user_id, played_at::date, track_id
+    ON CONFLICT (user_id, day, track_id) DO UPDATE SET count = daily_tracks.count + excluded.count
+'''
+
+
+def update(ids):
+    """ Adds the scrobbles with the given ids to the rollups. """
+    if not ids:
+        return
+
+    for query in (UPDATE_ARTISTS_QUERY, UPDATE_TRACKS_QUERY):
+        db.session.execute(text(query.format(where='id = ANY(:ids)')), {'ids': list(ids)})
+
+
+def update_tracks(ids):
+    """ Adds the scrobbles with the given ids to `daily_tracks` only, once they have a `track_id`. """
+    if not ids:
+        return
+
+    db.session.execute(text(UPDATE_TRACKS_QUERY.format(where='id = ANY(:ids)')), {'ids': list(ids)})
+
+
+def rebuild(user_id=None):
+    """ Recomputes the rollups of a user (or everyone's) from `scrobbles`. """
+    for model in (DailyArtistCount, DailyTrackCount):
+        query = db.session.query(model)
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        query.delete(synchronize_session=False)
+
+    where = 'TRUE' if user_id is None else 'user_id = :user_id'
+    for query in (UPDATE_ARTISTS_QUERY, UPDATE_TRACKS_QUERY):
+        db.session.execute(text(query.format(where=where)), {'user_id': user_id})
+
+
+def refresh(ids):
+    """
+    Recomputes the days that contain the scrobbles with the given ids,
+    e.g. after their artist or track was renamed in place.
+    """
+    if not ids:
+        return
+
+    days = 'SELECT DISTINCT user_id, played_at::date FROM scrobbles WHERE id = ANY(:ids)'
+
+    for table in ('daily_artists', 'daily_tracks'):
+        db.session.execute(text(
+            'DELETE FROM {} WHERE (user_id, day) IN ({})'.format(table, days)
+        ), {'ids': list(ids)})
+
+    where = '(user_id, played_at::date) IN ({})'.format(days)
+    for query in (UPDATE_ARTISTS_QUERY, UPDATE_TRACKS_QUERY):
+        db.session.execute(text(query.format(where=where)), {'ids': list(ids)})
+
+
+def split_range(time_from, time_to):
+    """
+    Splits an inclusive datetime range into the whole days it covers and the partial days left.
+
+    Returns a tuple of (day_from, day_to, edges) where `edges` is a list of inclusive
+    (datetime, datetime) ranges. `day_from` and `day_to` are None if there are no whole days.
+    """
+    one_day = datetime.timedelta(days=1)
+    one_us = datetime.timedelta(microseconds=1)
+
+    day_from = time_from.date()
+    if time_from > datetime.datetime.combine(day_from, datetime.time()):
+        day_from += one_day
+    day_to = (time_to + one_us).date() - one_day
+
+    if day_from > day_to:
+        return (None, None, [(time_from, time_to)])
+
+    edges = []
+
+    first_midnight = datetime.datetime.combine(day_from, datetime.time())
+    if time_from < first_midnight:
+        edges.append((time_from, first_midnight - one_us))
+
+    last_midnight = datetime.datetime.combine(day_to + one_day, datetime.time())
+    if time_to >= last_midnight:
+        edges.append((last_midnight, time_to))
+
+    return (day_from, day_to, edges)
+
+
+def _chart(rollup, fields, user_id, time_from, time_to, limit):
+    """ Returns the query of the top `limit` rows of (fields..., count) for the range. """
+    day_from, day_to, edges = split_range(time_from, time_to)
+    parts = []
+
+    if day_from is not None:
+        parts.append(
+            select([getattr(rollup, field).label(field) for field in fields] +
+                   [rollup.count.label('count')])
+            .where(rollup.user_id == user_id)
+            .where(rollup.day >= day_from)
+            .where(rollup.day <= day_to)
+        )
+
+    for edge_from, edge_to in edges:
+        columns = [getattr(Scrobble, field) for field in fields]
+        parts.append(
+            select([column.label(field) for column, field in zip(columns, fields)] +
+                   [func.count(Scrobble.id).label('count')])
+            .where(Scrobble.user_id == user_id)
+            .where(Scrobble.played_at >= edge_from)
+            .where(Scrobble.played_at <= edge_to)
+            .group_by(*columns)
+        )
+
+    chart = union_all(*parts).alias('chart')
+    count = func.sum(chart.c.count).label('count')
+
+    return (
+        db.session.query(*([chart.c[field] for field in fields] + [count]))
+        .group_by(*[chart.c[field] for field in fields])
+        .order_by(count.desc())
+        .limit(limit)
+    )
+
+
+def top_artists(user_id, time_from, time_to, limit):
+    return _chart(DailyArtistCount, ('artist',), user_id, time_from, time_to, limit).all()
+
+
+def top_tracks(user_id, time_from, time_to, limit):
+    top = _chart(DailyTrackCount, ('track_id',), user_id, time_from, time_to, limit).subquery('top')
+
+    return (
+        db.session.query(Track.artist.label('artist'), Track.title.label('track'), top.c.count)
+        .join(top, top.c.track_id == Track.id)
+        .order_by(top.c.count.desc(), Track.artist, Track.title)
+        .all()
+    )
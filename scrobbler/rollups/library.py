@@ -0,0 +1,227 @@
+"""
+A user's library: every distinct (artist, track) they have played, with a playcount.
+
+It backs the search, which ranks the matches by trigram similarity (`pg_trgm`) and
+playcount instead of scanning the whole history, and the autocomplete, which looks up
+prefixes in a sorted in-memory index of the library built per user.
+
+The index is read from `library` once and then kept up to date in place with the rows
+the ingest upserts, once their transaction commits. The indexes are per-process, so the
+scrobbles ingested by the other workers only show up when it expires
+(`CACHE_PREFIX_INDEXES_TTL`).
+"""
+
+import heapq
+import threading
+
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+from scrobbler import db
+from scrobbler.cache import LRUCache
+from scrobbler.models import LibraryTrack
+
+
+UPDATE_QUERY = '''
+    INSERT INTO library (user_id, artist, track, playcount)
+    SELECT user_id, artist, track, count(*)
+    FROM scrobbles
+    WHERE {where}
+    GROUP BY user_id, artist, track
+    ON CONFLICT (user_id, artist, track) DO UPDATE SET playcount = library.playcount + excluded.playcount
+'''
+
+SEARCH_ARTISTS_QUERY = '''
+    SELECT artist, sum(playcount) AS playcount, max(similarity(artist, :query)) AS score
+    FROM library
+    WHERE user_id = :user_id AND (artist ILIKE :pattern OR artist % :query)
+    GROUP BY artist
+    ORDER BY score DESC, playcount DESC
+    LIMIT :count
+'''
+
+SEARCH_TRACKS_QUERY = '''
+    SELECT artist, track, playcount, similarity(track, :query) AS score
+    FROM library
+    WHERE user_id = :user_id AND (track ILIKE :pattern OR track % :query)
+    ORDER BY score DESC, playcount DESC
+    LIMIT :count
+'''
+
+# The upserted rows, to update the cached prefix indexes with
+RETURNING = 'RETURNING user_id, artist, track, playcount'
+
+# The key of the upserted, uncommitted library rows in `Session.info`
+SESSION_KEY = 'library'
+
+# User.id -> PrefixIndex
+prefix_indexes = LRUCache('prefix_indexes', maxsize=100, ttl=10 * 60)
+
+
+def create_extension():
+    """
+    Creates the `pg_trgm` extension the search indexes need. Returns False if it can't
+    be created, e.g. before PostgreSQL 13, where only a superuser may create it.
+    """
+    installed = db.session.execute(
+        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    ).first()
+
+    if installed is not None:
+        return True
+
+    try:
+        db.session.execute(text('CREATE EXTENSION pg_trgm'))
+    except DBAPIError:
+        db.session.rollback()
+        return False
+
+    db.session.commit()
+    return True
+
+
+def update(ids):
+    """ Adds the scrobbles with the given ids to the library. """
+    if not ids:
+        return
+
+    query = UPDATE_QUERY.format(where='id = ANY(:ids)') + RETURNING
+    rows = db.session.execute(text(query), {'ids': list(ids)}).fetchall()
+    db.session().info.setdefault(SESSION_KEY, []).extend(rows)
+
+
+def rebuild(user_id=None):
+    query = db.session.query(LibraryTrack)
+    if user_id is not None:
+        query = query.filter(LibraryTrack.user_id == user_id)
+    query.delete(synchronize_session=False)
+
+    where = 'TRUE' if user_id is None else 'user_id = :user_id'
+    db.session.execute(text(UPDATE_QUERY.format(where=where)), {'user_id': user_id})
+
+    if user_id is None:
+        prefix_indexes.clear()
+    else:
+        prefix_indexes.invalidate(user_id)
+
+
+def refresh(ids):
+    """ Rebuilds the libraries of the users of the given scrobbles, e.g. after a rename. """
+    if not ids:
+        return
+
+    user_ids = db.session.execute(
+        text('SELECT DISTINCT user_id FROM scrobbles WHERE id = ANY(:ids)'), {'ids': list(ids)}
+    ).fetchall()
+
+    for user_id, in user_ids:
+        rebuild(user_id)
+
+
+def _like_pattern(query):
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%{}%'.format(escaped)
+
+
+def search(user_id, query, count):
+    """ Returns a tuple of (artists, tracks) matching the query, the best matches first. """
+    params = {'user_id': user_id, 'query': query, 'pattern': _like_pattern(query), 'count': count}
+
+    artists = db.session.execute(text(SEARCH_ARTISTS_QUERY), params).fetchall()
+    tracks = db.session.execute(text(SEARCH_TRACKS_QUERY), params).fetchall()
+
+    return (artists, tracks)
+
+
+def _index_key(entry):
+    artist, track = entry
+    return (artist if track is None else track).casefold()
+
+
+class PrefixIndex(object):
+    """
+    Case-insensitive prefix lookups over the artists and tracks of a library.
+
+    The entries, i.e. (artist, track) and (artist, None) pairs, are kept in a list sorted by
+    their casefolded names, so the entries of a prefix are a contiguous slice found with two
+    binary searches. The playcounts are kept apart, so `set()` only inserts the new entries.
+    """
+
+    def __init__(self, rows=()):
+        self.playcounts = {}
+        artists = Counter()
+
+        for artist, track, playcount in rows:
+            self.playcounts[(artist, track)] = playcount
+            artists[artist] += playcount
+
+        for artist, playcount in artists.items():
+            self.playcounts[(artist, None)] = playcount
+
+        self.entries = sorted(self.playcounts, key=_index_key)
+        self.keys = [_index_key(entry) for entry in self.entries]
+        self._lock = threading.Lock()
+
+    def set(self, artist, track, playcount):
+        """ Sets the playcount of a track and updates its artist's, adding them if they're new. """
+        with self._lock:
+            delta = playcount - self.playcounts.get((artist, track), 0)
+            self._set((artist, track), playcount)
+            self._set((artist, None), self.playcounts.get((artist, None), 0) + delta)
+
+    def _set(self, entry, playcount):
+        if entry not in self.playcounts:
+            key = _index_key(entry)
+            i = bisect_right(self.keys, key)
+            self.keys.insert(i, key)
+            self.entries.insert(i, entry)
+
+        self.playcounts[entry] = playcount
+
+    def lookup(self, prefix, count):
+        """ Returns up to `count` of (artist, track or None, playcount), the most played first. """
+        prefix = prefix.casefold()
+
+        with self._lock:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+            best = heapq.nlargest(count, self.entries[start:end], key=self.playcounts.__getitem__)
+            return [(artist, track, self.playcounts[(artist, track)]) for artist, track in best]
+
+
+def get_prefix_index(user_id):
+    """ Returns the user's `PrefixIndex`, reading their library if it isn't cached. """
+    index = prefix_indexes.get(user_id)
+    if index is not None:
+        return index
+
+    rows = (
+        db.session.query(LibraryTrack.artist, LibraryTrack.track, LibraryTrack.playcount)
+        .filter(LibraryTrack.user_id == user_id)
+        .yield_per(10000)
+    )
+    index = PrefixIndex(rows)
+    prefix_indexes.set(user_id, index)
+    return index
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _after_commit(session):
+    if session.transaction is not None and session.transaction.nested:
+        return  # a SAVEPOINT, the outer transaction may still be rolled back
+
+    for user_id, artist, track, playcount in session.info.pop(SESSION_KEY, ()):
+        index = prefix_indexes.get(user_id)
+        if index is not None:
+            index.set(artist, track, playcount)
+
+
+@event.listens_for(SignallingSession, 'after_transaction_end')
+def _after_transaction_end(session, transaction):
+    # Drops the rows of a transaction that was rolled back or closed without a commit
+    if transaction.parent is None:
+        session.info.pop(SESSION_KEY, None)
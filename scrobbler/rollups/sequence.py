@@ -0,0 +1,102 @@
+"""
+Per-user sequence numbers of the scrobbles (`scrobbles.seq`): 1 for the first track a user
+has ever played, and so on in the order of `played_at`.
+
+New scrobbles usually come after everything the user already has, so numbering them only
+takes an index lookup of the previous scrobble. A late one (e.g. from a player's offline
+cache) renumbers the scrobbles played after it. A bulk import defers the numbering and
+renumbers the user once at the end, see `renumber()`.
+"""
+
+from sqlalchemy import text
+
+from scrobbler import db
+
+
+# Numbers every scrobble of a user played at or after the earliest of the given ones,
+# continuing from the closest numbered scrobble before it plus the unnumbered ones in
+# between (left by a deferred bulk import, or by an upgrade before `renumber()` has run).
+# Relies on the users' rows being locked (see `bump_generations()`), so concurrent
+# submissions of a user are numbered in turn.
+ASSIGN_QUERY = '''
+    WITH new AS (
+        SELECT user_id, min(played_at) AS played_from
+        FROM scrobbles
+        WHERE id = ANY(:ids)
+        GROUP BY user_id
+    ), previous AS (
+        SELECT new.user_id, new.played_from, p.played_at, p.id, p.seq
+        FROM new
+        LEFT JOIN LATERAL (
+            SELECT p.played_at, p.id, p.seq FROM scrobbles AS p
+            WHERE p.user_id = new.user_id AND p.played_at < new.played_from AND p.seq IS NOT NULL
+            ORDER BY p.played_at DESC, p.id DESC
+            LIMIT 1
+        ) AS p ON TRUE
+    ), start AS (
+        SELECT
+            previous.user_id,
+            previous.played_from,
+            coalesce(previous.seq, 0) + (
+                SELECT count(*) FROM scrobbles AS u
+                WHERE u.user_id = previous.user_id AND u.played_at < previous.played_from
+                  AND (previous.id IS NULL OR (u.played_at, u.id) > (previous.played_at, previous.id))
+            ) AS seq
+        FROM previous
+    ), numbered AS (
+        SELECT
+            s.id,
+            start.seq + row_number() OVER (PARTITION BY s.user_id ORDER BY s.played_at, s.id) AS seq
+        FROM start
+        JOIN scrobbles AS s ON s.user_id = start.user_id AND s.played_at >= start.played_from
+    )
+    UPDATE scrobbles SET seq = numbered.seq
+    FROM numbered
+    WHERE scrobbles.id = numbered.id AND scrobbles.seq IS DISTINCT FROM numbered.seq
+'''
+
+RENUMBER_QUERY = '''
+    UPDATE scrobbles SET seq = numbered.seq
+    FROM (
+        SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY played_at, id) AS seq
+        FROM scrobbles
+        WHERE {where}
+    ) AS numbered
+    WHERE scrobbles.id = numbered.id AND scrobbles.seq IS DISTINCT FROM numbered.seq
+'''
+
+MILESTONES_QUERY = '''
+    SELECT seq AS seq_id, played_at, artist, track, album
+    FROM scrobbles
+    WHERE user_id = :user_id AND seq = ANY(:seqs)
+    ORDER BY seq
+'''
+
+
+def assign(ids):
+    """ Numbers the newly inserted scrobbles with the given ids. """
+    if not ids:
+        return
+
+    db.session.execute(text(ASSIGN_QUERY), {'ids': list(ids)})
+
+
+def renumber(user_id=None):
+    """ Renumbers all the scrobbles of a user (or everyone's). Returns the number of changed rows. """
+    where = 'TRUE' if user_id is None else 'user_id = :user_id'
+    result = db.session.execute(text(RENUMBER_QUERY.format(where=where)), {'user_id': user_id})
+    return result.rowcount
+
+
+def milestones(user_id, step):
+    """ Returns every `step`-th scrobble of a user (e.g. #10000, #20000, ...). """
+    last = db.session.execute(
+        text('SELECT max(seq) FROM scrobbles WHERE user_id = :user_id'),
+        {'user_id': user_id},
+    ).scalar()
+
+    if not last or step <= 0:
+        return []
+
+    seqs = list(range(step, last + 1, step))
+    return db.session.execute(text(MILESTONES_QUERY), {'user_id': user_id, 'seqs': seqs}).fetchall()
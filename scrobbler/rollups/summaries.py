@@ -0,0 +1,244 @@
+"""
+Per-(user, artist) summaries for the artist page: the total, first and last heard,
+scrobbles per year and the top albums and tracks, all in one row.
+
+A summary is built the first time its artist page is visited and kept up to date by
+`update()` from then on. The top tracks stay exact, since the new playcounts of the
+submitted tracks come from the library. There's no such table for albums, so a summary
+keeps the `ALBUMS_KEPT` most played ones and `albums_floor`, an upper bound of the
+playcount of any album left out (0 if none is). When the floor gets above the albums
+shown on the page, the summary is marked stale and built again on the next visit.
+
+`build()` and `update()` take a transaction-level advisory lock per (user, artist), so a
+summary built while a submission of the same artist is in flight doesn't miss its
+scrobbles, without the page having to wait for the user's other submissions.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import text, tuple_
+
+from scrobbler import app, db
+from scrobbler.models import ArtistSummary, LibraryTrack
+
+
+ALBUMS_KEPT = 50
+
+# The keys are sorted first, so that two submissions can't deadlock
+LOCK_QUERY = '''
+    SELECT pg_advisory_xact_lock(user_id, key)
+    FROM (
+        SELECT DISTINCT user_id, hashtext(artist) AS key
+        FROM scrobbles
+        WHERE id = ANY(:ids)
+        ORDER BY user_id, key
+    ) AS keys
+'''
+
+NEW_SCROBBLES_QUERY = '''
+    SELECT s.user_id, s.artist, extract(year FROM s.played_at)::integer AS year, s.album,
+           count(*) AS count, min(s.played_at) AS first_heard, max(s.played_at) AS last_heard
+    FROM scrobbles s
+    JOIN artist_summaries a ON a.user_id = s.user_id AND a.artist = s.artist
+    WHERE s.id = ANY(:ids) AND NOT a.stale
+    GROUP BY s.user_id, s.artist, year, s.album
+'''
+
+NEW_PLAYCOUNTS_QUERY = '''
+    SELECT DISTINCT l.user_id, l.artist, l.track, l.playcount
+    FROM scrobbles s
+    JOIN library l ON l.user_id = s.user_id AND l.artist = s.artist AND l.track = s.track
+    WHERE s.id = ANY(:ids)
+'''
+
+YEARS_QUERY = '''
+    SELECT extract(year FROM played_at)::integer AS year, count(*), min(played_at), max(played_at)
+    FROM scrobbles
+    WHERE user_id = :user_id AND artist = :artist
+    GROUP BY year
+'''
+
+ALBUMS_QUERY = '''
+    SELECT album, count(*) AS count
+    FROM scrobbles
+    WHERE user_id = :user_id AND artist = :artist
+    GROUP BY album
+    ORDER BY count DESC
+    LIMIT :limit
+'''
+
+
+def _by_count(pairs):
+    return sorted(pairs, key=lambda pair: pair[1], reverse=True)
+
+
+def merge_albums(albums, floor, counts):
+    """
+    Adds the new scrobbles per album (`counts`) to the `albums` list with its `floor`.
+    Returns the new (albums, floor).
+    """
+    merged = dict(albums)
+    new_floor = floor
+
+    for album, count in counts.items():
+        if album in merged:
+            merged[album] += count
+        elif floor == 0:
+            # Every album is in the list, so this one has no earlier scrobbles
+            merged[album] = count
+        else:
+            new_floor = max(new_floor, floor + count)
+
+    ranked = _by_count(merged.items())
+    for album, count in ranked[ALBUMS_KEPT:]:
+        new_floor = max(new_floor, count)
+
+    return ([list(pair) for pair in ranked[:ALBUMS_KEPT]], new_floor)
+
+
+def merge_tracks(tracks, playcounts, count):
+    """ Updates the `tracks` list with the new playcounts of the given tracks. """
+    merged = dict(tracks)
+    merged.update(playcounts)
+    return [list(pair) for pair in _by_count(merged.items())[:count]]
+
+
+def albums_shown(summary):
+    """ Returns the albums for the page or None if the list can't be trusted anymore. """
+    shown = summary.albums[:app.config['ARTIST_TOP_ALBUMS_COUNT']]
+    if summary.albums_floor and (not shown or shown[-1][1] < summary.albums_floor):
+        return None
+    return shown
+
+
+def update(ids):
+    """ Adds the scrobbles with the given ids to the existing summaries. """
+    if not ids:
+        return
+
+    params = {'ids': list(ids)}
+    db.session.execute(text(LOCK_QUERY), params)
+    rows = db.session.execute(text(NEW_SCROBBLES_QUERY), params).fetchall()
+    if not rows:
+        return
+
+    keys = {(row.user_id, row.artist) for row in rows}
+    summaries = {
+        (summary.user_id, summary.artist): summary
+        for summary in (
+            db.session.query(ArtistSummary)
+            .filter(tuple_(ArtistSummary.user_id, ArtistSummary.artist).in_(keys))
+            .with_for_update()
+        )
+    }
+
+    playcounts = defaultdict(dict)
+    for user_id, artist, track, playcount in db.session.execute(text(NEW_PLAYCOUNTS_QUERY), params):
+        if (user_id, artist) in keys:
+            playcounts[(user_id, artist)][track] = playcount
+
+    years = defaultdict(lambda: defaultdict(int))
+    albums = defaultdict(lambda: defaultdict(int))
+
+    for row in rows:
+        key = (row.user_id, row.artist)
+        summary = summaries.get(key)
+        if summary is None or summary.stale:
+            continue
+
+        summary.total += row.count
+        summary.first_heard = min(summary.first_heard, row.first_heard)
+        summary.last_heard = max(summary.last_heard, row.last_heard)
+        years[key][str(row.year)] += row.count
+        albums[key][row.album] += row.count
+
+    tracks_count = app.config['ARTIST_TOP_TRACKS_COUNT']
+
+    for key, counts in albums.items():
+        summary = summaries[key]
+
+        merged_years = dict(summary.years)
+        for year, count in years[key].items():
+            merged_years[year] = merged_years.get(year, 0) + count
+
+        # New values rather than in-place changes, so the JSONB columns are written
+        summary.years = merged_years
+        summary.albums, summary.albums_floor = merge_albums(
+            summary.albums, summary.albums_floor, counts
+        )
+        summary.tracks = merge_tracks(summary.tracks, playcounts[key], tracks_count)
+
+        if albums_shown(summary) is None:
+            summary.stale = True
+
+
+def build(user_id, artist):
+    """
+    (Re)builds the summary of the user's artist from `scrobbles` and the library.
+    Returns it, or None if the user has never heard the artist. The caller commits.
+    """
+    params = {'user_id': user_id, 'artist': artist}
+    db.session.execute(text('SELECT pg_advisory_xact_lock(:user_id, hashtext(:artist))'), params)
+    years = db.session.execute(text(YEARS_QUERY), params).fetchall()
+
+    summary = db.session.query(ArtistSummary).get((user_id, artist))
+
+    if not years:
+        if summary is not None:
+            db.session.delete(summary)
+        return None
+
+    albums = db.session.execute(text(ALBUMS_QUERY), dict(params, limit=ALBUMS_KEPT + 1)).fetchall()
+    tracks = (
+        db.session.query(LibraryTrack.track, LibraryTrack.playcount)
+        .filter(LibraryTrack.user_id == user_id, LibraryTrack.artist == artist)
+        .order_by(LibraryTrack.playcount.desc())
+        .limit(app.config['ARTIST_TOP_TRACKS_COUNT'])
+        .all()
+    )
+
+    if summary is None:
+        summary = ArtistSummary(user_id=user_id, artist=artist)
+        db.session.add(summary)
+
+    summary.total = sum(row[1] for row in years)
+    summary.first_heard = min(row[2] for row in years)
+    summary.last_heard = max(row[3] for row in years)
+    summary.years = {str(row[0]): row[1] for row in years}
+    summary.albums = [[album, count] for album, count in albums[:ALBUMS_KEPT]]
+    summary.albums_floor = albums[ALBUMS_KEPT][1] if len(albums) > ALBUMS_KEPT else 0
+    summary.tracks = [[track, playcount] for track, playcount in tracks]
+    summary.stale = False
+    return summary
+
+
+def get(user_id, artist):
+    """
+    Returns the summary of the user's artist, building it if it's missing or stale,
+    or None if the user has never heard the artist. The caller commits.
+    """
+    summary = db.session.query(ArtistSummary).get((user_id, artist))
+
+    if summary is None or summary.stale or albums_shown(summary) is None:
+        summary = build(user_id, artist)
+
+    return summary
+
+
+def rebuild(user_id=None):
+    """ Drops the summaries, they're built again as the artist pages are visited. """
+    query = db.session.query(ArtistSummary)
+    if user_id is not None:
+        query = query.filter(ArtistSummary.user_id == user_id)
+    query.delete(synchronize_session=False)
+
+
+def refresh(ids):
+    """ Marks the summaries of the users of the given scrobbles stale, e.g. after a rename. """
+    if not ids:
+        return
+
+    db.session.execute(text('''
+        UPDATE artist_summaries SET stale = TRUE
+        WHERE user_id IN (SELECT DISTINCT user_id FROM scrobbles WHERE id = ANY(:ids))
+    '''), {'ids': list(ids)})
@@ -0,0 +1,149 @@
+"""
+Monthly per-user tag weights for the tag charts: every scrobble adds the Last.fm tag
+strengths of its artist (0-100, from `artist_tags`) divided by 100 to its month.
+
+Artists are matched by name, like the other rollups, so the scrobbles from before
+their metadata was downloaded count as well. A name with several `artists` rows counts
+the tags of the oldest one, the row the ingest links the scrobbles to. When the tags
+of an artist change, `retag()` moves the weights of everyone's scrobbles of the artist.
+"""
+
+from sqlalchemy import text
+
+from scrobbler import db
+from scrobbler.models import ArtistTag, TagWeight
+
+
+UPDATE_QUERY = '''
+    INSERT INTO user_tag_stats (user_id, month, tag, weight)
+    SELECT s.user_id, date_trunc('month', s.played_at)::date, t.tag, sum(t.strength) / 100.0
+    FROM scrobbles s
+    CROSS JOIN LATERAL (SELECT min(id) AS id FROM artists WHERE name = s.artist) AS a
+    JOIN artist_tags t ON t.artist_id = a.id
+    WHERE {where}
+    GROUP BY s.user_id, date_trunc('month', s.played_at)::date, t.tag
+    ON CONFLICT (user_id, month, tag) DO UPDATE SET weight = user_tag_stats.weight + excluded.weight
+'''
+
+RETAG_QUERY = '''
+    INSERT INTO user_tag_stats (user_id, month, tag, weight)
+    SELECT d.user_id, date_trunc('month', d.day)::date, t.tag, sum(d.count) * t.strength / 100.0
+    FROM daily_artists d,
+         unnest(CAST(:tags AS text[]), CAST(:strengths AS integer[])) AS t (tag, strength)
+    WHERE d.artist = :artist
+    GROUP BY d.user_id, date_trunc('month', d.day)::date, t.tag, t.strength
+    ON CONFLICT (user_id, month, tag) DO UPDATE SET weight = user_tag_stats.weight + excluded.weight
+    RETURNING user_id
+'''
+
+CHART_QUERY = '''
+    SELECT tag, sum(weight) AS weight
+    FROM user_tag_stats
+    WHERE user_id = :user_id AND month >= date_trunc('month', CAST(:time_from AS timestamp))
+                             AND month <= :time_to
+    GROUP BY tag
+    HAVING sum(weight) > 0.005
+    ORDER BY weight DESC
+    LIMIT :limit
+'''
+
+
+def index_artist(artist):
+    """ Replaces the `artist_tags` rows of the artist with its current `tags`. """
+    db.session.query(ArtistTag).filter(ArtistTag.artist_id == artist.id).delete(synchronize_session=False)
+
+    for tag, strength in (artist.tags or {}).items():
+        db.session.add(ArtistTag(tag=tag, artist_id=artist.id, strength=strength))
+
+
+def reindex():
+    """ Rebuilds the whole `artist_tags` index from `Artist.tags`. """
+    db.session.query(ArtistTag).delete(synchronize_session=False)
+    db.session.execute(text('''
+        INSERT INTO artist_tags (tag, artist_id, strength)
+        SELECT key, id, value::integer FROM artists, jsonb_each_text(tags)
+        WHERE tags IS NOT NULL AND jsonb_typeof(tags) = 'object'
+    '''))
+
+
+def retag(old_name, old_tags, new_name, new_tags):
+    """
+    Moves the weights of the artist's scrobbles from its old tags to the new ones,
+    e.g. after a metadata sync. The name may have changed as well.
+
+    Returns the ids of the users whose weights changed.
+    """
+    changes = []
+    user_ids = set()
+
+    if old_name is not None and old_tags:
+        changes.append((old_name, {tag: -strength for tag, strength in old_tags.items()}))
+
+    if new_tags:
+        changes.append((new_name, dict(new_tags)))
+
+    if len(changes) == 2 and old_name == new_name:
+        # Only apply the difference, most of the tags usually stay the same
+        deltas = changes[1][1]
+        for tag, strength in changes[0][1].items():
+            deltas[tag] = deltas.get(tag, 0) + strength
+        changes = [(new_name, {tag: delta for tag, delta in deltas.items() if delta})]
+
+    for artist, deltas in changes:
+        if not deltas:
+            continue
+
+        tags = sorted(deltas)
+        user_ids.update(user_id for user_id, in db.session.execute(text(RETAG_QUERY), {
+            'artist': artist,
+            'tags': tags,
+            'strengths': [deltas[tag] for tag in tags],
+        }))
+
+    return user_ids
+
+
+def update(ids):
+    """ Adds the scrobbles with the given ids to the tag weights. """
+    if not ids:
+        return
+
+    db.session.execute(text(UPDATE_QUERY.format(where='s.id = ANY(:ids)')), {'ids': list(ids)})
+
+
+def rebuild(user_id=None):
+    query = db.session.query(TagWeight)
+    if user_id is not None:
+        query = query.filter(TagWeight.user_id == user_id)
+    query.delete(synchronize_session=False)
+
+    where = 'TRUE' if user_id is None else 's.user_id = :user_id'
+    db.session.execute(text(UPDATE_QUERY.format(where=where)), {'user_id': user_id})
+
+
+def refresh(ids):
+    """ Recomputes the months that contain the scrobbles with the given ids, e.g. after a rename. """
+    if not ids:
+        return
+
+    months = '''
+        SELECT DISTINCT user_id, date_trunc('month', played_at)::date
+        FROM scrobbles WHERE id = ANY(:ids)
+    '''
+
+    db.session.execute(text(
+        'DELETE FROM user_tag_stats WHERE (user_id, month) IN ({})'.format(months)
+    ), {'ids': list(ids)})
+
+    where = "(s.user_id, date_trunc('month', s.played_at)::date) IN ({})".format(months)
+    db.session.execute(text(UPDATE_QUERY.format(where=where)), {'ids': list(ids)})
+
+
+def top_tags(user_id, time_from, time_to, limit):
+    """ Returns (tag, weight) rows for the whole months that the range touches. """
+    return db.session.execute(text(CHART_QUERY), {
+        'user_id': user_id,
+        'time_from': time_from,
+        'time_to': time_to,
+        'limit': limit,
+    }).fetchall()
@@ -0,0 +1,168 @@
+"""
+Scrobbles, unique artists and unique tracks per month or year.
+
+By default the stats are computed from `scrobbles` in a single grouped query. With
+`STATS_USE_HLL` enabled they're read from `daily_sketches` instead: per-day HyperLogLog
+sketches of the artists and tracks (see the `hll` extension) that are updated at ingest
+and merged at query time, so the stats are answered without touching `scrobbles`.
+The sketch counts are estimates, within a couple of percent.
+
+The table is only created by `manage.py initdb` with `STATS_USE_HLL` enabled, as it
+needs the extension (https://github.com/citusdata/postgresql-hll) on the server.
+"""
+
+import datetime
+
+from sqlalchemy import text
+
+from scrobbler import app, db
+
+
+BUCKETS = ('month', 'year')
+
+EXACT_QUERY = '''
+    SELECT
+        date_trunc(:bucket, played_at) AS period,
+        count(*),
+        count(DISTINCT artist),
+        count(DISTINCT track_id)
+    FROM scrobbles
+    WHERE user_id = :user_id
+    GROUP BY period
+    ORDER BY period
+'''
+
+SKETCH_QUERY = '''
+    SELECT
+        date_trunc(:bucket, day) AS period,
+        sum(scrobbles),
+        round(hll_cardinality(hll_union_agg(artists))),
+        round(hll_cardinality(hll_union_agg(tracks)))
+    FROM daily_sketches
+    WHERE user_id = :user_id
+    GROUP BY period
+    ORDER BY period
+'''
+
+CREATE_SKETCHES_QUERY = '''
+    CREATE TABLE IF NOT EXISTS daily_sketches (
+        user_id integer NOT NULL REFERENCES users(id),
+        day date NOT NULL,
+        scrobbles integer NOT NULL,
+        artists hll NOT NULL,
+        tracks hll NOT NULL,
+        PRIMARY KEY (user_id, day)
+    )
+'''
+
+UPDATE_SKETCHES_QUERY = '''
+    INSERT INTO daily_sketches (user_id, day, scrobbles, artists, tracks)
+    SELECT
+        user_id,
+        played_at::date,
+        count(*),
+        hll_add_agg(hll_hash_text(artist)),
+        hll_add_agg(hll_hash_integer(track_id))
+    FROM scrobbles
+    WHERE {where}
+    GROUP BY user_id, played_at::date
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        scrobbles = daily_sketches.scrobbles + excluded.scrobbles,
+        artists = hll_union(daily_sketches.artists, excluded.artists),
+        tracks = hll_union(daily_sketches.tracks, excluded.tracks)
+'''
+
+
+def use_sketches():
+    return app.config.get('STATS_USE_HLL', False)
+
+
+def create_sketches():
+    """
+    Creates the `hll` extension and the `daily_sketches` table.
+    Returns False if the extension isn't available on the server.
+    """
+    available = db.session.execute(
+        text("SELECT 1 FROM pg_available_extensions WHERE name = 'hll'")
+    ).first()
+
+    if available is None:
+        return False
+
+    db.session.execute(text('CREATE EXTENSION IF NOT EXISTS hll'))
+    db.session.execute(text(CREATE_SKETCHES_QUERY))
+    return True
+
+
+def update(ids):
+    """ Adds the scrobbles with the given ids to the sketches, if they're enabled. """
+    if not ids or not use_sketches():
+        return
+
+    db.session.execute(text(UPDATE_SKETCHES_QUERY.format(where='id = ANY(:ids)')), {'ids': list(ids)})
+
+
+def rebuild(user_id=None):
+    if not use_sketches():
+        return
+
+    if user_id is None:
+        db.session.execute(text('DELETE FROM daily_sketches'))
+        where = 'TRUE'
+    else:
+        db.session.execute(text('DELETE FROM daily_sketches WHERE user_id = :user_id'), {'user_id': user_id})
+        where = 'user_id = :user_id'
+
+    db.session.execute(text(UPDATE_SKETCHES_QUERY.format(where=where)), {'user_id': user_id})
+
+
+def refresh(ids):
+    """ Recomputes the sketches of the days that contain the scrobbles with the given ids. """
+    if not ids or not use_sketches():
+        return
+
+    days = 'SELECT DISTINCT user_id, played_at::date FROM scrobbles WHERE id = ANY(:ids)'
+
+    db.session.execute(text(
+        'DELETE FROM daily_sketches WHERE (user_id, day) IN ({})'.format(days)
+    ), {'ids': list(ids)})
+
+    where = '(user_id, played_at::date) IN ({})'.format(days)
+    db.session.execute(text(UPDATE_SKETCHES_QUERY.format(where=where)), {'ids': list(ids)})
+
+
+def _fill_months(rows):
+    """ Adds the empty months within the years that have data, like the stats page always showed. """
+    if not rows:
+        return rows
+
+    stats = dict(rows)
+    years = range(rows[0][0].year, rows[-1][0].year + 1)
+    empty = (0, 0, 0)
+
+    return [
+        (period, stats.get(period, empty))
+        for period in (datetime.date(year, month, 1) for year in years for month in range(1, 13))
+    ]
+
+
+def unique_stats(user_id, bucket):
+    """
+    Returns a sorted list of (period, (scrobbles, unique artists, unique tracks)),
+    where period is a `datetime.date` of the first day of the month or year.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError('Unknown bucket: {}'.format(bucket))
+
+    query = SKETCH_QUERY if use_sketches() else EXACT_QUERY
+    rows = [
+        (period.date() if isinstance(period, datetime.datetime) else period,
+         (int(scrobbles), int(artists), int(tracks)))
+        for period, scrobbles, artists, tracks in db.session.execute(
+            text(query), {'user_id': user_id, 'bucket': bucket})
+    ]
+
+    if bucket == 'month':
+        rows = _fill_months(rows)
+
+    return rows
@@ -0,0 +1,97 @@
+"""
+Yearly top artists/tracks with the position changes from the previous year.
+
+All the years are ranked in one query over the daily rollups with
+`rank() OVER (PARTITION BY year ...)`, and the year an artist/track was first heard
+comes from `min(year) OVER (PARTITION BY ...)`, so the position changes are computed
+in a single pass over the rows. Tracks are ranked by `track_id` and their names are
+joined for the charted rows only.
+"""
+
+from sqlalchemy import text
+
+from scrobbler import db
+
+
+CHART_QUERY = '''
+    WITH counts AS (
+        SELECT extract(year FROM day)::integer AS year, {fields}, sum(count)::integer AS count
+        FROM {table}
+        WHERE user_id = :user_id
+        GROUP BY year, {fields}
+    ), ranked AS (
+        SELECT
+            year, {fields}, count,
+            rank() OVER (PARTITION BY year ORDER BY count DESC) AS position,
+            min(year) OVER (PARTITION BY {fields}) AS first_year
+        FROM counts
+    )
+    SELECT r.year, {names}, r.count, r.position, r.first_year
+    FROM ranked r {join}
+    WHERE r.position <= :limit
+    ORDER BY r.year, r.position, {order}
+'''
+
+# chart: (table, ranked field, the joined names and their ORDER BY, join for the names)
+CHARTS = {
+    'artists': ('daily_artists', 'artist', ('r.artist',), ('r.artist',), ''),
+    'tracks': (
+        'daily_tracks', 'track_id',
+        ('t.artist', 't.title AS track'), ('t.artist', 't.title'),
+        'JOIN tracks t ON t.id = r.track_id',
+    ),
+}
+
+
+def yearly_charts(user_id, chart, limit):
+    """
+    Returns a tuple of (charts, position_changes):
+
+    - charts is a sorted list of (year, rows), every year between the first and the last
+      one included; rows have the chart fields, `count` and `position`;
+    - position_changes is {year: {key: change}} where key is the artist name or an
+      (artist, track) tuple and change is the number of positions gained since the
+      previous year or 'new' if it's the first year it was heard at all.
+    """
+    table, field, names, order, join = CHARTS[chart]
+    query = CHART_QUERY.format(
+        table=table, fields=field, names=', '.join(names), order=', '.join(order), join=join)
+    rows = db.session.execute(text(query), {'user_id': user_id, 'limit': limit}).fetchall()
+
+    if len(names) == 1:
+        def get_key(row):
+            return row[1]
+    else:
+        def get_key(row):
+            return tuple(row[1:1 + len(names)])
+
+    charts = []
+    position_changes = {}
+    chart_year, chart_rows, positions = None, [], {}
+    prev_year, prev_positions = None, {}
+
+    for row in rows:
+        if row.year != chart_year:
+            if chart_year is not None:
+                charts.append((chart_year, chart_rows))
+                prev_year, prev_positions = chart_year, positions
+            chart_year, chart_rows, positions = row.year, [], {}
+            position_changes[chart_year] = {}
+
+        key = get_key(row)
+        chart_rows.append(row)
+        positions[key] = row.position
+
+        if prev_year == chart_year - 1 and key in prev_positions:
+            position_changes[chart_year][key] = prev_positions[key] - row.position
+        elif row.first_year == chart_year:
+            position_changes[chart_year][key] = 'new'
+
+    if chart_year is not None:
+        charts.append((chart_year, chart_rows))
+
+    if charts:
+        years = dict(charts)
+        charts = [(year, years.get(year, [])) for year in range(charts[0][0], charts[-1][0] + 1)]
+
+    return (charts, position_changes)
@@ -17,4 +17,26 @@ $(window).load(function() {
   $(".alert-info").fadeTo(2000, 500).slideUp(500, function(){
     $(".alert-info").alert('close');
   });
-});
\ No newline at end of file
+});
+
+$(function() {
+  var input = $('#q');
+  var suggestions = $('#q-suggestions');
+  var lastPrefix = null;
+
+  input.on('input', function() {
+    var prefix = $.trim(input.val());
+    if (!prefix || prefix === lastPrefix) return;
+    lastPrefix = prefix;
+
+    $.getJSON(input.data('autocomplete'), {q: prefix}, function(data) {
+      if (prefix !== lastPrefix) return;
+
+      suggestions.empty();
+      $.each(data.results, function(i, result) {
+        suggestions.append($('<option>').attr('value', result.track || result.artist)
+          .text(result.track ? result.artist + ' – ' + result.track : result.artist));
+      });
+    });
+  });
+});
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import BooleanField, PasswordField, SelectField, StringField, SubmitField
-from wtforms.validators import Required, Optional, Length, EqualTo, Email
+from wtforms.validators import Required, Optional, Length, EqualTo, Email, ValidationError
 
 
 class LoginForm(FlaskForm):
@@ -51,5 +51,11 @@ class CorrectionForm(FlaskForm):
 
     type = SelectField(u'Type', choices=CHOICES, validators=[Required()])
 
+    # Only for the track corrections
+    artist = StringField('Artist')
     old = StringField('Old', validators=[Required()])
     new = StringField('New', validators=[Required()])
+
+    def validate_artist(self, field):
+        if self.type.data == 'track' and not field.data:
+            raise ValidationError('A track correction needs the artist.')
@@ -1,12 +1,14 @@
 import datetime
+import time
 from functools import wraps
 
-from flask import flash, request
+from flask import flash, make_response, request, session
 from flask_login import current_user
 
 from scrobbler import app, db, login_manager, __VERSION__
+from scrobbler.api.helpers import md5
 from scrobbler.webui.consts import PERIODS
-from scrobbler.models import User
+from scrobbler.models import NowPlaying, User
 
 
 def admin_required(func):
@@ -20,6 +22,52 @@ def admin_required(func):
     return decorated_view
 
 
+def conditional(*probes):
+    """
+    Answers 304 Not Modified when the client already has the current version of the page.
+
+    The ETag is derived from the user's `generation`, which changes with every new scrobble
+    and comes with `current_user`, so an unchanged page is answered before the view runs
+    any query. `probes` are callables that return whatever else the page depends on.
+    """
+    def decorator(func):
+        @wraps(func)
+        def decorated_view(*args, **kwargs):
+            # A page with flashed messages must not be reused
+            if not current_user.is_authenticated or session.get('_flashes'):
+                return func(*args, **kwargs)
+
+            parts = [__VERSION__, current_user.id, current_user.generation]
+            parts.extend(probe() for probe in probes)
+            etag = md5(repr(parts))
+
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(func(*args, **kwargs))
+
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_view
+    return decorator
+
+
+def every(seconds):
+    """ A probe that changes every N seconds, for the pages relative to the current time. """
+    return lambda: int(time.time() // seconds)
+
+
+def now_playing():
+    """ A probe for the pages that show the current now-playing track. """
+    return (
+        db.session.query(NowPlaying.id, NowPlaying.played_at)
+        .filter(NowPlaying.user_id == current_user.id, NowPlaying.ends_at >= datetime.datetime.now())
+        .order_by(NowPlaying.ends_at.desc())
+        .first()
+    )
+
+
 @app.context_processor
 def periods():
     return {'PERIODS': PERIODS}
@@ -68,3 +116,22 @@ def range_to_datetime(s_from, s_to):
         dt_to = datetime.datetime.strptime(s_to, '%Y-%m-%d %H:%M:%S')
 
     return (dt_from, dt_to)
+
+
+def encode_cursor(played_at, id):
+    """ A keyset pagination cursor for a (played_at, id) position, e.g. `1485000000000000.42`. """
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    delta = played_at - epoch
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return '{}.{}'.format(microseconds, id)
+
+
+def decode_cursor(cursor):
+    """ Returns a tuple of (played_at, id) or None if the cursor is invalid. """
+    try:
+        microseconds, id = (int(part) for part in cursor.split('.'))
+    except (AttributeError, ValueError):
+        return None
+
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return (epoch + datetime.timedelta(microseconds=microseconds), id)
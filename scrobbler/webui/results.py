@@ -0,0 +1,90 @@
+"""
+Cache of the aggregates behind the webui pages (charts, stats, the artist page).
+
+An entry is keyed by (user, view, parameters) and stamped with the user's
+`generation`, which is bumped whenever their scrobbles change (see
+`scrobbler.api.ingest.bump_generations`). The generation comes with `current_user`,
+so checking for staleness costs nothing: an entry of an older generation is simply
+recomputed and overwritten. The TTL only bounds the pages whose range is relative
+to the current time, e.g. "last 7 days".
+
+`RESULT_CACHE_BACKEND` is 'memory' (per-process LRU), 'filesystem' (shared by the
+workers, in `CACHE_RESULTS_PATH`) or None to disable the cache.
+"""
+
+from flask_login import current_user
+
+from scrobbler.cache import FilesystemCache, LRUCache
+
+
+BACKENDS = {
+    'memory': LRUCache,
+    'filesystem': FilesystemCache,
+}
+
+
+class ResultCache(object):
+    def __init__(self, app=None):
+        self.app = app
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        name = app.config.get('RESULT_CACHE_BACKEND', 'memory')
+
+        if not name:
+            self.backend = None
+            return
+
+        if name not in BACKENDS:
+            raise ValueError('Unknown RESULT_CACHE_BACKEND: {}'.format(name))
+
+        self.backend = BACKENDS[name]('results', maxsize=1000, ttl=10 * 60)
+        self.backend.init_app(app)
+
+    def cached(self, view, params, compute):
+        """
+        Returns the result of `compute()` for the current user's `view` with `params`
+        (a tuple), from the cache if it's there and up to date.
+        """
+        if self.backend is None or not current_user.is_authenticated:
+            return compute()
+
+        key = (current_user.id, view) + tuple(params)
+        generation = current_user.generation
+
+        entry = self.backend.get(key)
+        if entry is not None:
+            if entry[0] == generation:
+                self.hits += 1
+                return entry[1]
+            self.stale += 1
+        else:
+            self.misses += 1
+
+        result = compute()
+        self.backend.set(key, (generation, result))
+        return result
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses + self.stale
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__ if self.backend else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'hit_ratio': self.hit_ratio,
+        }
+
+
+result_cache = ResultCache()
@@ -2,6 +2,7 @@ from scrobbler.webui.views.blueprint import *
 from scrobbler.webui.views.auth import *
 from scrobbler.webui.views.charts import *
 from scrobbler.webui.views.errors import *
+from scrobbler.webui.views.export import *
 from scrobbler.webui.views.index import *
 from scrobbler.webui.views.maintenance import *
 from scrobbler.webui.views.meta import *
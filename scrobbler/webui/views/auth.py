@@ -2,6 +2,7 @@ from flask import abort, flash, redirect, render_template, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 
 from scrobbler import app, db
+from scrobbler.api.auth import bump_tokens_version
 from scrobbler.webui.forms import (
     AddTokenForm,
     ChangeAPIPasswordForm,
@@ -103,6 +104,7 @@ def settings():
             key=form_add_token.data['key']
         )
         db.session.add(token)
+        bump_tokens_version(current_user.id)
         db.session.commit()
         flash("Token has been added.", category='success')
     else:
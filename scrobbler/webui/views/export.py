@@ -0,0 +1,30 @@
+from flask import Response, abort, request, stream_with_context
+from flask_login import current_user, login_required
+
+from scrobbler.export import CONTENT_TYPES, export
+from scrobbler.webui.helpers import get_argument, range_to_datetime
+from scrobbler.webui.views import blueprint
+
+
+@blueprint.route("/export/<fmt>/")
+@login_required
+def export_scrobbles(fmt):
+    if fmt not in CONTENT_TYPES:
+        abort(404)
+
+    time_from, time_to = None, None
+    if request.args.get('from') and request.args.get('to'):
+        try:
+            time_from, time_to = range_to_datetime(request.args['from'], request.args['to'])
+        except ValueError:
+            abort(400)
+
+    offset = max(get_argument('offset'), 0)
+    chunks = export(fmt, current_user.id, time_from, time_to, offset)
+
+    filename = '{}-scrobbles.{}'.format(current_user.username, fmt)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=CONTENT_TYPES[fmt],
+        headers={'Content-Disposition': 'attachment; filename="{}"'.format(filename)},
+    )
@@ -1,8 +1,11 @@
 from flask import abort, flash, redirect, render_template, request, url_for
 from sqlalchemy import desc, func
 
-from scrobbler import db
+from scrobbler import cache, db
+from scrobbler.api.corrections import corrections
+from scrobbler.api.ingest import after_update
 from scrobbler.models import (
+    Artist,
     ArtistCorrection,
     DiffArtists,
     DiffTracks,
@@ -12,6 +15,7 @@ from scrobbler.models import (
 )
 from scrobbler.webui.forms import CorrectionForm
 from scrobbler.webui.helpers import admin_required, get_argument, show_form_errors
+from scrobbler.webui.results import result_cache
 from scrobbler.webui.views import blueprint
 
 
@@ -60,7 +64,9 @@ def maintenance_artist_fix(id, direction):
     for scrobble in scrobbles:
         print('[%d] %s -> %s' % (scrobble.id, scrobble.artist, replace_with))
 
+    ids = [scrobble.id for scrobble in scrobbles]
     scrobbles.update({'artist': replace_with})
+    after_update(ids)
     db.session.delete(diff)
     db.session.commit()
 
@@ -136,7 +142,9 @@ def maintenance_track_fix(id, direction):
     for scrobble in scrobbles:
         print('[%d] %s: %s -> %s' % (scrobble.id, scrobble.artist, scrobble.track, replace_with))
 
+    ids = [scrobble.id for scrobble in scrobbles]
     scrobbles.update({'track': replace_with})
+    after_update(ids)
     db.session.delete(diff)
     db.session.commit()
 
@@ -155,16 +163,26 @@ def maintenance_corrections():
 
     if form.validate_on_submit():
         if form.type.data == 'artist':
-            model = ArtistCorrection
+            obj = ArtistCorrection(old=form.old.data, new=form.new.data)
         elif form.type.data == 'tag':
-            model = TagCorrection
+            obj = TagCorrection(old=form.old.data, new=form.new.data)
         else:
-            flash("Not implemented yet :(", category='error')
-            return render_template('maintenance/corrections.html', **ctx)
+            # Track corrections belong to an artist row, the oldest one of the name
+            artist = (
+                db.session.query(Artist)
+                .filter(Artist.name == form.artist.data)
+                .order_by(Artist.id)
+                .first()
+            )
+            if artist is None:
+                flash("Unknown artist, download its metadata first.", category='error')
+                return redirect(url_for('webui.maintenance_corrections'))
+
+            obj = TrackCorrection(artist_id=artist.id, old=form.old.data, new=form.new.data)
 
-        obj = model(old=form.old.data, new=form.new.data)
         db.session.add(obj)
         db.session.commit()
+        corrections.reload()
 
         flash('Your correction was added, thanks!', category='success')
         return redirect(url_for('webui.maintenance_corrections'))
@@ -185,11 +203,12 @@ def maintenance_corrections():
 def maintenance_corrections_delete(type, id):
     if type == 'artist':
         model = ArtistCorrection
+    elif type == 'track':
+        model = TrackCorrection
     elif type == 'tag':
         model = TagCorrection
     else:
-        flash("Not implemented yet :(", category='error')
-        return redirect(url_for('webui.maintenance_corrections'))
+        abort(404)
 
     correction = db.session.query(model).get(id)
 
@@ -198,5 +217,16 @@ def maintenance_corrections_delete(type, id):
 
     db.session.delete(correction)
     db.session.commit()
+    corrections.reload()
     flash('Correction was deleted.')
     return redirect(url_for('webui.maintenance_corrections'))
+
+
+@blueprint.route("/maintenance/caches/")
+@admin_required
+def maintenance_caches():
+    return render_template(
+        'maintenance/caches.html',
+        caches=[c.stats() for c in cache.caches.values()],
+        results=result_cache.stats(),
+    )
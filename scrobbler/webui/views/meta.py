@@ -1,10 +1,10 @@
-from flask import abort, flash, redirect, render_template, request, url_for
+from flask import abort, flash, jsonify, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
-from sqlalchemy import desc, func
-from sqlalchemy.types import Integer
+from sqlalchemy import desc
 
 from scrobbler import app, db, meta
-from scrobbler.models import Artist, Scrobble
+from scrobbler.models import Artist, ArtistTag
+from scrobbler.rollups import library, summaries
 from scrobbler.webui.helpers import get_argument
 from scrobbler.webui.views import blueprint
 
@@ -26,58 +26,28 @@ def artist(name=None):
     artist = db.session.query(Artist).filter(Artist.name == name).first()
 
     # Stats
-    scrobbles = func.count(Scrobble.id).label('count')
-    first_time = func.min(Scrobble.played_at).label('first_time')
+    summary = summaries.get(current_user.id, name)
+    db.session.commit()
 
-    total_scrobbles, first_time_heard = (
-        db.session.query(scrobbles, first_time)
-        .filter(Scrobble.user_id == current_user.id, Scrobble.artist == name)
-        .order_by(scrobbles.desc()).first()
-    )
-
-    if total_scrobbles == 0:
+    if summary is None:
         abort(404)
 
-    year = func.extract('year', Scrobble.played_at).label('year')
-
-    scrobbles_per_year = (
-        db.session.query(year, scrobbles)
-        .filter(Scrobble.user_id == current_user.id, Scrobble.artist == name)
-        .group_by(Scrobble.artist, 'year')
-        .order_by(year).all()
-    )
-
-    max_scrobbles_per_year = max(x[1] for x in scrobbles_per_year)
-
     # Fill with zeroes if years skipped
-    min_year = min(int(x[0]) for x in scrobbles_per_year)
-    max_year = max(int(x[0]) for x in scrobbles_per_year)
-    scrobbles_per_year = dict(scrobbles_per_year)
-    scrobbles_per_year = {y: scrobbles_per_year.get(y, 0) for y in range(min_year, max_year + 1)}
-    scrobbles_per_year = sorted(scrobbles_per_year.items())
-
-    top_albums = (
-        db.session.query(scrobbles, Scrobble.album)
-        .filter(Scrobble.user_id == current_user.id)
-        .filter(Scrobble.artist == name)
-        .group_by(Scrobble.album)
-        .order_by(scrobbles.desc())
-        .limit(app.config['ARTIST_TOP_ALBUMS_COUNT'])
-        .all()
-    )
-
-    top_tracks = (
-        db.session.query(scrobbles, Scrobble.track)
-        .filter(Scrobble.user_id == current_user.id)
-        .filter(Scrobble.artist == name)
-        .group_by(Scrobble.track)
-        .order_by(scrobbles.desc())
-        .limit(app.config['ARTIST_TOP_TRACKS_COUNT'])
-        .all()
-    )
-
-    max_album_scrobbles = top_albums[0][0]
-    max_track_scrobbles = top_tracks[0][0]
+    years = {int(year): count for year, count in summary.years.items()}
+    scrobbles_per_year = [(year, years.get(year, 0)) for year in range(min(years), max(years) + 1)]
+    max_scrobbles_per_year = max(years.values())
+
+    top_albums = [
+        {'album': album, 'count': count} for album, count in summaries.albums_shown(summary)
+    ]
+    # The tracks come from the library, which is empty until the rollups are rebuilt
+    top_tracks = [
+        {'track': track, 'count': count}
+        for track, count in summary.tracks[:app.config['ARTIST_TOP_TRACKS_COUNT']]
+    ]
+
+    max_album_scrobbles = top_albums[0]['count'] if top_albums else 0
+    max_track_scrobbles = top_tracks[0]['count'] if top_tracks else 0
 
     top_albums = enumerate(top_albums, start=1)
     top_tracks = enumerate(top_tracks, start=1)
@@ -85,7 +55,7 @@ def artist(name=None):
     return render_template(
         'meta/artist.html',
         artist=artist,
-        total=total_scrobbles,
+        total=summary.total,
         top_albums=top_albums,
         top_tracks=top_tracks,
         max_album_scrobbles=max_album_scrobbles,
@@ -112,8 +82,9 @@ def tag(name=None):
     name = name.lower()
 
     top_artists = (
-        db.session.query(Artist.name, Artist.tags[name].cast(Integer).label('strength'), Artist.local_playcount, Artist.playcount)
-        .filter(Artist.tags.has_key(name))
+        db.session.query(Artist.name, ArtistTag.strength.label('strength'), Artist.local_playcount, Artist.playcount)
+        .join(ArtistTag, ArtistTag.artist_id == Artist.id)
+        .filter(ArtistTag.tag == name)
         .order_by(*sort_by)
         .all()
     )
@@ -136,18 +107,7 @@ def search():
     if not search_query:
         abort(404)  # :D
 
-    artists = (
-        db.session.query(Scrobble.artist)
-        .filter(Scrobble.user_id == current_user.id)
-        .filter(Scrobble.artist.ilike('%{}%'.format(search_query))).distinct()
-        .limit(count).all()
-    )
-    tracks = (
-        db.session.query(Scrobble.artist, Scrobble.track)
-        .filter(Scrobble.user_id == current_user.id)
-        .filter(Scrobble.track.ilike('%{}%'.format(search_query))).distinct()
-        .limit(count).all()
-    )
+    artists, tracks = library.search(current_user.id, search_query, count)
 
     if not artists and not tracks:
         abort(404)
@@ -156,3 +116,20 @@ def search():
     tracks = enumerate(tracks, start=1)
 
     return render_template('search.html', artists=artists, tracks=tracks)
+
+
+@blueprint.route("/ajax/autocomplete/")
+@login_required
+def ajax_autocomplete():
+    prefix = request.args.get('q', '').strip()
+    count = min(get_argument('count', default=10), 50)
+
+    if not prefix:
+        return jsonify(results=[])
+
+    index = library.get_prefix_index(current_user.id)
+
+    return jsonify(results=[
+        {'artist': artist, 'track': track, 'playcount': playcount}
+        for artist, track, playcount in index.lookup(prefix, count)
+    ])
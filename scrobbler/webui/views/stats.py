@@ -1,120 +1,147 @@
-import calendar
 import datetime
 
 from json import dumps
 
-from flask import render_template, request
+from flask import abort, jsonify, render_template, request
 from flask_login import current_user, login_required
-from sqlalchemy import func, text
+from sqlalchemy import func, tuple_
 
 from scrobbler import app, db
-from scrobbler.models import NowPlaying, Scrobble
-from scrobbler.webui.helpers import get_argument
+from scrobbler.models import NowPlaying, Scrobble, Token
+from scrobbler.rollups import activity, sequence, unique
+from scrobbler.webui.helpers import (conditional, decode_cursor, encode_cursor, every, get_argument,
+                                     now_playing)
 from scrobbler.webui.consts import PERIODS
+from scrobbler.webui.results import result_cache
 from scrobbler.webui.views import blueprint
 
 
+MAX_PAGE_SIZE = 500
+
+
 @blueprint.route("/ajax/dashboard/per-hour/")
+@conditional()
 def ajax_dashboard_per_hour():
     arg_year = request.args.get('year', 'all')
     arg_month = request.args.get('month', 'all')
     arg_artist = request.args.get('artist', '')
 
-    count = func.count(Scrobble.id).label('count')
-    time = Scrobble.played_at
-    hour = func.extract('hour', time).label('hour')
-    weekday = func.extract('isodow', time).label('weekday')
-    year = func.extract('year', time).label('year')
-    month = func.extract('month', time).label('month')
+    try:
+        year = None if arg_year == 'all' else int(arg_year)
+        month = None if arg_month == 'all' else int(arg_month)
+    except ValueError:
+        return dumps([])
 
-    year_filter = True if arg_year == 'all' else (year == arg_year)
-    month_filter = True if arg_month == 'all' else (month == arg_month)
-    artist_filter = True if arg_artist == '' else (Scrobble.artist == arg_artist)
+    cube = result_cache.cached(
+        'activity', (arg_artist,), lambda: activity.load_cube(current_user.id, arg_artist)
+    )
 
-    per_hour = (
-        db.session.query(weekday, hour, count)
-        .filter(Scrobble.user_id == current_user.id)
-        .filter(year_filter, month_filter, artist_filter)
-        .group_by('weekday', 'hour').all()
+    return dumps(activity.heat_map(cube, year, month))
+
+
+def latest_page(user_id, before, count):
+    """
+    Returns a tuple of (scrobbles, next cursor) for a page of `count` scrobbles played
+    before the `before` cursor (or the latest ones). Every page is a range scan of
+    `scrobbles_user_id_played_at_id_idx`, however far back it is.
+    """
+    query = (
+        db.session.query(
+            Scrobble.id, Scrobble.played_at, Scrobble.artist, Scrobble.track,
+            Token.name.label('token_name'),
+        )
+        .outerjoin(Token, Token.id == Scrobble.token_id)
+        .filter(Scrobble.user_id == user_id)
     )
-    per_hour = [(d, h + 1, v) for d, h, v in per_hour]
-    return dumps(per_hour)
+
+    if before is not None:
+        query = query.filter(tuple_(Scrobble.played_at, Scrobble.id) < tuple_(*before))
+
+    scrobbles = (
+        query
+        .order_by(Scrobble.played_at.desc(), Scrobble.id.desc())
+        .limit(count + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(scrobbles) > count:
+        scrobbles = scrobbles[:count]
+        next_cursor = encode_cursor(scrobbles[-1].played_at, scrobbles[-1].id)
+
+    return (scrobbles, next_cursor)
+
+
+def get_page_params():
+    count = get_argument('count', default=app.config['RESULTS_COUNT'])
+    count = min(max(count, 1), MAX_PAGE_SIZE)
+
+    before = request.args.get('before')
+    if before is None:
+        return (None, count)
+
+    before = decode_cursor(before)
+    if before is None:
+        abort(400)
+
+    return (before, count)
 
 
 @blueprint.route("/latest/")
 @login_required
+# The times are shown relative to now
+@conditional(now_playing, every(60))
 def last_scrobbles():
-    count = get_argument('count', default=app.config['RESULTS_COUNT'])
+    before, count = get_page_params()
+    scrobbles, next_cursor = latest_page(current_user.id, before, count)
+
+    nowplaying = None
+    if before is None:
+        nowplaying = (
+            db.session.query(NowPlaying)
+            .filter(NowPlaying.user_id == current_user.id, NowPlaying.ends_at >= func.now())
+            .order_by(NowPlaying.ends_at.desc())
+            .first()
+        )
 
-    scrobbles = (
-        db.session.query(Scrobble)
-        .filter(Scrobble.user_id == current_user.id)
-        .order_by(Scrobble.played_at.desc())
-        .limit(count)
-        .all()
+    return render_template(
+        'latest.html',
+        scrobbles=scrobbles,
+        nowplaying=nowplaying,
+        next_cursor=next_cursor,
+        count=count,
     )
 
-    nowplaying = (
-        db.session.query(NowPlaying)
-        .filter(NowPlaying.user_id == current_user.id,
-                NowPlaying.played_at + NowPlaying.length >= func.now())
-        .order_by(NowPlaying.played_at.desc())
-        .first()
-    )
 
-    return render_template('latest.html', scrobbles=scrobbles, nowplaying=nowplaying)
+@blueprint.route("/ajax/latest/")
+@login_required
+@conditional(every(60))
+def ajax_latest():
+    before, count = get_page_params()
+    scrobbles, next_cursor = latest_page(current_user.id, before, count)
+
+    return jsonify(
+        scrobbles=[
+            {
+                'id': scrobble.id,
+                'played_at': scrobble.played_at.isoformat(),
+                'artist': scrobble.artist,
+                'track': scrobble.track,
+                'token': scrobble.token_name,
+            }
+            for scrobble in scrobbles
+        ],
+        html=render_template('partials/scrobbles.html', scrobbles=scrobbles),
+        next=next_cursor,
+    )
 
 
 @blueprint.route("/unique/monthly/")
 @login_required
+@conditional()
 def unique_monthly():
-    stats = {}
-
-    col_year = func.extract('year', Scrobble.played_at)
-    year_from, year_to = (
-        db.session.query(func.min(col_year), func.max(col_year))
-        .filter(Scrobble.user_id == current_user.id)
-        .first()
-    )
-
-    if not year_from or not year_to:
-        return render_template('stats/unique.html', stats=stats)
-
-    year_from, year_to = int(year_from), int(year_to)
-
-    for year in range(year_from, year_to + 1):
-        for month in range(1, 13):
-            time_from = datetime.datetime(year, month, 1)
-            time_to = time_from + datetime.timedelta(days=calendar.monthrange(year, month)[1])
-
-            scrobbles = (
-                db.session.query(Scrobble)
-                .filter(Scrobble.user_id == current_user.id)
-                .filter(Scrobble.played_at >= time_from, Scrobble.played_at <= time_to)
-                .count()
-            )
-            unique_artists = (
-                db.session.query(Scrobble.artist)
-                .filter(
-                    Scrobble.user_id == current_user.id,
-                    Scrobble.played_at >= time_from,
-                    Scrobble.played_at <= time_to
-                )
-                .group_by(Scrobble.artist)
-                .count()
-            )
-            unique_tracks = (
-                db.session.query(Scrobble.artist, Scrobble.track)
-                .filter(Scrobble.user_id == current_user.id)
-                .filter(Scrobble.played_at >= time_from, Scrobble.played_at <= time_to)
-                .group_by(Scrobble.artist, Scrobble.track)
-                .count()
-            )
-
-            key = '{:d}-{:02d}'.format(year, month)
-            stats[key] = (scrobbles, unique_artists, unique_tracks)
-
-    stats = sorted(stats.items())
+    rows = result_cache.cached('unique', ('month',), lambda: unique.unique_stats(current_user.id, 'month'))
+    stats = [('{:%Y-%m}'.format(period), counts) for period, counts in rows]
 
     return render_template(
         'stats/unique.html',
@@ -124,51 +151,10 @@ def unique_monthly():
 
 @blueprint.route("/unique/yearly/")
 @login_required
+@conditional()
 def unique_yearly():
-    stats = {}
-
-    col_year = func.extract('year', Scrobble.played_at)
-    year_from, year_to = (
-        db.session.query(func.min(col_year), func.max(col_year))
-        .filter(Scrobble.user_id == current_user.id)
-        .first()
-    )
-
-    if not year_from or not year_to:
-        return render_template('stats/unique.html', stats=stats)
-
-    year_from, year_to = int(year_from), int(year_to)
-
-    for year in range(year_from, year_to + 1):
-        time_from = datetime.datetime(year, 1, 1)
-        time_to = datetime.datetime(year, 12, 31, 23, 59, 59, 999999)
-        # select extract(year from played_at) as year, count(id) from scrobbles group by year;
-        scrobbles = (
-            db.session.query(Scrobble)
-            .filter(Scrobble.user_id == current_user.id)
-            .filter(Scrobble.played_at >= time_from, Scrobble.played_at <= time_to)
-            .count()
-        )
-
-        # select extract(year from played_at) as year, sum(1) from scrobbles group by year, artist;
-        unique_artists = (
-            db.session.query(Scrobble.artist)
-            .filter(Scrobble.user_id == current_user.id)
-            .filter(Scrobble.played_at >= time_from, Scrobble.played_at <= time_to)
-            .group_by(Scrobble.artist)
-            .count()
-        )
-        unique_tracks = (
-            db.session.query(Scrobble.artist, Scrobble.track)
-            .filter(Scrobble.user_id == current_user.id)
-            .filter(Scrobble.played_at >= time_from, Scrobble.played_at <= time_to)
-            .group_by(Scrobble.artist, Scrobble.track)
-            .count()
-        )
-
-        stats[year] = (scrobbles, unique_artists, unique_tracks)
-
-    stats = sorted(stats.items())
+    rows = result_cache.cached('unique', ('year',), lambda: unique.unique_stats(current_user.id, 'year'))
+    stats = [(period.year, counts) for period, counts in rows]
 
     return render_template(
         'stats/unique.html',
@@ -178,11 +164,11 @@ def unique_yearly():
 
 @blueprint.route("/milestones/")
 @login_required
+@conditional(every(60 * 60))
 def milestones():
     step = get_argument('step', default=10000)
 
-    query = text('SELECT * FROM scrobbles_seq WHERE user_id = :user_id AND seq_id % :step = 0')
-    scrobbles = db.engine.execute(query, {'user_id': current_user.id, 'step': step})
+    scrobbles = sequence.milestones(current_user.id, step)
 
     return render_template(
         'stats/milestones.html',
@@ -193,6 +179,7 @@ def milestones():
 @blueprint.route("/dashboard/")
 @blueprint.route("/dashboard/<period>/")
 @login_required
+@conditional()
 def dashboard(period=None):
     period, days = PERIODS.get(period, PERIODS['1w'])
 
@@ -1,5 +1,9 @@
-from scrobbler import app, bcrypt, db, lastfm, login_manager
+from scrobbler import app, bcrypt, cache, compression, db, lastfm, login_manager
+from scrobbler.api.corrections import corrections
+from scrobbler.api.journal import journal
+from scrobbler.api.playcounts import playcounts
 from scrobbler.api.views import blueprint as api_bp
+from scrobbler.webui.results import result_cache
 from scrobbler.webui.views import blueprint as webui_bp
 
 # App config
@@ -22,3 +26,21 @@ login_manager.init_app(app)
 
 # Last.fm API
 lastfm.init_app(app)
+
+# In-process caches
+cache.init_app(app)
+
+# Cached webui results
+result_cache.init_app(app)
+
+# Corrections applied at ingest
+corrections.init_app(app)
+
+# Buffered artist/album playcounts
+playcounts.init_app(app)
+
+# Write-behind ingest journal
+journal.init_app(app)
+
+# Response compression
+compression.init_app(app)
@@ -0,0 +1,114 @@
+import datetime
+
+import pytest
+
+from scrobbler.api.helpers import SubmissionError, parse_scrobble_request
+
+
+def test_no_session():
+    args = {'a[0]': 'Burial', 't[0]': 'Archangel', 'i[0]': '1485000000'}
+    assert parse_scrobble_request(args) == (False, [])
+    assert parse_scrobble_request({'s': ''}) == (False, [])
+
+
+def test_empty_submission():
+    assert parse_scrobble_request({'s': 'abc'}) == ('abc', [])
+
+
+def test_single_item():
+    session_id, scrobbles = parse_scrobble_request({
+        's': 'abc',
+        'a[0]': 'Burial',
+        't[0]': 'Archangel',
+        'i[0]': '1485000000',
+        'b[0]': 'Untrue',
+        'l[0]': '238',
+        'n[0]': '2',
+        'm[0]': '',
+        'o[0]': 'P',
+        'r[0]': '',
+    })
+
+    assert session_id == 'abc'
+    assert scrobbles == [{
+        'artist': 'Burial',
+        'track': 'Archangel',
+        'timestamp': datetime.datetime.fromtimestamp(1485000000),
+        'album': 'Untrue',
+        'length': datetime.timedelta(seconds=238),
+        'tracknumber': '2',
+        'musicbrainz': '',
+        'source': 'P',
+        'rating': '',
+    }]
+
+
+def test_keys_without_index():
+    _, scrobbles = parse_scrobble_request({
+        's': 'abc', 'a': 'Burial', 't': 'Archangel', 'i': '1485000000',
+    })
+    assert [(item['artist'], item['track']) for item in scrobbles] == [('Burial', 'Archangel')]
+
+
+def test_sorted_by_timestamp():
+    _, scrobbles = parse_scrobble_request({
+        's': 'abc',
+        'a[0]': 'Burial', 't[0]': 'Archangel', 'i[0]': '1485000300',
+        'a[1]': 'Burial', 't[1]': 'Near Dark', 'i[1]': '1485000000',
+        'a[2]': 'Burial', 't[2]': 'Ghost Hardware', 'i[2]': '1485000600',
+    })
+    assert [item['track'] for item in scrobbles] == ['Near Dark', 'Archangel', 'Ghost Hardware']
+
+
+def test_index_beyond_precomputed_keys():
+    _, scrobbles = parse_scrobble_request({
+        's': 'abc', 'a[60]': 'Burial', 't[60]': 'Archangel', 'i[60]': '1485000000',
+    })
+    assert len(scrobbles) == 1
+
+
+def test_unknown_keys_are_ignored():
+    _, scrobbles = parse_scrobble_request({
+        's': 'abc',
+        'a[0]': 'Burial', 't[0]': 'Archangel', 'i[0]': '1485000000',
+        'x[0]': 'whatever', 'a[zero]': 'Burial', 'portable': '1',
+    })
+    assert len(scrobbles) == 1
+
+
+def test_empty_length():
+    _, scrobbles = parse_scrobble_request({
+        's': 'abc', 'a[0]': 'Burial', 't[0]': 'Archangel', 'i[0]': '1485000000', 'l[0]': '',
+    })
+    assert scrobbles[0]['length'] == datetime.timedelta(0)
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'t[0]': 'Archangel', 'i[0]': '1485000000'}, 'Item #0 has no artist'),
+    ({'a[0]': 'Burial', 'i[0]': '1485000000'}, 'Item #0 has no track'),
+    ({'a[0]': 'Burial', 't[0]': 'Archangel'}, 'Item #0 has no timestamp'),
+    ({'a[0]': 'Burial', 't[0]': '', 'i[0]': '1485000000'}, 'Item #0 has no track'),
+    ({'a[0]': 'Burial', 't[0]': 'Archangel', 'i[0]': '1485000000', 'b[1]': 'Untrue'},
+     'Item #1 has no artist'),
+])
+def test_missing_fields(args, message):
+    with pytest.raises(SubmissionError) as error:
+        parse_scrobble_request(dict(args, s='abc'))
+    assert str(error.value) == message
+
+
+@pytest.mark.parametrize('args', [
+    {'i[0]': 'yesterday'},
+    {'i[0]': '1485000000', 'l[0]': '3:58'},
+])
+def test_invalid_numbers(args):
+    args = dict({'s': 'abc', 'a[0]': 'Burial', 't[0]': 'Archangel'}, **args)
+    with pytest.raises(SubmissionError):
+        parse_scrobble_request(args)
+
+
+def test_timestamp_out_of_range():
+    with pytest.raises(SubmissionError):
+        parse_scrobble_request({
+            's': 'abc', 'a[0]': 'Burial', 't[0]': 'Archangel', 'i[0]': '9' * 20,
+        })
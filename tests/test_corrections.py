@@ -0,0 +1,88 @@
+from scrobbler.api.corrections import CorrectionMap
+
+
+ARTISTS = [('boc', 'Boards of Canada'), ('Sigur Ros', 'Sigur Rós')]
+TRACKS = [
+    ('Boards of Canada', 'roygbiv', 'Roygbiv'),
+    ('Burial', 'Archangel (original)', 'Archangel'),
+]
+TAGS = [('electronica', 'electronic'), ('idm', 'IDM')]
+
+
+def make_map():
+    return CorrectionMap(ARTISTS, TRACKS, TAGS)
+
+
+def test_len():
+    assert len(make_map()) == 6
+    assert len(CorrectionMap()) == 0
+
+
+def test_exact_hit():
+    data = make_map().apply({'artist': 'Sigur Ros', 'track': 'Hoppípolla'})
+    assert data == {'artist': 'Sigur Rós', 'track': 'Hoppípolla'}
+
+
+def test_casefolded_hit():
+    data = make_map().apply({'artist': 'BOC', 'track': 'ROYGBIV'})
+    assert data == {'artist': 'Boards of Canada', 'track': 'Roygbiv'}
+
+
+def test_track_of_corrected_artist():
+    # The track corrections match the artist's name after its own correction
+    data = make_map().apply({'artist': 'boc', 'track': 'roygbiv'})
+    assert data == {'artist': 'Boards of Canada', 'track': 'Roygbiv'}
+
+
+def test_track_of_other_artist():
+    data = make_map().apply({'artist': 'Autechre', 'track': 'roygbiv'})
+    assert data == {'artist': 'Autechre', 'track': 'roygbiv'}
+
+
+def test_miss():
+    data = {'artist': 'Burial', 'track': 'Near Dark', 'album': 'Untrue'}
+    assert make_map().apply(dict(data)) == data
+
+
+def test_in_place():
+    data = {'artist': 'boc', 'track': 'roygbiv'}
+    assert make_map().apply(data) is data
+    assert data['artist'] == 'Boards of Canada'
+
+
+def test_missing_fields():
+    correction_map = make_map()
+    assert correction_map.apply({'track': 'roygbiv'}) == {'track': 'roygbiv'}
+    assert correction_map.apply({'artist': 'boc'}) == {'artist': 'Boards of Canada'}
+    data = {'artist': '', 'track': 'roygbiv'}
+    assert correction_map.apply(dict(data)) == data
+
+
+def test_empty_map():
+    data = {'artist': 'boc', 'track': 'roygbiv'}
+    assert CorrectionMap().apply(dict(data)) == data
+
+
+def test_exact_before_casefolded():
+    correction_map = CorrectionMap([('boc', 'first'), ('BOC', 'second')])
+    assert correction_map.artist('BOC') == 'second'
+    # The oldest correction wins the casefolded fallback
+    assert correction_map.artist('Boc') == 'first'
+
+
+def test_apply_tags():
+    tags = make_map().apply_tags({'electronica': 50, 'ambient': 30, 'IDM': 20})
+    assert tags == {'electronic': 50, 'ambient': 30, 'IDM': 20}
+
+
+def test_apply_tags_keeps_highest_strength():
+    correction_map = make_map()
+    assert correction_map.apply_tags({'electronica': 90, 'electronic': 80}) == {'electronic': 90}
+    assert correction_map.apply_tags({'electronica': 10, 'electronic': 80}) == {'electronic': 80}
+    assert correction_map.apply_tags({'idm': 40, 'IDM': 60}) == {'IDM': 60}
+
+
+def test_apply_tags_copies():
+    tags = {'electronica': 50}
+    make_map().apply_tags(tags)
+    assert tags == {'electronica': 50}
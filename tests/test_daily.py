@@ -0,0 +1,60 @@
+import datetime
+
+from scrobbler.rollups.daily import split_range
+
+
+def dt(*args):
+    return datetime.datetime(*args)
+
+
+def end_of(*args):
+    return datetime.datetime(*args) + datetime.timedelta(days=1, microseconds=-1)
+
+
+def test_whole_days():
+    assert split_range(dt(2017, 1, 1), end_of(2017, 1, 3)) == (
+        datetime.date(2017, 1, 1), datetime.date(2017, 1, 3), [],
+    )
+
+
+def test_single_whole_day():
+    assert split_range(dt(2017, 1, 1), end_of(2017, 1, 1)) == (
+        datetime.date(2017, 1, 1), datetime.date(2017, 1, 1), [],
+    )
+
+
+def test_partial_days_at_both_ends():
+    assert split_range(dt(2017, 1, 1, 12), dt(2017, 1, 3, 6)) == (
+        datetime.date(2017, 1, 2),
+        datetime.date(2017, 1, 2),
+        [(dt(2017, 1, 1, 12), end_of(2017, 1, 1)), (dt(2017, 1, 3), dt(2017, 1, 3, 6))],
+    )
+
+
+def test_partial_first_day():
+    assert split_range(dt(2017, 1, 1, 0, 0, 1), end_of(2017, 1, 3)) == (
+        datetime.date(2017, 1, 2),
+        datetime.date(2017, 1, 3),
+        [(dt(2017, 1, 1, 0, 0, 1), end_of(2017, 1, 1))],
+    )
+
+
+def test_ends_at_midnight():
+    # The midnight itself belongs to the next day, which isn't whole
+    assert split_range(dt(2017, 1, 1), dt(2017, 1, 2)) == (
+        datetime.date(2017, 1, 1),
+        datetime.date(2017, 1, 1),
+        [(dt(2017, 1, 2), dt(2017, 1, 2))],
+    )
+
+
+def test_within_one_day():
+    assert split_range(dt(2017, 1, 1, 10), dt(2017, 1, 1, 11)) == (
+        None, None, [(dt(2017, 1, 1, 10), dt(2017, 1, 1, 11))],
+    )
+
+
+def test_across_midnight_without_whole_days():
+    assert split_range(dt(2017, 1, 1, 22), dt(2017, 1, 2, 2)) == (
+        None, None, [(dt(2017, 1, 1, 22), dt(2017, 1, 2, 2))],
+    )
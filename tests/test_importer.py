@@ -0,0 +1,58 @@
+import datetime
+import io
+
+from scrobbler.commands.importer import read_lastfm_csv, read_lastfm_json, read_listenbrainz
+
+
+PLAYED_AT = datetime.datetime(2017, 1, 21, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_lastfm_csv_with_header():
+    fp = io.StringIO('uts,artist,album,track\n1485000000,Burial,Untrue,Archangel\n')
+    assert list(read_lastfm_csv(fp)) == [{
+        'played_at': PLAYED_AT,
+        'artist': 'Burial',
+        'track': 'Archangel',
+        'album': 'Untrue',
+        'length': 0,
+        'musicbrainz': None,
+    }]
+
+
+def test_lastfm_csv_without_header():
+    fp = io.StringIO('Burial,Untrue,Archangel,21 Jan 2017 12:00\nBurial,Untrue\n')
+    rows = list(read_lastfm_csv(fp))
+    assert [row and row['played_at'] for row in rows] == [PLAYED_AT, None]
+
+
+def test_invalid_timestamp():
+    fp = io.StringIO(
+        'uts,artist,track\n'
+        'yesterday,Burial,Near Dark\n'
+        '1485000000,Burial,Archangel\n'
+        '{},Burial,Ghost Hardware\n'.format('9' * 30)
+    )
+    rows = list(read_lastfm_csv(fp))
+    assert [row and row['track'] for row in rows] == [None, 'Archangel', None]
+
+
+def test_lastfm_json():
+    fp = io.StringIO('''[{"recenttracks": {"track": [
+        {"artist": {"#text": "Burial"}, "name": "Archangel", "album": {"#text": ""},
+         "date": {"uts": "1485000000"}},
+        {"artist": {"#text": "Burial"}, "name": "Near Dark", "@attr": {"nowplaying": "true"}},
+        {"artist": {"#text": "Burial"}, "name": "Ghost Hardware", "date": {"uts": "x"}}
+    ]}}]''')
+    rows = list(read_lastfm_json(fp))
+    assert [row and (row['track'], row['album']) for row in rows] == [('Archangel', None), None]
+
+
+def test_listenbrainz_length():
+    fp = io.StringIO(
+        '{"listened_at": 1485000000, "track_metadata": {"artist_name": "Burial",'
+        ' "track_name": "Archangel", "additional_info": {"duration_ms": 238000}}}\n'
+        '\n'
+        '{"listened_at": 1485000300, "track_metadata": {"artist_name": "Burial",'
+        ' "track_name": "Near Dark", "additional_info": {"duration": "3:50"}}}\n'
+    )
+    assert [row['length'] for row in read_listenbrainz(fp)] == [238, 0]
@@ -0,0 +1,83 @@
+import datetime
+
+from scrobbler.api.journal import Journal, decode_item, decode_record, encode_item, encode_record
+
+
+ITEM = {
+    'artist': 'Boards of Canada',
+    'track': 'Roygbiv',
+    'album': None,
+    'played_at': datetime.datetime(2017, 1, 21, 12, 34, 56),
+    'length': datetime.timedelta(seconds=151),
+}
+
+
+def test_record_round_trip():
+    data = {
+        'user_id': 1,
+        'token_id': None,
+        'items': [{'artist': 'Кино', 'track': 'Группа крови'}],
+    }
+    line = encode_record('scrobbles', data)
+
+    assert line.endswith(b'\n')
+    assert line.count(b'\n') == 1
+    assert decode_record(line) == ('scrobbles', data)
+
+
+def test_record_without_newline():
+    line = encode_record('np', {'artist': 'Burial'})
+    assert decode_record(line.rstrip(b'\n')) == ('np', {'artist': 'Burial'})
+
+
+def test_corrupt_record():
+    line = encode_record('np', {'artist': 'Burial'})
+    assert decode_record(line.replace(b'Burial', b'Bur1al')) is None
+
+
+def test_torn_record():
+    line = encode_record('np', {'artist': 'Burial'})
+    assert decode_record(line[:len(line) // 2]) is None
+
+
+def test_garbage():
+    assert decode_record(b'') is None
+    assert decode_record(b'\n') is None
+    assert decode_record(b'\xff\xfe\xfd') is None
+    assert decode_record(b'zzzzzzzz {}\n') is None
+
+
+def test_item_round_trip():
+    line = encode_record('np', encode_item(ITEM))
+    kind, data = decode_record(line)
+
+    assert kind == 'np'
+    assert decode_item(data) == ITEM
+
+
+def test_item_without_times():
+    item = {'artist': 'Burial', 'played_at': None, 'length': None}
+    assert decode_item(encode_item(item)) == item
+
+
+def test_encode_item_copies():
+    item = dict(ITEM)
+    encode_item(item)
+    assert item == ITEM
+
+
+def test_quarantine(tmpdir):
+    journal = Journal()
+    journal.path = str(tmpdir)
+
+    journal.quarantine('scrobbles', dict(ITEM, user_id=1, token_id=2))
+    journal.quarantine('np', dict(ITEM, user_id=1, token_id=None))
+
+    records = list(journal.read_segment(str(tmpdir.join('quarantine.log'))))
+
+    assert [kind for kind, _ in records] == ['scrobbles', 'np']
+
+    scrobbles = records[0][1]
+    assert (scrobbles['user_id'], scrobbles['token_id']) == (1, 2)
+    assert decode_item(scrobbles['items'][0])['played_at'] == ITEM['played_at']
+    assert decode_item(records[1][1])['length'] == ITEM['length']
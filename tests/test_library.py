@@ -0,0 +1,86 @@
+from scrobbler.rollups.library import PrefixIndex
+
+
+ROWS = [
+    ('Boards of Canada', 'Roygbiv', 10),
+    ('Boards of Canada', 'Dayvan Cowboy', 5),
+    ('Bonobo', 'Kerala', 7),
+    ('Burial', 'Archangel', 3),
+    ('Burial', 'Raw Sienna', 1),
+]
+
+
+def test_artists_by_prefix():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('bo', 10) == [('Boards of Canada', None, 15), ('Bonobo', None, 7)]
+
+
+def test_most_played_first():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('b', 2) == [('Boards of Canada', None, 15), ('Bonobo', None, 7)]
+
+
+def test_tracks_by_prefix():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('r', 10) == [
+        ('Boards of Canada', 'Roygbiv', 10),
+        ('Burial', 'Raw Sienna', 1),
+    ]
+
+
+def test_case_insensitive():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('BURIAL', 10) == [('Burial', None, 4)]
+    assert index.lookup('dAYVAN c', 10) == [('Boards of Canada', 'Dayvan Cowboy', 5)]
+
+
+def test_whole_name_is_a_prefix():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('kerala', 10) == [('Bonobo', 'Kerala', 7)]
+
+
+def test_no_match():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('x', 10) == []
+    assert index.lookup('kerala!', 10) == []
+    assert index.lookup('zzz', 10) == []
+
+
+def test_empty_prefix():
+    index = PrefixIndex(ROWS)
+    assert index.lookup('', 3) == [
+        ('Boards of Canada', None, 15),
+        ('Boards of Canada', 'Roygbiv', 10),
+        ('Bonobo', None, 7),
+    ]
+
+
+def test_empty_library():
+    assert PrefixIndex([]).lookup('b', 10) == []
+
+
+def test_set_known_track():
+    index = PrefixIndex(ROWS)
+    index.set('Burial', 'Raw Sienna', 20)
+    assert index.lookup('r', 10) == [
+        ('Burial', 'Raw Sienna', 20),
+        ('Boards of Canada', 'Roygbiv', 10),
+    ]
+    assert index.lookup('burial', 10) == [('Burial', None, 23)]
+
+
+def test_set_new_track_and_artist():
+    index = PrefixIndex(ROWS)
+    index.set('Burial', 'Near Dark', 2)
+    index.set('Autechre', 'Rae', 1)
+    assert index.lookup('n', 10) == [('Burial', 'Near Dark', 2)]
+    assert index.lookup('burial', 10) == [('Burial', None, 6)]
+    assert index.lookup('ra', 10) == [('Autechre', 'Rae', 1), ('Burial', 'Raw Sienna', 1)]
+    assert index.lookup('a', 10) == [('Burial', 'Archangel', 3), ('Autechre', None, 1)]
+
+
+def test_set_track_named_like_its_artist():
+    index = PrefixIndex()
+    index.set('Burial', 'Burial', 3)
+    index.set('Burial', 'Archangel', 1)
+    assert index.lookup('bur', 10) == [('Burial', None, 4), ('Burial', 'Burial', 3)]
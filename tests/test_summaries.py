@@ -0,0 +1,72 @@
+import pytest
+
+from scrobbler import app
+from scrobbler.models import ArtistSummary
+from scrobbler.rollups import summaries
+from scrobbler.rollups.summaries import albums_shown, merge_albums, merge_tracks
+
+
+@pytest.fixture
+def albums_kept(monkeypatch):
+    monkeypatch.setattr(summaries, 'ALBUMS_KEPT', 3)
+
+
+def test_merge_existing_albums():
+    albums, floor = merge_albums([['Untrue', 5], ['Burial', 3]], 0, {'Burial': 4})
+    assert (albums, floor) == ([['Burial', 7], ['Untrue', 5]], 0)
+
+
+def test_merge_new_album_without_floor():
+    # Every album is in the list, so a new one has no earlier scrobbles
+    albums, floor = merge_albums([['Untrue', 5]], 0, {'Kindred': 2})
+    assert (albums, floor) == ([['Untrue', 5], ['Kindred', 2]], 0)
+
+
+def test_merge_unknown_album_raises_floor():
+    # The album may have been left out with up to `floor` scrobbles already
+    albums, floor = merge_albums([['Untrue', 10]], 2, {'Kindred': 3})
+    assert (albums, floor) == ([['Untrue', 10]], 5)
+
+
+def test_merge_keeps_highest_floor():
+    albums, floor = merge_albums([['Untrue', 10]], 4, {'Kindred': 1, 'Rival Dealer': 2})
+    assert (albums, floor) == ([['Untrue', 10]], 6)
+
+
+def test_merge_drops_albums_beyond_kept(albums_kept):
+    albums, floor = merge_albums([['a', 5], ['b', 4], ['c', 3]], 0, {'d': 2, 'b': 2})
+    assert (albums, floor) == ([['b', 6], ['a', 5], ['c', 3]], 2)
+
+
+def test_merge_rounds(albums_kept):
+    albums, floor = merge_albums([['a', 5], ['b', 4]], 0, {'c': 3, None: 2})
+    assert (albums, floor) == ([['a', 5], ['b', 4], ['c', 3]], 2)
+
+    albums, floor = merge_albums(albums, floor, {'a': 1, None: 1})
+    assert (albums, floor) == ([['a', 6], ['b', 4], ['c', 3]], 3)
+
+    # An album missing from the list may have been left out before, so only the floor grows
+    albums, floor = merge_albums(albums, floor, {None: 10})
+    assert (albums, floor) == ([['a', 6], ['b', 4], ['c', 3]], 13)
+
+
+def test_merge_tracks():
+    tracks = [['Archangel', 5], ['Near Dark', 3]]
+    playcounts = {'Near Dark': 6, 'Etched Headplate': 1}
+    assert merge_tracks(tracks, playcounts, 2) == [['Near Dark', 6], ['Archangel', 5]]
+
+
+def test_merge_tracks_without_playcounts():
+    assert merge_tracks([['Archangel', 5]], {}, 10) == [['Archangel', 5]]
+
+
+@pytest.mark.parametrize('albums, floor, shown', [
+    ([['Untrue', 10], ['Burial', 5], ['Kindred', 1]], 0, [['Untrue', 10], ['Burial', 5]]),
+    ([['Untrue', 10], ['Burial', 5], ['Kindred', 1]], 5, [['Untrue', 10], ['Burial', 5]]),
+    ([['Untrue', 10], ['Burial', 5], ['Kindred', 1]], 6, None),
+    ([], 0, []),
+    ([], 1, None),
+])
+def test_albums_shown(monkeypatch, albums, floor, shown):
+    monkeypatch.setitem(app.config, 'ARTIST_TOP_ALBUMS_COUNT', 2)
+    assert albums_shown(ArtistSummary(albums=albums, albums_floor=floor)) == shown
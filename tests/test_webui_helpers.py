@@ -0,0 +1,38 @@
+import datetime
+
+import pytest
+
+from scrobbler.webui.helpers import decode_cursor, encode_cursor
+
+
+UTC = datetime.timezone.utc
+
+
+def test_encode_cursor():
+    played_at = datetime.datetime(2017, 1, 21, 12, 0, tzinfo=UTC)
+    assert encode_cursor(played_at, 42) == '1485000000000000.42'
+
+
+def test_cursor_round_trip():
+    played_at = datetime.datetime(2017, 1, 21, 12, 34, 56, 789012, tzinfo=UTC)
+    assert decode_cursor(encode_cursor(played_at, 42)) == (played_at, 42)
+
+
+def test_cursor_of_other_timezone():
+    moscow = datetime.timezone(datetime.timedelta(hours=3))
+    played_at = datetime.datetime(2017, 1, 21, 15, 0, tzinfo=moscow)
+
+    assert encode_cursor(played_at, 1) == '1485000000000000.1'
+    assert decode_cursor(encode_cursor(played_at, 1)) == (played_at, 1)
+
+
+def test_cursor_before_epoch():
+    played_at = datetime.datetime(1969, 12, 31, 23, 59, 59, 500000, tzinfo=UTC)
+    assert decode_cursor(encode_cursor(played_at, 7)) == (played_at, 7)
+
+
+@pytest.mark.parametrize('cursor', [
+    None, '', 'abc', '1485000000000000', '1.2.3', '1485000000000000.x',
+])
+def test_invalid_cursor(cursor):
+    assert decode_cursor(cursor) is None